@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+"""
+Sparse cubes of joint cell counts across annotation dimensions.
+
+A `Cube` holds the number of cells for every combination of labels that
+occurs in a dataset, e.g. (cell type, tissue, disease, assay), in coordinate
+form: one row of label indices per non-empty cell of the cube and its count.
+Labels are ontology term IDs where the obs values map to terms, and the raw
+value otherwise; cells missing a value are counted under the empty label.
+
+Cubes are written by `populate_schema.py --cube` (one per dataset), summed
+across datasets with `cube.py merge` and queried with `cube.py query`:
+
+    cube.py merge lung.cube.npz heart.cube.npz -o atlas.cube.npz
+    cube.py query atlas.cube.npz --where cell_type=CL:0000084 tissue=UBERON:0002048
+    cube.py query atlas.cube.npz --where cell_type=CL:0000084 --group-by disease
+
+Rows are kept sorted by their linearized coordinates, so a query fixing every
+dimension is a binary search and partial queries scan one vectorized mask.
+"""
+
+import argparse
+import logging
+import sys
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DESCRIPTION = "Merge and query cubes of joint cell counts"
+
+# Label of cells with a missing value
+MISSING_LABEL = ""
+
+
+def _linear_keys(coords: np.ndarray, sizes: Sequence[int]) -> Optional[np.ndarray]:
+    """Linearize coordinates in row-major order, or None if the cube is too large for int64 keys."""
+    if np.prod([max(s, 1) for s in sizes], dtype=float) >= 2 ** 62:
+        return None
+    keys = np.zeros(len(coords), dtype=np.int64)
+    for i, size in enumerate(sizes):
+        keys *= size
+        keys += coords[:, i]
+    return keys
+
+
+# Largest dense cube counted with a bincount instead of sorting the keys
+_MAX_DENSE_SIZE = 1 << 24
+
+
+def _aggregate(coords: np.ndarray, counts: np.ndarray, sizes: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Sum the counts of duplicate coordinates and sort the rows, dropping empty ones."""
+    keys = _linear_keys(coords, sizes)
+    size = int(np.prod(sizes, dtype=np.int64))
+    if keys is not None and size <= _MAX_DENSE_SIZE:
+        summed = np.bincount(keys, weights=counts, minlength=size).astype(np.int64)
+        nonzero = np.flatnonzero(summed)
+        coords = np.column_stack(np.unravel_index(nonzero, sizes)) if sizes else np.zeros((len(nonzero), 0), dtype=np.int64)
+        return coords.astype(np.int64), summed[nonzero]
+    if keys is not None:
+        unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    else:
+        unique, first, inverse = np.unique(coords, axis=0, return_index=True, return_inverse=True)
+    summed = np.bincount(inverse.ravel(), weights=counts, minlength=len(unique)).astype(np.int64)
+    nonzero = summed > 0
+    return coords[first][nonzero], summed[nonzero]
+
+
+class Cube:
+    """
+    Sparse joint counts over named dimensions.
+
+    Args:
+        dims: Dimension names, e.g. ("cell_type", "tissue", "disease", "assay").
+        labels: Sorted, distinct labels of each dimension.
+        coords: (n, len(dims)) label indices of the non-empty cells, sorted.
+        counts: Cell count of each row of `coords`.
+        datasets: IDs of the datasets counted in the cube.
+    """
+
+    def __init__(
+        self,
+        dims: Sequence[str],
+        labels: Sequence[np.ndarray],
+        coords: np.ndarray,
+        counts: np.ndarray,
+        datasets: Sequence[str] = (),
+    ):
+        self.dims = tuple(dims)
+        self.labels = [np.asarray(l, dtype=str) for l in labels]
+        self.coords = coords
+        self.counts = counts
+        self.datasets = list(datasets)
+        self._label_index = [{label: i for i, label in enumerate(l)} for l in self.labels]
+        self._keys = _linear_keys(coords, self.sizes)
+
+    @property
+    def sizes(self) -> List[int]:
+        return [len(l) for l in self.labels]
+
+    @property
+    def n_cells(self) -> int:
+        return int(self.counts.sum())
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    @classmethod
+    def from_codes(
+        cls,
+        dims: Sequence[str],
+        codes: Sequence[np.ndarray],
+        code_labels: Sequence[Sequence[str]],
+        dataset_id: str,
+        chunk_size: int = 1 << 22,
+    ) -> "Cube":
+        """
+        Count the cells of every label combination in one grouped pass over obs codes.
+
+        Args:
+            dims: Dimension names.
+            codes: Per-cell codes of each dimension's obs column (-1 for missing).
+            code_labels: Label of each code of each dimension; several codes may share a label.
+            dataset_id: ID of the dataset.
+            chunk_size: Number of cells grouped at a time, bounding temporary memory.
+
+        Returns:
+            The cube of the dataset.
+        """
+        # Map codes to label indices, with missing values on the empty label
+        labels, label_of_code = [], []
+        for names in code_labels:
+            distinct, inverse = np.unique(np.asarray(list(names) + [MISSING_LABEL], dtype=str), return_inverse=True)
+            labels.append(distinct)
+            label_of_code.append(inverse.ravel().astype(np.int64))
+        sizes = [len(l) for l in labels]
+
+        n_cells = len(codes[0]) if codes else 0
+        parts_coords, parts_counts = [], []
+        for start in range(0, n_cells, chunk_size):
+            # Code -1 picks the last entry of label_of_code, the missing label
+            chunk = np.column_stack([m[c[start:start + chunk_size]] for m, c in zip(label_of_code, codes)])
+            chunk_coords, chunk_counts = _aggregate(chunk, np.ones(len(chunk), dtype=np.int64), sizes)
+            parts_coords.append(chunk_coords)
+            parts_counts.append(chunk_counts)
+        if parts_coords:
+            coords, counts = _aggregate(np.concatenate(parts_coords), np.concatenate(parts_counts), sizes)
+        else:
+            coords, counts = np.zeros((0, len(dims)), dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return cls(dims, labels, coords, counts, datasets=[dataset_id])
+
+    @classmethod
+    def merge(cls, cubes: Sequence["Cube"]) -> "Cube":
+        """
+        Sum cubes with the same dimensions, e.g. of several datasets.
+
+        Args:
+            cubes: The cubes to merge.
+
+        Returns:
+            A cube whose counts are the sums of the counts of `cubes`.
+
+        Raises:
+            ValueError: If the cubes have different dimensions or a dataset is
+                counted in more than one of them, which would count its cells twice.
+        """
+        if not cubes:
+            raise ValueError("No cubes to merge")
+        dims = cubes[0].dims
+        for cube in cubes[1:]:
+            if cube.dims != dims:
+                raise ValueError(f"Cannot merge cubes with dimensions {dims} and {cube.dims}")
+        seen, duplicates = set(), set()
+        for cube in cubes:
+            for ds in set(cube.datasets):
+                (duplicates if ds in seen else seen).add(ds)
+        if duplicates:
+            raise ValueError(f"Datasets counted in more than one cube: {', '.join(sorted(duplicates))}")
+
+        labels = [np.unique(np.concatenate([cube.labels[i] for cube in cubes])) for i in range(len(dims))]
+        coords = np.concatenate([
+            np.column_stack([np.searchsorted(labels[i], cube.labels[i])[cube.coords[:, i]] for i in range(len(dims))])
+            if len(cube) else np.zeros((0, len(dims)), dtype=np.int64)
+            for cube in cubes
+        ])
+        counts = np.concatenate([cube.counts for cube in cubes])
+        coords, counts = _aggregate(coords, counts, [len(l) for l in labels])
+        datasets = [ds for cube in cubes for ds in cube.datasets]
+        return cls(dims, labels, coords, counts, datasets=datasets)
+
+    def _mask(self, where: Dict[str, Sequence[str]]) -> Optional[np.ndarray]:
+        """Rows matching any of the given labels in each constrained dimension (None: no match possible)."""
+        mask = np.ones(len(self), dtype=bool)
+        for dim, values in where.items():
+            if dim not in self.dims:
+                raise ValueError(f"Unknown dimension {dim}; expected one of {list(self.dims)}")
+            axis = self.dims.index(dim)
+            indices = [self._label_index[axis][v] for v in values if v in self._label_index[axis]]
+            if not indices:
+                return None
+            mask &= np.isin(self.coords[:, axis], indices)
+        return mask
+
+    def count(self, **where: str) -> int:
+        """
+        Get the number of cells with the given label in each given dimension.
+
+        Dimensions not given are summed over. Fixing every dimension is a binary
+        search in the sorted rows.
+
+        Args:
+            **where: Label of each constrained dimension.
+
+        Returns:
+            The number of matching cells.
+        """
+        if set(where) == set(self.dims) and self._keys is not None:
+            try:
+                point = np.array([[self._label_index[i][where[d]] for i, d in enumerate(self.dims)]])
+            except KeyError:
+                return 0
+            key = _linear_keys(point, self.sizes)[0]
+            pos = np.searchsorted(self._keys, key)
+            return int(self.counts[pos]) if pos < len(self._keys) and self._keys[pos] == key else 0
+        mask = self._mask({dim: [value] for dim, value in where.items()})
+        return 0 if mask is None else int(self.counts[mask].sum())
+
+    def group_by(
+        self, dims: Sequence[str], where: Optional[Dict[str, Sequence[str]]] = None,
+    ) -> List[Tuple[Tuple[str, ...], int]]:
+        """
+        Sum the counts of the matching cells by the labels of some dimensions.
+
+        Args:
+            dims: Dimensions to group by (none: a single group with the total count).
+            where: Accepted labels of each constrained dimension.
+
+        Returns:
+            (labels, count) of each group, by decreasing count.
+        """
+        unknown = [d for d in dims if d not in self.dims]
+        if unknown:
+            raise ValueError(f"Unknown dimensions {unknown}; expected some of {list(self.dims)}")
+        mask = self._mask(where or {})
+        if mask is None:
+            return []
+        axes = [self.dims.index(d) for d in dims]
+        coords, counts = _aggregate(
+            self.coords[mask][:, axes], self.counts[mask], [self.sizes[a] for a in axes],
+        )
+        order = np.argsort(-counts, kind="stable")
+        return [
+            (tuple(str(self.labels[a][c]) for a, c in zip(axes, coords[i])), int(counts[i]))
+            for i in order
+        ]
+
+    def save(self, path: str) -> None:
+        """Write the cube to a compressed .npz file."""
+        arrays = {f"labels_{i}": l for i, l in enumerate(self.labels)}
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f, dims=np.asarray(self.dims, dtype=str), datasets=np.asarray(self.datasets, dtype=str),
+                coords=self.coords, counts=self.counts, **arrays,
+            )
+        logger.info(f"Saved cube with {len(self)} non-empty cells over {list(self.dims)} to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> "Cube":
+        """Read a cube written by `save`."""
+        with np.load(path) as data:
+            dims = [str(d) for d in data["dims"]]
+            labels = [data[f"labels_{i}"] for i in range(len(dims))]
+            return cls(dims, labels, data["coords"], data["counts"], datasets=[str(d) for d in data["datasets"]])
+
+
+def _parse_where(conditions: Sequence[str]) -> Dict[str, List[str]]:
+    """Parse dim=label conditions; repeating a dimension accepts any of its labels."""
+    where: Dict[str, List[str]] = {}
+    for condition in conditions:
+        dim, sep, value = condition.partition("=")
+        if not sep:
+            raise ValueError(f"Expected dim=label, got {condition!r}")
+        where.setdefault(dim, []).append(value)
+    return where
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line options of this script to a parser."""
+    subparsers = parser.add_subparsers(dest="cube_command", metavar="action", required=True)
+
+    merge_parser = subparsers.add_parser("merge", help="Sum the cubes of several datasets")
+    merge_parser.add_argument("cube_files", nargs="+", help="Cube files (.npz) written by populate_schema.py --cube")
+    merge_parser.add_argument("--output", "-o", required=True, help="Path to the merged cube file")
+
+    query_parser = subparsers.add_parser("query", help="Count cells in a cube")
+    query_parser.add_argument("cube_file", help="Cube file (.npz)")
+    query_parser.add_argument("--where", nargs="+", default=[], metavar="DIM=LABEL",
+                              help="Constrain dimensions to labels; repeat a dimension to accept several labels")
+    query_parser.add_argument("--group-by", nargs="+", default=[], metavar="DIM",
+                              help="Report counts per label of these dimensions (default: the total only)")
+    query_parser.add_argument("--top", type=int, default=None, help="Only report the largest groups")
+    query_parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+
+def run(args: argparse.Namespace) -> None:
+    """Run the script with parsed command line options."""
+    import json
+
+    try:
+        if args.cube_command == "merge":
+            cube = Cube.merge([Cube.load(path) for path in args.cube_files])
+            cube.save(args.output)
+            print(f"✅ Merged {len(cube.datasets)} datasets ({cube.n_cells} cells) into {args.output}")
+            return
+
+        cube = Cube.load(args.cube_file)
+        groups = cube.group_by(args.group_by, _parse_where(args.where))[:args.top] or [((), 0)]
+    except (OSError, KeyError, ValueError) as e:
+        logger.error(f"Cube {args.cube_command} failed: {e}")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps([dict(zip(args.group_by, labels), cells=count) for labels, count in groups], indent=2))
+    else:
+        for labels, count in groups:
+            print("\t".join(list(labels) + [str(count)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
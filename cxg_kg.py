@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Unified command line entry point for the single cell knowledge graph tools.
+
+    cxg_kg.py populate sample_data.h5ad -o sample_dataset.json
+    cxg_kg.py validate sample_dataset.json
+    cxg_kg.py visualize sample_dataset.json
+    cxg_kg.py generate --n-cells 1000
+    cxg_kg.py cube query atlas.cube.npz --where cell_type=CL:0000084
+    cxg_kg.py serve --socket /tmp/cxg-kg.sock
+
+Only the module of the selected subcommand is imported, and the modules
+import heavy dependencies (anndata, LinkML, matplotlib, networkx) inside the
+functions that use them, so `--help` and argument errors return immediately.
+"""
+
+import argparse
+import importlib
+import sys
+from typing import List, Optional
+
+# Subcommands: name -> (module, help)
+COMMANDS = {
+    "populate": ("populate_schema", "Populate the schema from an AnnData (h5ad) file"),
+    "validate": ("validate_data", "Validate a dataset against the LinkML schema"),
+    "visualize": ("visualize_graph", "Visualize the knowledge graph of a dataset"),
+    "pipeline": ("pipeline", "Populate the schema for many AnnData files with overlapped stages"),
+    "render": ("render_batch", "Render knowledge graph images for many datasets in parallel"),
+    "generate": ("generate_sample_data", "Generate a sample AnnData (h5ad) file"),
+    "cube": ("cube", "Merge and query cubes of joint cell counts"),
+    "diff": ("graph_diff", "Diff two knowledge graph releases into a changeset"),
+    "serve": ("kg_server", "Serve populate and validate jobs from warm worker processes"),
+}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog="cxg-kg", description="Single cell transcriptomics knowledge graph tools")
+    subparsers = parser.add_subparsers(dest="command", metavar="command", required=True)
+    for name, (_, summary) in COMMANDS.items():
+        subparsers.add_parser(name, help=summary)
+
+    # Import the selected subcommand's module only, and register its options
+    command = next((arg for arg in argv if not arg.startswith("-")), None)
+    if command in COMMANDS:
+        module = importlib.import_module(COMMANDS[command][0])
+        subparser = subparsers.choices[command]
+        subparser.description = module.DESCRIPTION
+        module.add_arguments(subparser)
+
+    args = parser.parse_args(argv)
+    module.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+"""
+Generate slotted record classes from the LinkML schema.
+
+Each concrete schema class becomes a class with `__slots__` for its slots and
+a constructor checking, for every slot, what the schema declares: the type of
+its range (identifiers and references must be CURIEs or URIs), minimum and
+maximum values, and that multivalued slots hold lists. Inlined slots hold
+records of their range class, built from dictionaries when needed.
+
+The generated module (records.py, next to this script) is checked in;
+regenerate it after editing the schema. It records the digest of the schema it
+was generated from, so `validate_data.py --typed` can refuse other schemas.
+"""
+
+import argparse
+import logging
+import os
+import sys
+from typing import Any, Dict, List
+
+import yaml
+
+from validate_data import SCHEMA_FILE, schema_digest
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DESCRIPTION = "Generate slotted record classes from the LinkML schema"
+
+# The generated module imported by populate_schema.py and validate_data.py
+RECORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "records.py")
+
+# Checker and annotation of each schema type
+TYPES = {
+    "string": ("_str", "str"),
+    "uriorcurie": ("_curie", "str"),
+    "integer": ("_int", "int"),
+    "float": ("_float", "float"),
+}
+
+HEADER = '''"""
+Record classes of the single cell transcriptomics schema.
+
+Generated by generate_records.py from {schema}; do not edit.
+
+Constructors check each slot against its range, bounds and cardinality and
+raise RecordError on invalid values, so records are valid by construction.
+"""
+
+import re
+from numbers import Integral, Real
+from typing import Any, Callable, Dict, List, Optional
+
+# Digest of the schema file the classes were generated from (see validate_data.schema_digest)
+SCHEMA_DIGEST = "{digest}"
+
+# CURIE (prefix:reference) or URI without whitespace
+_CURIE = re.compile(r"^[A-Za-z_][A-Za-z0-9_.+-]*:\\S+$")
+
+
+class RecordError(ValueError):
+    """Raised when a slot value does not conform to the schema."""
+
+
+def _str(value: Any, where: str) -> Optional[str]:
+    if value is not None and not isinstance(value, str):
+        raise RecordError(f"{{where}}: expected a string, got {{value!r}}")
+    return value
+
+
+def _curie(value: Any, where: str) -> Optional[str]:
+    if value is not None and not (isinstance(value, str) and _CURIE.match(value)):
+        raise RecordError(f"{{where}}: expected a CURIE or URI, got {{value!r}}")
+    return value
+
+
+def _int(value: Any, where: str, minimum: Optional[float] = None, maximum: Optional[float] = None) -> Optional[int]:
+    if value is None:
+        return None
+    # Exact type checks first: isinstance against the numbers ABCs is slow
+    if type(value) is not int:
+        if not isinstance(value, Integral) or isinstance(value, bool):
+            raise RecordError(f"{{where}}: expected an integer, got {{value!r}}")
+        value = int(value)
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise RecordError(f"{{where}}: {{value}} is outside [{{minimum}}, {{maximum}}]")
+    return value
+
+
+def _float(value: Any, where: str, minimum: Optional[float] = None, maximum: Optional[float] = None) -> Optional[float]:
+    if value is None:
+        return None
+    if type(value) is not float:
+        if not isinstance(value, Real) or isinstance(value, bool):
+            raise RecordError(f"{{where}}: expected a number, got {{value!r}}")
+        value = float(value)
+    # Written so that NaN fails the bounds
+    if (minimum is not None and not value >= minimum) or (maximum is not None and not value <= maximum):
+        raise RecordError(f"{{where}}: {{value}} is outside [{{minimum}}, {{maximum}}]")
+    return value
+
+
+def _list(values: Any, check: Callable, where: str, *bounds: Optional[float]) -> Optional[List[Any]]:
+    if values is None:
+        return None
+    if not isinstance(values, list):
+        raise RecordError(f"{{where}}: expected a list, got {{values!r}}")
+    return [check(value, where, *bounds) for value in values]
+
+
+def _inlined(values: Any, cls: type, where: str) -> Optional[List[Any]]:
+    if values is None:
+        return None
+    if not isinstance(values, list):
+        raise RecordError(f"{{where}}: expected a list, got {{values!r}}")
+    return [value if isinstance(value, cls) else cls.from_dict(value, where) for value in values]
+
+
+class _Record:
+    __slots__ = ()
+    _identifier: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Any, where: Optional[str] = None) -> Any:
+        """Build a record from a schema-shaped dictionary."""
+        where = where or cls.__name__
+        if not isinstance(data, dict):
+            raise RecordError(f"{{where}}: expected an object, got {{data!r}}")
+        unknown = [key for key in data if key not in cls.__slots__]
+        if unknown:
+            raise RecordError(f"{{where}}: unknown slots {{unknown}}")
+        if cls._identifier is not None and data.get(cls._identifier) is None:
+            raise RecordError(f"{{where}}: missing required slot {{cls._identifier}}")
+        return cls(**data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the record as a schema-shaped dictionary, without unset slots."""
+        raise NotImplementedError
+
+    def __eq__(self, other: Any) -> bool:
+        return type(self) is type(other) and all(getattr(self, s) == getattr(other, s) for s in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"{{type(self).__name__}}({{self.to_dict()!r}})"
+'''
+
+
+class _SchemaLoader(yaml.SafeLoader):
+    """Safe YAML loader merging the values of repeated mapping keys (the schema declares `classes` twice)."""
+
+
+def _construct_mapping(loader: yaml.SafeLoader, node: yaml.MappingNode) -> Dict[Any, Any]:
+    loader.flatten_mapping(node)
+    mapping: Dict[Any, Any] = {}
+    for key_node, value_node in node.value:
+        key = loader.construct_object(key_node, deep=True)
+        value = loader.construct_object(value_node, deep=True)
+        if isinstance(mapping.get(key), dict) and isinstance(value, dict):
+            mapping[key].update(value)
+        else:
+            mapping[key] = value
+    return mapping
+
+
+_SchemaLoader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, _construct_mapping)
+
+
+def load_schema(schema_file: str) -> Dict[str, Any]:
+    """Load a LinkML schema file, merging repeated top-level sections."""
+    with open(schema_file) as f:
+        return yaml.load(f, Loader=_SchemaLoader)
+
+
+def _slot_code(class_name: str, slot_name: str, slot: Dict[str, Any], schema: Dict[str, Any]) -> tuple:
+    """Return (annotation, assignment expression) of a slot."""
+    where = f'"{class_name}.{slot_name}"'
+    range_ = slot.get("range", schema.get("default_range", "string"))
+    if range_ in schema.get("classes", {}):
+        if slot.get("inlined"):
+            return f'List["{range_}"]', f"_inlined({slot_name}, {range_}, {where})"
+        check, annotation = "_curie", "str"
+    else:
+        check, annotation = TYPES[range_]
+
+    bounds = ""
+    if "minimum_value" in slot or "maximum_value" in slot:
+        bounds = f", {slot.get('minimum_value')!r}, {slot.get('maximum_value')!r}"
+    if slot.get("multivalued"):
+        return f"List[{annotation}]", f"_list({slot_name}, {check}, {where}{bounds})"
+    return annotation, f"{check}({slot_name}, {where}{bounds})"
+
+
+def _tuple(names: List[str]) -> str:
+    return "(" + ", ".join(f'"{name}"' for name in names) + ("," if len(names) == 1 else "") + ")"
+
+
+def generate_records(schema: Dict[str, Any], schema_name: str = "single_cell_schema.yaml", digest: str = "") -> str:
+    """
+    Generate the source of the record classes of a schema.
+
+    Args:
+        schema: The loaded LinkML schema.
+        schema_name: Schema file name mentioned in the generated module.
+        digest: Digest of the schema file (`validate_data.schema_digest`), recorded
+            in the generated module.
+
+    Returns:
+        Python source code.
+    """
+    slots = schema.get("slots", {})
+    lines = [HEADER.format(schema=schema_name, digest=digest)]
+    class_names = []
+    for class_name, cls in schema.get("classes", {}).items():
+        if cls.get("abstract"):
+            continue
+        class_names.append(class_name)
+        slot_names: List[str] = cls.get("slots", [])
+        identifier = next((s for s in slot_names if slots[s].get("identifier")), None)
+        inlined = tuple(s for s in slot_names if slots[s].get("inlined"))
+        code = {s: _slot_code(class_name, s, slots[s], schema) for s in slot_names}
+
+        lines.append("")
+        lines.append(f"class {class_name}(_Record):")
+        lines.append(f'    """{cls.get("description", class_name)}"""')
+        lines.append("")
+        lines.append(f"    __slots__ = {_tuple(slot_names)}")
+        if identifier is not None:
+            lines.append(f'    _identifier = "{identifier}"')
+        lines.append("")
+        lines.append("    def __init__(")
+        lines.append("        self,")
+        # The identifier is required and comes first
+        for s in sorted(slot_names, key=lambda s: s != identifier):
+            annotation = code[s][0]
+            lines.append(f"        {s}: {annotation}," if s == identifier else f"        {s}: Optional[{annotation}] = None,")
+        lines.append("    ):")
+        for s in slot_names:
+            lines.append(f"        self.{s} = {code[s][1]}")
+        lines.append("")
+        lines.append("    def to_dict(self) -> Dict[str, Any]:")
+        lines.append("        data = {}")
+        for s in slot_names:
+            value = f"[v.to_dict() for v in self.{s}]" if s in inlined else f"self.{s}"
+            lines.append(f"        if self.{s} is not None:")
+            lines.append(f'            data["{s}"] = {value}')
+        lines.append("        return data")
+        lines.append("")
+
+    lines.append("")
+    lines.append("# Record class of each schema class")
+    lines.append("RECORD_CLASSES = {")
+    lines.extend(f'    "{name}": {name},' for name in class_names)
+    lines.append("}")
+    lines.append("")
+    return "\n".join(lines)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line options of this script to a parser."""
+    parser.add_argument("--schema", "-s", default=SCHEMA_FILE,
+                        help="Path to the LinkML schema file (default: single_cell_schema.yaml next to this script)")
+    parser.add_argument("--output", "-o", default=RECORDS_FILE,
+                        help="Path to the generated module (default: records.py next to this script)")
+
+
+def run(args: argparse.Namespace) -> None:
+    """Run the script with parsed command line options."""
+    if not os.path.exists(args.schema):
+        logger.error(f"Schema file not found: {args.schema}")
+        sys.exit(1)
+    source = generate_records(load_schema(args.schema), os.path.basename(args.schema), schema_digest(args.schema))
+    with open(args.output, "w") as f:
+        f.write(source)
+    logger.info(f"Wrote record classes to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
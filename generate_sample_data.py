@@ -3,18 +3,24 @@
 Generate a sample AnnData (h5ad) file for testing the single cell schema.
 """
 
+from __future__ import annotations
+
 import argparse
 import logging
 import os
 import random
 import numpy as np
-import pandas as pd
-import scanpy as sc
-from typing import List, Tuple, Dict
+from typing import TYPE_CHECKING, List, Tuple, Dict
+
+if TYPE_CHECKING:
+    import h5py
+    import scipy.sparse as sp
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+DESCRIPTION = "Generate a sample AnnData (h5ad) file for testing the single cell schema"
+
 # Define sample data
 # CL IDs and their author-annotated free text labels
 CELL_TYPE_AUTHOR_LABELS = {
@@ -86,6 +92,9 @@ def generate_sample_data(
         random_seed: Random seed for reproducibility.
         output_file: Path to the output h5ad file.
     """
+    import pandas as pd
+    import scanpy as sc
+    
     logger.info(f"Generating sample data with {n_cells} cells and {n_genes} genes")
     
     # Set random seed for reproducibility
@@ -160,14 +169,265 @@ def generate_sample_data(
     return adata
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Generate a sample AnnData (h5ad) file for testing the single cell schema")
+def _write_string_array(group: h5py.Group, name: str, values: List[str]) -> h5py.Dataset:
+    """
+    Write a small string array using the AnnData on-disk encoding.
+    
+    Args:
+        group: The HDF5 group to write into.
+        name: Name of the dataset.
+        values: The strings to write.
+        
+    Returns:
+        The created HDF5 dataset.
+    """
+    import h5py
+    
+    dset = group.create_dataset(name, data=np.array(values, dtype=object), dtype=h5py.string_dtype())
+    dset.attrs["encoding-type"] = "string-array"
+    dset.attrs["encoding-version"] = "0.2.0"
+    return dset
+
+
+def _write_empty_dict(group: h5py.Group, name: str) -> None:
+    """Write an empty AnnData mapping element (uns, obsm, layers, ...)."""
+    sub = group.create_group(name)
+    sub.attrs["encoding-type"] = "dict"
+    sub.attrs["encoding-version"] = "0.1.0"
+
+
+def _generate_obs_codes(rng: np.random.Generator, n: int) -> Dict[str, np.ndarray]:
+    """
+    Generate categorical codes for one chunk of cells.
+    
+    The codes index into the category lists returned by `_obs_categories` and
+    follow the same hierarchy and skew as `generate_sample_data`.
+    
+    Args:
+        rng: The random generator.
+        n: Number of cells in the chunk.
+        
+    Returns:
+        A dictionary mapping obs column names to int8 code arrays.
+    """
+    # Level 1: broad cell types, coded by their position in CELL_TYPES[:4]
+    broad = rng.integers(0, 4, size=n).astype(np.int8)
+    
+    # Level 2: T cells become NKT or Th cells, 30% of B cells become memory B cells.
+    # Positions refer to CELL_TYPES and are remapped to the level 2 categories below.
+    specific = broad.copy()
+    t_cell_mask = broad == 0
+    specific[t_cell_mask] = rng.choice([6, 7], size=int(t_cell_mask.sum()))
+    b_cell_mask = broad == 1
+    memory_mask = rng.random(int(b_cell_mask.sum())) < 0.3
+    specific[b_cell_mask] = np.where(memory_mask, 5, 1)
+    
+    return {
+        "cell_type_l1": broad,
+        "cell_type": _SPECIFIC_CODE_LOOKUP[specific],
+        "tissue": rng.integers(0, len(TISSUES), size=n).astype(np.int8),
+        "disease": rng.choice(len(DISEASES), size=n, p=[0.1, 0.1, 0.1, 0.7]).astype(np.int8),
+        "development_stage": rng.choice(len(DEV_STAGES), size=n, p=[0.7, 0.15, 0.15]).astype(np.int8),
+        "assay": rng.choice(len(ASSAYS), size=n, p=[0.5, 0.3, 0.2]).astype(np.int8),
+    }
+
+
+# Level 2 categories actually produced by `_generate_obs_codes`, and the lookup
+# from a position in CELL_TYPES to the code in that category list
+_SPECIFIC_CELL_TYPES = ["CL:0000236", "CL:0000576", "CL:0000775", "CL:0000813", "CL:0000814", "CL:0000939"]
+_SPECIFIC_CODE_LOOKUP = np.array(
+    [_SPECIFIC_CELL_TYPES.index(ct) if ct in _SPECIFIC_CELL_TYPES else -1 for ct in CELL_TYPES],
+    dtype=np.int8,
+)
+
+
+def _random_csr_chunk(rng: np.random.Generator, n_rows: int, n_cols: int, density: float) -> sp.csr_matrix:
+    """
+    Generate a random sparse count matrix in canonical CSR form.
+    
+    Non-zero positions follow a Bernoulli process over the flattened matrix,
+    sampled through geometric gaps so they come out sorted and unique without
+    materializing a dense mask. Values are negative binomial counts shifted to
+    be strictly positive.
+    
+    Args:
+        rng: The random generator.
+        n_rows: Number of rows (cells).
+        n_cols: Number of columns (genes).
+        density: Fraction of non-zero entries.
+        
+    Returns:
+        A float32 CSR matrix.
+    """
+    import scipy.sparse as sp
+    
+    total = n_rows * n_cols
+    positions = np.empty(0, dtype=np.int64)
+    offset = -1
+    while offset < total - 1 and density > 0:
+        expected = (total - 1 - offset) * density
+        gaps = rng.geometric(density, size=int(expected + 5 * np.sqrt(expected) + 16))
+        block = offset + np.cumsum(gaps)
+        positions = np.concatenate([positions, block])
+        offset = block[-1]
+    positions = positions[positions < total]
+    
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(positions // n_cols, minlength=n_rows), out=indptr[1:])
+    values = (rng.negative_binomial(5, 0.3, size=len(positions)) + 1).astype(np.float32)
+    return sp.csr_matrix((values, (positions % n_cols).astype(np.int32), indptr), shape=(n_rows, n_cols))
+
+
+def _obs_categories() -> Dict[str, List[str]]:
+    """Return the category list for each generated obs column."""
+    return {
+        "cell_type_l1": [CELL_TYPE_AUTHOR_LABELS[ct] for ct in CELL_TYPES[:4]],
+        "cell_type": _SPECIFIC_CELL_TYPES,
+        "tissue": TISSUES,
+        "disease": DISEASES,
+        "development_stage": DEV_STAGES,
+        "assay": ASSAYS,
+    }
+
+
+def generate_sample_data_fast(
+    n_cells: int = 1000,
+    n_genes: int = 200,
+    random_seed: int = 42,
+    output_file: str = "sample_data.h5ad",
+    x_mode: str = "sparse",
+    density: float = 0.05,
+    chunk_size: int = 500_000,
+) -> None:
+    """
+    Generate a large sample h5ad file in bounded memory.
+    
+    Unlike `generate_sample_data`, this writes the file incrementally with h5py:
+    obs columns are generated as categorical codes chunk by chunk, X is either a
+    sparse CSR count matrix or omitted entirely, and no normalization or
+    embedding steps are run. The result can be read with `anndata.read_h5ad`.
+    
+    Args:
+        n_cells: Number of cells to generate.
+        n_genes: Number of genes to generate.
+        random_seed: Random seed for reproducibility.
+        output_file: Path to the output h5ad file.
+        x_mode: "sparse" to write a CSR count matrix, "empty" to write no X.
+        density: Fraction of non-zero entries in X (sparse mode only).
+        chunk_size: Number of cells generated and written per chunk.
+    """
+    if x_mode not in ("sparse", "empty"):
+        raise ValueError(f"Unsupported X mode: {x_mode}")
+    import h5py
+    
+    logger.info(f"Generating {x_mode} sample data with {n_cells} cells and {n_genes} genes "
+                f"in chunks of {chunk_size}")
+    
+    rng = np.random.default_rng(random_seed)
+    categories = _obs_categories()
+    
+    with h5py.File(output_file, "w") as f:
+        f.attrs["encoding-type"] = "anndata"
+        f.attrs["encoding-version"] = "0.1.0"
+        
+        # Observations: index plus one categorical group per column
+        obs = f.create_group("obs")
+        obs.attrs["encoding-type"] = "dataframe"
+        obs.attrs["encoding-version"] = "0.2.0"
+        obs.attrs["_index"] = "_index"
+        obs.attrs.create("column-order", list(categories), dtype=h5py.string_dtype())
+        
+        index = obs.create_dataset("_index", shape=(n_cells,), dtype=h5py.string_dtype(),
+                                   chunks=(min(chunk_size, max(n_cells, 1)),))
+        index.attrs["encoding-type"] = "string-array"
+        index.attrs["encoding-version"] = "0.2.0"
+        
+        codes = {}
+        for col, values in categories.items():
+            group = obs.create_group(col)
+            group.attrs["encoding-type"] = "categorical"
+            group.attrs["encoding-version"] = "0.2.0"
+            group.attrs["ordered"] = False
+            _write_string_array(group, "categories", values)
+            codes[col] = group.create_dataset("codes", shape=(n_cells,), dtype=np.int8,
+                                              chunks=(min(chunk_size, max(n_cells, 1)),))
+            codes[col].attrs["encoding-type"] = "array"
+            codes[col].attrs["encoding-version"] = "0.2.0"
+        
+        # Variables
+        var = f.create_group("var")
+        var.attrs["encoding-type"] = "dataframe"
+        var.attrs["encoding-version"] = "0.2.0"
+        var.attrs["_index"] = "_index"
+        var.attrs["column-order"] = np.array([], dtype=np.float64)
+        _write_string_array(var, "_index", [f"gene_{i}" for i in range(n_genes)])
+        
+        # Expression matrix as growable CSR components
+        if x_mode == "sparse":
+            X = f.create_group("X")
+            X.attrs["encoding-type"] = "csr_matrix"
+            X.attrs["encoding-version"] = "0.1.0"
+            X.attrs["shape"] = np.array([n_cells, n_genes])
+            data = X.create_dataset("data", shape=(0,), maxshape=(None,), dtype=np.float32, chunks=(1 << 20,))
+            indices = X.create_dataset("indices", shape=(0,), maxshape=(None,), dtype=np.int32, chunks=(1 << 20,))
+            indptr = X.create_dataset("indptr", shape=(n_cells + 1,), dtype=np.int64)
+            indptr[0] = 0
+        
+        for name in ("layers", "obsm", "obsp", "uns", "varm", "varp"):
+            _write_empty_dict(f, name)
+        
+        nnz = 0
+        for start in range(0, n_cells, chunk_size):
+            stop = min(start + chunk_size, n_cells)
+            n = stop - start
+            
+            index[start:stop] = np.array([f"cell_{i}" for i in range(start, stop)], dtype=object)
+            for col, chunk_codes in _generate_obs_codes(rng, n).items():
+                codes[col][start:stop] = chunk_codes
+            
+            if x_mode == "sparse":
+                chunk = _random_csr_chunk(rng, n, n_genes, density)
+                data.resize((nnz + chunk.nnz,))
+                indices.resize((nnz + chunk.nnz,))
+                data[nnz:] = chunk.data
+                indices[nnz:] = chunk.indices
+                indptr[start + 1:stop + 1] = chunk.indptr[1:].astype(np.int64) + nnz
+                nnz += chunk.nnz
+            
+            logger.info(f"Wrote cells {start} to {stop}")
+    
+    logger.info(f"Saved sample data to {output_file}")
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line options of this script to a parser."""
     parser.add_argument("--n-cells", type=int, default=1000, help="Number of cells to generate (default: 1000)")
     parser.add_argument("--n-genes", type=int, default=200, help="Number of genes to generate (default: 200)")
     parser.add_argument("--random-seed", type=int, default=42, help="Random seed for reproducibility (default: 42)")
     parser.add_argument("--output", "-o", default="sample_data.h5ad", help="Path to the output h5ad file (default: sample_data.h5ad)")
-    
-    args = parser.parse_args()
+    parser.add_argument("--fast", action="store_true",
+                        help="Write the file incrementally with sparse or empty X and no embeddings")
+    parser.add_argument("--x-mode", choices=["sparse", "empty"], default="sparse",
+                        help="Expression matrix to write in fast mode (default: sparse)")
+    parser.add_argument("--density", type=float, default=0.05,
+                        help="Fraction of non-zero expression values in fast mode (default: 0.05)")
+    parser.add_argument("--chunk-size", type=int, default=500_000,
+                        help="Number of cells generated per chunk in fast mode (default: 500000)")
+
+
+def run(args: argparse.Namespace) -> None:
+    """Run the script with parsed command line options."""
+    if args.fast:
+        generate_sample_data_fast(
+            n_cells=args.n_cells,
+            n_genes=args.n_genes,
+            random_seed=args.random_seed,
+            output_file=args.output,
+            x_mode=args.x_mode,
+            density=args.density,
+            chunk_size=args.chunk_size,
+        )
+        return
     
     generate_sample_data(
         n_cells=args.n_cells,
@@ -177,5 +437,11 @@ def main():
     )
 
 
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args())
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+"""
+Diff two knowledge graph releases into a changeset.
+
+Entities are keyed independently of the random IDs assigned at population:
+datasets by name, cell sets by (dataset, obs_column, obs_value), metadata
+associations by (cell set key, slot, term) and terms by ID. Each input is
+streamed once to record a content hash per entity (JSON key order does not
+matter), then the new graph is streamed again to emit the added and changed
+entities, so memory holds one digest per entity rather than the graphs.
+
+The changeset is written as JSON lines, removals first, then additions and
+changes in the order of the new graph:
+
+    {"op": "remove", "entity": "association", "key": {"dataset": ..., "obs_column": ..., "obs_value": ..., "slot": ..., "term": ...}}
+    {"op": "add", "entity": "cell_set", "key": {...}, "value": {...}}
+    {"op": "change", "entity": "term", "key": {"id": "CL:0000236"}, "value": {...}}
+
+References between cell sets (subset_of, overlaps_with) are written as
+[obs_column, obs_value] keys within the dataset.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DESCRIPTION = "Diff two knowledge graph releases into a changeset"
+
+# Entity types, in the order removals are written
+ENTITIES = ("association", "cell_set", "term", "dataset")
+
+# Key fields of each entity type
+KEY_FIELDS = {
+    "dataset": ("name",),
+    "cell_set": ("dataset", "obs_column", "obs_value"),
+    "association": ("dataset", "obs_column", "obs_value", "slot", "term"),
+    "term": ("id",),
+}
+
+# Cell set fields that reference other cell sets or are part of the key
+_CELL_SET_REFERENCES = ("subset_of", "overlaps_with")
+_CELL_SET_KEY_FIELDS = ("id", "obs_column", "obs_value")
+
+EntityKey = Tuple[str, ...]
+
+
+class _JSONStream:
+    """Incremental reader of the values of a JSON document whose top level is an object of objects and lists."""
+
+    def __init__(self, f: TextIO, chunk_size: int = 1 << 20):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> None:
+        data = self._f.read(self._chunk_size)
+        if not data:
+            self._eof = True
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+
+    def peek(self) -> str:
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buffer) or self._eof:
+                return self._buffer[self._pos:self._pos + 1]
+            self._fill()
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} in JSON document, found {char!r}")
+        self._pos += 1
+        return char
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+
+def _iter_json(path: str) -> Iterator[Tuple[str, Any]]:
+    """Yield (top-level key, value) pairs, one per list item for list values, without loading the document."""
+    with open(path) as f:
+        stream = _JSONStream(f)
+        stream.expect("{")
+        if stream.peek() == "}":
+            return
+        while True:
+            key = stream.value()
+            stream.expect(":")
+            if stream.peek() == "[":
+                stream.expect("[")
+                if stream.peek() == "]":
+                    stream.expect("]")
+                else:
+                    while True:
+                        yield key, stream.value()
+                        if stream.expect(",]") == "]":
+                            break
+            else:
+                yield key, stream.value()
+            if stream.expect(",}") == "}":
+                return
+
+
+def iter_objects(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Iterate over the objects of a graph.
+
+    Args:
+        path: JSON or YAML file, or graph store (every dataset is read).
+
+    Yields:
+        (collection key, object) pairs; each dataset comes before its cell sets and terms.
+    """
+    from graph_store import GraphStore, is_store_file
+
+    if is_store_file(path):
+        with GraphStore(path) as store:
+            for dataset_id in store.dataset_ids():
+                store.select(dataset_id)
+                yield "dataset", store.dataset_dict(dataset_id)
+                for key, items in store.iter_collections():
+                    for item in items:
+                        yield key, item
+    elif path.endswith(".json"):
+        yield from _iter_json(path)
+    elif path.endswith((".yaml", ".yml")):
+        import yaml
+
+        with open(path) as f:
+            data = yaml.safe_load(f)
+        for key, value in data.items():
+            for item in value if isinstance(value, list) else [value]:
+                yield key, item
+    else:
+        raise ValueError(f"Unsupported file format: {path}. Must be JSON, YAML or a graph store.")
+
+
+def _digest(value: Any) -> bytes:
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).digest()
+
+
+def _is_association_slot(value: Any) -> bool:
+    return isinstance(value, list) and bool(value) and isinstance(value[0], dict) and "term" in value[0]
+
+
+class _Entities:
+    """The entities of one graph, in stream order, with their natural keys."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dataset: Optional[str] = None
+        # Cell set ID -> key, for resolving references
+        self.cell_set_keys: Dict[str, EntityKey] = {}
+
+    def __iter__(self) -> Iterator[Tuple[str, EntityKey, Dict[str, Any]]]:
+        """Yield (entity type, key, content) triples; cell set content still holds ID references."""
+        for collection, obj in iter_objects(self.path):
+            if collection == "dataset":
+                self.dataset = obj.get("name", "")
+                yield "dataset", (self.dataset,), {k: v for k, v in obj.items() if not isinstance(v, list) and k != "id"}
+            elif collection == "cell_sets":
+                if self.dataset is None:
+                    raise ValueError(f"{self.path}: the dataset must come before its cell sets")
+                key = (self.dataset, obj["obs_column"], str(obj["obs_value"]))
+                self.cell_set_keys[obj["id"]] = key
+                content = {}
+                for field, value in obj.items():
+                    if _is_association_slot(value):
+                        for association in value:
+                            yield "association", key + (field, association["term"]), {
+                                k: v for k, v in association.items() if k != "term"
+                            }
+                    elif field not in _CELL_SET_KEY_FIELDS:
+                        content[field] = value
+                yield "cell_set", key, content
+            else:
+                # List fields of terms are reverse links to cell sets, derived from the associations
+                content = {k: v for k, v in obj.items() if not isinstance(v, list) and k != "id"}
+                content["collection"] = collection
+                yield "term", (obj["id"],), content
+
+    def resolve(self, content: Dict[str, Any]) -> Dict[str, Any]:
+        """Replace the cell set IDs referenced by cell set content with [obs_column, obs_value] keys."""
+        content = dict(content)
+        if "subset_of" in content:
+            content["subset_of"] = sorted(list(self.cell_set_keys[i][1:]) for i in content["subset_of"])
+        if "overlaps_with" in content:
+            content["overlaps_with"] = sorted(
+                ({**o, "cell_set": list(self.cell_set_keys[o["cell_set"]][1:])} for o in content["overlaps_with"]),
+                key=lambda o: o["cell_set"],
+            )
+        return content
+
+
+def digest_graph(path: str) -> Dict[str, Dict[EntityKey, bytes]]:
+    """
+    Hash the content of every entity of a graph in one streaming pass.
+
+    Args:
+        path: JSON or YAML file, or graph store.
+
+    Returns:
+        Dictionary of entity type -> {key: digest}.
+    """
+    digests: Dict[str, Dict[EntityKey, bytes]] = {entity: {} for entity in ENTITIES}
+    entities = _Entities(path)
+    # Cell sets referencing others are hashed once the IDs of their dataset are all known
+    pending: List[Tuple[EntityKey, Dict[str, Any]]] = []
+
+    def flush() -> None:
+        for key, content in pending:
+            digests["cell_set"][key] = _digest(entities.resolve(content))
+        pending.clear()
+
+    for entity, key, content in entities:
+        if entity == "cell_set" and any(field in content for field in _CELL_SET_REFERENCES):
+            pending.append((key, content))
+            continue
+        if entity != "cell_set" and entity != "association":
+            flush()
+        # Terms shared by several datasets of a store are hashed once
+        if key not in digests[entity]:
+            digests[entity][key] = _digest(content)
+    flush()
+    return digests
+
+
+def diff_digests(
+    old: Dict[str, Dict[EntityKey, bytes]],
+    new: Dict[str, Dict[EntityKey, bytes]],
+) -> Tuple[Dict[str, List[EntityKey]], Dict[str, Dict[EntityKey, str]]]:
+    """
+    Compare the entity digests of two graphs.
+
+    Returns:
+        Tuple of (entity type -> removed keys, entity type -> {key: "add" or "change"}).
+    """
+    removed, upserted = {}, {}
+    for entity in ENTITIES:
+        old_digests, new_digests = old[entity], new[entity]
+        removed[entity] = [key for key in old_digests if key not in new_digests]
+        upserted[entity] = {
+            key: "add" if key not in old_digests else "change"
+            for key, digest in new_digests.items() if old_digests.get(key) != digest
+        }
+    return removed, upserted
+
+
+def _record(op: str, entity: str, key: EntityKey, value: Optional[Dict[str, Any]] = None) -> str:
+    record = {"op": op, "entity": entity, "key": dict(zip(KEY_FIELDS[entity], key))}
+    if value is not None:
+        record["value"] = value
+    return json.dumps(record, ensure_ascii=False)
+
+
+def diff_graphs(old_path: str, new_path: str, output: TextIO) -> Counter:
+    """
+    Write the changeset turning one graph into another.
+
+    Args:
+        old_path: The old graph (JSON or YAML file, or graph store).
+        new_path: The new graph.
+        output: Text stream the JSON lines are written to.
+
+    Returns:
+        Number of records per (op, entity).
+    """
+    logger.info(f"Hashing entities of {old_path}")
+    old = digest_graph(old_path)
+    logger.info(f"Hashing entities of {new_path}")
+    new = digest_graph(new_path)
+    removed, upserted = diff_digests(old, new)
+    del old, new
+
+    counts: Counter = Counter()
+    for entity in ENTITIES:
+        for key in removed[entity]:
+            output.write(_record("remove", entity, key) + "\n")
+            counts["remove", entity] += 1
+
+    # Stream the new graph again for the content of the added and changed entities
+    entities = _Entities(new_path)
+    pending: List[Tuple[EntityKey, str, Dict[str, Any]]] = []
+
+    def flush() -> None:
+        for key, op, content in pending:
+            output.write(_record(op, "cell_set", key, entities.resolve(content)) + "\n")
+        pending.clear()
+
+    for entity, key, content in entities:
+        if entity != "cell_set" and entity != "association":
+            flush()
+        op = upserted[entity].pop(key, None)
+        if op is None:
+            continue
+        counts[op, entity] += 1
+        if entity == "cell_set":
+            # Written once the cell set IDs of the dataset are all known
+            pending.append((key, op, content))
+        else:
+            output.write(_record(op, entity, key, content) + "\n")
+    flush()
+    return counts
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line options of this script to a parser."""
+    parser.add_argument("old", help="Old release: JSON or YAML file, or graph store (.sqlite/.db)")
+    parser.add_argument("new", help="New release: JSON or YAML file, or graph store (.sqlite/.db)")
+    parser.add_argument("--output", "-o", default=None,
+                        help="Path to the changeset (JSON lines; default: standard output)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Enable verbose output")
+
+
+def run(args: argparse.Namespace) -> Counter:
+    """Run the script with parsed command line options and return the number of records per (op, entity)."""
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    for path in (args.old, args.new):
+        if not os.path.exists(path):
+            logger.error(f"File not found: {path}")
+            sys.exit(1)
+
+    if args.output is None:
+        counts = diff_graphs(args.old, args.new, sys.stdout)
+    else:
+        with open(args.output, "w") as f:
+            counts = diff_graphs(args.old, args.new, f)
+
+    summary = ", ".join(f"{n} {op} {entity}" for (op, entity), n in sorted(counts.items())) or "no changes"
+    logger.info(f"Changeset: {summary}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
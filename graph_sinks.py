@@ -0,0 +1,407 @@
+"""
+Output sinks for `KnowledgeGraph`.
+
+Each sink is constructed with an output path and writes a whole graph with
+`write(graph)`. Sinks pull entities from the graph's iterators, so objects are
+materialized one at a time where the format allows it; single-file outputs are
+written to a temporary file that replaces the output once complete. `get_sink`
+looks up a sink by format name.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+from itertools import repeat
+from typing import Dict, Any, Iterator, List, Optional, TextIO, Tuple
+
+import numpy as np
+import yaml
+
+import graph_store
+from knowledge_graph import DonorSummary, KnowledgeGraph
+from validate_data import SCHEMA_FILE
+
+logger = logging.getLogger(__name__)
+
+
+def _indent(text: str, prefix: str) -> str:
+    """Indent every line of `text` after the first one."""
+    return text.replace("\n", "\n" + prefix)
+
+
+@contextmanager
+def _atomic_output(output_file: str) -> Iterator[TextIO]:
+    """
+    Open a temporary file next to `output_file` and move it into place on success.
+
+    If writing fails, the partial output is deleted and an existing `output_file`
+    is left untouched.
+    """
+    tmp_path = f"{output_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            yield f
+        os.replace(tmp_path, output_file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class JSONSink:
+    """
+    Writes the graph as a single JSON document.
+
+    The output is identical to `json.dump(graph.to_dict(), f, indent=2)`, but
+    objects are encoded and written one at a time.
+    """
+
+    def __init__(self, output_file: str):
+        self.output_file = output_file
+
+    @staticmethod
+    def _write_list(f: TextIO, items: Iterator[Dict[str, Any]]) -> None:
+        first = True
+        for item in items:
+            f.write("[\n    " if first else ",\n    ")
+            f.write(_indent(json.dumps(item, indent=2), "    "))
+            first = False
+        f.write("[]" if first else "\n  ]")
+
+    def write(self, graph: KnowledgeGraph) -> None:
+        with _atomic_output(self.output_file) as f:
+            f.write('{\n  "dataset": ')
+            f.write(_indent(json.dumps(graph.dataset_dict(), indent=2), "  "))
+            for key, items in graph.iter_collections():
+                f.write(f',\n  "{key}": ')
+                self._write_list(f, items)
+            f.write("\n}")
+
+
+class YAMLSink:
+    """Writes the graph as a single YAML document using the LinkML YAML dumper."""
+
+    def __init__(self, output_file: str):
+        self.output_file = output_file
+
+    def write(self, graph: KnowledgeGraph) -> None:
+        from linkml_runtime.dumpers import yaml_dumper
+        with _atomic_output(self.output_file) as f:
+            f.write(yaml_dumper.dumps(graph.to_dict()))
+
+
+class RDFSink:
+    """
+    Writes the graph as RDF in N-Triples format.
+
+    CURIEs are expanded with the prefixes declared in the LinkML schema.
+    Metadata associations and overlaps become blank nodes of type
+    MetadataAssociation and CellSetOverlap. Donor-level statistics, when the
+    graph has them, are literals of the cell sets and association nodes.
+    """
+
+    RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+    XSD = "http://www.w3.org/2001/XMLSchema#"
+
+    def __init__(self, output_file: str, schema_file: Optional[str] = None):
+        self.output_file = output_file
+        with open(schema_file or SCHEMA_FILE) as f:
+            schema = yaml.safe_load(f)
+        self.prefixes: Dict[str, str] = schema.get("prefixes", {})
+        self.vocab = self.prefixes.get(schema.get("default_prefix", "schema"), "https://w3id.org/single-cell-schema/")
+
+    def _iri(self, curie: str) -> str:
+        prefix, sep, local = curie.partition(":")
+        if sep and prefix in self.prefixes:
+            return f"<{self.prefixes[prefix]}{local}>"
+        return f"<{curie}>"
+
+    def _prop(self, slot: str) -> str:
+        return f"<{self.vocab}{slot}>"
+
+    def _literal(self, value: Any) -> str:
+        if isinstance(value, bool):
+            return f'"{str(value).lower()}"^^<{self.XSD}boolean>'
+        if isinstance(value, int):
+            return f'"{value}"^^<{self.XSD}integer>'
+        if isinstance(value, float):
+            return f'"{value!r}"^^<{self.XSD}float>'
+        return json.dumps(str(value))
+
+    def _type(self, subject: str, class_name: str) -> str:
+        return f"{subject} <{self.RDF_TYPE}> <{self.vocab}{class_name}> .\n"
+
+    def write(self, graph: KnowledgeGraph) -> None:
+        with _atomic_output(self.output_file) as f:
+            dataset = graph.dataset_dict()
+            subject = self._iri(dataset["id"])
+            f.write(self._type(subject, "Dataset"))
+            for slot in ("name", "description"):
+                f.write(f"{subject} {self._prop(slot)} {self._literal(dataset[slot])} .\n")
+            if "donor_column" in dataset:
+                f.write(f"{subject} {self._prop('donor_column')} {self._literal(dataset['donor_column'])} .\n")
+            for slot in ("cell_sets", "ontology_terms"):
+                for ref in dataset[slot]:
+                    f.write(f"{subject} {self._prop(slot)} {self._iri(ref)} .\n")
+
+            n_blank = 0
+            for cs in graph.iter_cell_sets():
+                subject = self._iri(cs["id"])
+                f.write(self._type(subject, "CellSet"))
+                for slot in ("name", "description", "obs_column", "obs_value", "cell_count"):
+                    f.write(f"{subject} {self._prop(slot)} {self._literal(cs[slot])} .\n")
+                if "predominantly_consists_of" in cs:
+                    f.write(f"{subject} {self._prop('predominantly_consists_of')} {self._iri(cs['predominantly_consists_of'])} .\n")
+                for slot in ("predominant_cell_type_fraction", *graph_store.DONOR_SLOTS):
+                    if slot in cs:
+                        f.write(f"{subject} {self._prop(slot)} {self._literal(cs[slot])} .\n")
+                for parent in cs.get("subset_of", []):
+                    f.write(f"{subject} {self._prop('subset_of')} {self._iri(parent)} .\n")
+                for overlap in cs.get("overlaps_with", []):
+                    n_blank += 1
+                    node = f"_:a{n_blank}"
+                    f.write(f"{subject} {self._prop('overlaps_with')} {node} .\n")
+                    f.write(self._type(node, "CellSetOverlap"))
+                    f.write(f"{node} {self._prop('cell_set')} {self._iri(overlap['cell_set'])} .\n")
+                    for slot in ("intersection_count", "jaccard", "overlap_coefficient"):
+                        f.write(f"{node} {self._prop(slot)} {self._literal(overlap[slot])} .\n")
+                for slot in graph.association_slots:
+                    for assoc in cs.get(slot, []):
+                        n_blank += 1
+                        node = f"_:a{n_blank}"
+                        f.write(f"{subject} {self._prop(slot)} {node} .\n")
+                        f.write(self._type(node, "MetadataAssociation"))
+                        f.write(f"{node} {self._prop('term')} {self._iri(assoc['term'])} .\n")
+                        f.write(f"{node} {self._prop('count')} {self._literal(assoc['count'])} .\n")
+                        f.write(f"{node} {self._prop('cell_ratio')} {self._literal(assoc['cell_ratio'])} .\n")
+                        for donor_slot in graph_store.DONOR_SLOTS:
+                            if donor_slot in assoc:
+                                f.write(f"{node} {self._prop(donor_slot)} {self._literal(assoc[donor_slot])} .\n")
+
+            for term_class, terms in graph.iter_term_classes():
+                reverse_slot = graph.term_classes[term_class][1]
+                for term in terms:
+                    subject = self._iri(term["id"])
+                    f.write(self._type(subject, term_class))
+                    for slot in ("name", "description"):
+                        f.write(f"{subject} {self._prop(slot)} {self._literal(term[slot])} .\n")
+                    f.write(f"{subject} {self._prop('source_uri')} {self._iri(term['source_uri'])} .\n")
+                    for ref in term[reverse_slot]:
+                        f.write(f"{subject} {self._prop(reverse_slot)} {self._iri(ref)} .\n")
+
+
+class ColumnarSink:
+    """
+    Writes the graph as a directory of flat tables.
+
+    Tables: datasets, cell_sets, terms, subset_of, overlaps, associations. Records are
+    read directly from the graph without building schema-shaped dictionaries. Cell
+    sets and associations get donor_count and donor_ratio_* columns when the graph
+    has donor-level statistics.
+    Parquet output requires pyarrow; CSV output has no extra dependencies.
+    """
+
+    def __init__(self, output_dir: str, file_format: str = "parquet"):
+        if file_format not in ("parquet", "csv"):
+            raise ValueError(f"Unsupported columnar file format: {file_format}")
+        self.output_dir = output_dir
+        self.file_format = file_format
+
+    def _write_table(self, name: str, columns: Dict[str, Any]) -> None:
+        import pandas as pd
+        table = pd.DataFrame(columns)
+        path = os.path.join(self.output_dir, f"{name}.{self.file_format}")
+        if self.file_format == "parquet":
+            table.to_parquet(path, index=False)
+        else:
+            table.to_csv(path, index=False)
+
+    def write(self, graph: KnowledgeGraph) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self._write_table("datasets", {
+            "id": [graph.dataset_id],
+            "name": [graph.name],
+            "description": [graph.description],
+        })
+
+        cell_sets = list(graph.iter_cell_set_records())
+        terms = list(graph.iter_term_records())
+        cell_set_donors, association_donors = graph.donor_summaries()
+        self._write_table("cell_sets", {
+            "id": [cs.id for cs in cell_sets],
+            "dataset_id": [graph.dataset_id] * len(cell_sets),
+            "name": [cs.name for cs in cell_sets],
+            "description": [cs.description for cs in cell_sets],
+            "obs_column": [cs.obs_column for cs in cell_sets],
+            "obs_value": [cs.obs_value for cs in cell_sets],
+            "cell_count": [cs.cell_count for cs in cell_sets],
+            "predominantly_consists_of": [
+                terms[cs.predominantly_consists_of].id if cs.predominantly_consists_of >= 0 else None
+                for cs in cell_sets
+            ],
+            "predominant_cell_type_fraction": [cs.predominance_fraction for cs in cell_sets],
+            **self._donor_columns(cell_set_donors),
+        })
+        self._write_table("terms", {
+            "id": [t.id for t in terms],
+            "term_class": [t.term_class for t in terms],
+            "name": [t.name for t in terms],
+            "description": [t.description for t in terms],
+            "source_uri": [t.source_uri for t in terms],
+        })
+
+        edges = [(cs.id, cell_sets[p].id) for cs in cell_sets for p in (cs.subset_of or [])]
+        self._write_table("subset_of", {
+            "cell_set_id": [child for child, _ in edges],
+            "parent_id": [parent for _, parent in edges],
+        })
+
+        cell_set_ids = np.array([cs.id for cs in cell_sets], dtype=object)
+        overlaps = graph.overlap_arrays()
+        self._write_table("overlaps", {
+            "cell_set_id": cell_set_ids[overlaps.cell_set],
+            "other_id": cell_set_ids[overlaps.other],
+            "intersection_count": overlaps.count,
+            "jaccard": overlaps.jaccard,
+            "overlap_coefficient": overlaps.overlap_coefficient,
+        })
+
+        assoc = graph.association_arrays()
+        term_ids = np.array([t.id for t in terms], dtype=object)
+        self._write_table("associations", {
+            "cell_set_id": cell_set_ids[assoc.cell_set],
+            "slot": np.array(graph.association_slots, dtype=object)[assoc.slot],
+            "term_id": term_ids[assoc.term],
+            "count": assoc.count,
+            "cell_ratio": assoc.cell_ratio,
+            **self._donor_columns(association_donors),
+        })
+
+    @staticmethod
+    def _donor_columns(donors: Optional[DonorSummary]) -> Dict[str, Any]:
+        """Donor-level columns of a table, none without donor statistics (unknown counts are -1)."""
+        if donors is None:
+            return {}
+        return {"donor_count": donors.donor_count, "donor_ratio_min": donors.ratio_min,
+                "donor_ratio_median": donors.ratio_median, "donor_ratio_max": donors.ratio_max}
+
+
+class SQLiteSink:
+    """
+    Writes the graph into an SQLite graph store (see `graph_store`).
+
+    The database may already hold other datasets; a dataset with the same ID is
+    replaced. All rows are inserted in one transaction with bulk inserts, and
+    the indexes are created (if missing) after loading. The donor columns are
+    NULL for graphs without donor-level statistics.
+    """
+
+    def __init__(self, output_file: str):
+        self.output_file = output_file
+
+    def write(self, graph: KnowledgeGraph) -> None:
+        conn = sqlite3.connect(self.output_file)
+        try:
+            conn.executescript(graph_store.SCHEMA)
+            graph_store.upgrade_schema(conn)
+            cell_sets = list(graph.iter_cell_set_records())
+            terms = list(graph.iter_term_records())
+            cell_set_donors, association_donors = graph.donor_summaries()
+            with conn:
+                graph_store.delete_dataset(conn, graph.dataset_id)
+                conn.execute(
+                    "INSERT INTO datasets VALUES (?, ?, ?, ?)",
+                    (graph.dataset_id, graph.name, graph.description, graph.donor_column),
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO term_classes VALUES (?, ?, ?)",
+                    [(term_class, collection, reverse_slot)
+                     for term_class, (collection, reverse_slot) in graph.term_classes.items()],
+                )
+                conn.executemany("INSERT INTO cell_sets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                    (cs.id, graph.dataset_id, cs.name, cs.description, cs.obs_column, cs.obs_value, cs.cell_count,
+                     terms[cs.predominantly_consists_of].id if cs.predominantly_consists_of >= 0 else None,
+                     cs.predominance_fraction, *donors)
+                    for cs, donors in zip(cell_sets, self._donor_rows(cell_set_donors, len(cell_sets)))
+                ))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO terms VALUES (?, ?, ?, ?, ?)",
+                    ((t.id, t.term_class, t.name, t.description, t.source_uri) for t in terms),
+                )
+                conn.executemany("INSERT INTO dataset_terms VALUES (?, ?)", ((graph.dataset_id, t.id) for t in terms))
+                conn.executemany("INSERT INTO subset_of VALUES (?, ?)", (
+                    (cs.id, cell_sets[p].id) for cs in cell_sets for p in (cs.subset_of or [])
+                ))
+
+                cell_set_ids = np.array([cs.id for cs in cell_sets], dtype=object)
+                overlaps = graph.overlap_arrays()
+                conn.executemany("INSERT INTO overlaps VALUES (?, ?, ?, ?, ?)", zip(
+                    cell_set_ids[overlaps.cell_set].tolist(),
+                    cell_set_ids[overlaps.other].tolist(),
+                    overlaps.count.tolist(),
+                    overlaps.jaccard.astype(str).astype(np.float64).tolist(),
+                    overlaps.overlap_coefficient.astype(str).astype(np.float64).tolist(),
+                ))
+
+                assoc = graph.association_arrays()
+                term_ids = np.array([t.id for t in terms], dtype=object)
+                conn.executemany("INSERT INTO associations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                    (*row, *donors) for row, donors in zip(zip(
+                        cell_set_ids[assoc.cell_set].tolist(),
+                        np.array(graph.association_slots, dtype=object)[assoc.slot].tolist(),
+                        term_ids[assoc.term].tolist(),
+                        assoc.count.tolist(),
+                        # Shortest decimal form of the stored float32 ratio, as in the other sinks
+                        assoc.cell_ratio.astype(str).astype(np.float64).tolist(),
+                    ), self._donor_rows(association_donors, len(assoc.count)))
+                ))
+            conn.executescript(graph_store.INDEXES)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _donor_rows(donors: Optional[DonorSummary], n: int) -> Iterator[Tuple]:
+        """Donor columns of each row, NULL where unknown (as the other sinks omit them)."""
+        if donors is None:
+            return repeat((None,) * len(graph_store.DONOR_SLOTS), n)
+        counts = [count if count >= 0 else None for count in donors.donor_count.tolist()]
+        ratios = [
+            [None if np.isnan(value) else value for value in np.asarray(values).astype(str).astype(np.float64).tolist()]
+            for values in donors[1:]
+        ]
+        return zip(counts, *ratios)
+
+
+# Sinks by format name
+SINKS = {
+    "json": JSONSink,
+    "yaml": YAMLSink,
+    "rdf": RDFSink,
+    "columnar": ColumnarSink,
+    "sqlite": SQLiteSink,
+}
+
+
+def get_sink(format: str, output: str, schema_file: Optional[str] = None):
+    """
+    Create the sink for an output format.
+
+    Args:
+        format: Output format (a key of SINKS).
+        output: Output file (or database for the sqlite sink), or directory for the columnar sink.
+        schema_file: LinkML schema declaring the prefixes of RDF output (default: SCHEMA_FILE).
+
+    Returns:
+        A sink instance.
+    """
+    try:
+        sink_class = SINKS[format.lower()]
+    except KeyError:
+        logger.error(f"Unsupported format: {format}")
+        raise ValueError(f"Unsupported format: {format}")
+    if sink_class is RDFSink:
+        return sink_class(output, schema_file)
+    return sink_class(output)
@@ -0,0 +1,517 @@
+"""
+Embedded SQLite store for knowledge graphs.
+
+`SQLiteSink` (in `graph_sinks`) writes graphs into a database with the tables
+below; several datasets can share one database. `GraphStore` reads it back
+and materializes only the requested part (one dataset, some obs columns, or
+a bounded number of cell sets) as dictionaries in the layout written by
+`save_objects`, so consumers never need the whole graph in memory.
+
+    datasets(id, name, description, donor_column)
+    cell_sets(id, dataset_id, name, description, obs_column, obs_value, cell_count,
+              predominantly_consists_of, predominant_cell_type_fraction,
+              donor_count, donor_ratio_min, donor_ratio_median, donor_ratio_max)
+    terms(id, term_class, name, description, source_uri)
+    term_classes(term_class, collection, reverse_slot)
+    dataset_terms(dataset_id, term_id)
+    subset_of(cell_set_id, parent_id)
+    overlaps(cell_set_id, other_id, intersection_count, jaccard, overlap_coefficient)
+    associations(cell_set_id, slot, term_id, count, cell_ratio,
+                 donor_count, donor_ratio_min, donor_ratio_median, donor_ratio_max)
+
+The donor columns are NULL for graphs without donor-level statistics. Rows keep their insertion order (rowid), which is the order of the graph.
+"""
+
+import logging
+import sqlite3
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    description TEXT,
+    donor_column TEXT
+);
+CREATE TABLE IF NOT EXISTS cell_sets (
+    id TEXT PRIMARY KEY,
+    dataset_id TEXT NOT NULL,
+    name TEXT,
+    description TEXT,
+    obs_column TEXT,
+    obs_value TEXT,
+    cell_count INTEGER,
+    predominantly_consists_of TEXT,
+    predominant_cell_type_fraction REAL,
+    donor_count INTEGER,
+    donor_ratio_min REAL,
+    donor_ratio_median REAL,
+    donor_ratio_max REAL
+);
+CREATE TABLE IF NOT EXISTS terms (
+    id TEXT PRIMARY KEY,
+    term_class TEXT NOT NULL,
+    name TEXT,
+    description TEXT,
+    source_uri TEXT
+);
+CREATE TABLE IF NOT EXISTS term_classes (
+    term_class TEXT PRIMARY KEY,
+    collection TEXT NOT NULL,
+    reverse_slot TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dataset_terms (
+    dataset_id TEXT NOT NULL,
+    term_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS subset_of (
+    cell_set_id TEXT NOT NULL,
+    parent_id TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS overlaps (
+    cell_set_id TEXT NOT NULL,
+    other_id TEXT NOT NULL,
+    intersection_count INTEGER NOT NULL,
+    jaccard REAL NOT NULL,
+    overlap_coefficient REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS associations (
+    cell_set_id TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    term_id TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    cell_ratio REAL NOT NULL,
+    donor_count INTEGER,
+    donor_ratio_min REAL,
+    donor_ratio_median REAL,
+    donor_ratio_max REAL
+);
+"""
+
+# Donor-level columns, missing from stores written before they were recorded
+DONOR_SLOTS = ("donor_count", "donor_ratio_min", "donor_ratio_median", "donor_ratio_max")
+_ADDED_COLUMNS = {
+    "datasets": (("donor_column", "TEXT"),),
+    "cell_sets": tuple(zip(DONOR_SLOTS, ("INTEGER", "REAL", "REAL", "REAL"))),
+    "associations": tuple(zip(DONOR_SLOTS, ("INTEGER", "REAL", "REAL", "REAL"))),
+}
+
+# Created after bulk loads, which are faster without them
+INDEXES = """
+CREATE INDEX IF NOT EXISTS cell_sets_dataset ON cell_sets (dataset_id);
+CREATE INDEX IF NOT EXISTS cell_sets_obs_column ON cell_sets (obs_column);
+CREATE INDEX IF NOT EXISTS cell_sets_cell_type ON cell_sets (predominantly_consists_of);
+CREATE INDEX IF NOT EXISTS dataset_terms_dataset ON dataset_terms (dataset_id);
+CREATE INDEX IF NOT EXISTS subset_of_cell_set ON subset_of (cell_set_id);
+CREATE INDEX IF NOT EXISTS subset_of_parent ON subset_of (parent_id);
+CREATE INDEX IF NOT EXISTS overlaps_cell_set ON overlaps (cell_set_id);
+CREATE INDEX IF NOT EXISTS overlaps_other ON overlaps (other_id);
+CREATE INDEX IF NOT EXISTS associations_cell_set ON associations (cell_set_id);
+CREATE INDEX IF NOT EXISTS associations_term ON associations (term_id);
+"""
+
+# Maximum number of cell set IDs per IN (...) query
+_BATCH_SIZE = 500
+
+
+def is_store_file(file_path: str) -> bool:
+    """Check whether a path names a graph store database (by extension)."""
+    return file_path.endswith((".sqlite", ".sqlite3", ".db"))
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def upgrade_schema(conn: sqlite3.Connection) -> None:
+    """Add the columns recorded since a store was written to its tables, so that new graphs can be added to it."""
+    for table, columns in _ADDED_COLUMNS.items():
+        existing = _columns(conn, table)
+        for name, column_type in columns:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+
+def delete_dataset(conn: sqlite3.Connection, dataset_id: str) -> None:
+    """Delete a dataset and its cell sets, edges and associations (terms are shared and kept)."""
+    selection = "SELECT id FROM cell_sets WHERE dataset_id = ?"
+    conn.execute(f"DELETE FROM associations WHERE cell_set_id IN ({selection})", (dataset_id,))
+    conn.execute(f"DELETE FROM subset_of WHERE cell_set_id IN ({selection})", (dataset_id,))
+    conn.execute(f"DELETE FROM overlaps WHERE cell_set_id IN ({selection})", (dataset_id,))
+    conn.execute("DELETE FROM cell_sets WHERE dataset_id = ?", (dataset_id,))
+    conn.execute("DELETE FROM dataset_terms WHERE dataset_id = ?", (dataset_id,))
+    conn.execute("DELETE FROM datasets WHERE id = ?", (dataset_id,))
+
+
+class GraphStore:
+    """
+    Read-only access to a graph store database.
+
+    Args:
+        store_file: Path to the SQLite database.
+    """
+
+    def __init__(self, store_file: str):
+        self.store_file = store_file
+        self._conn = sqlite3.connect(f"file:{store_file}?mode=ro", uri=True)
+        self._whole_dataset: Optional[str] = None
+        # Stores written before overlaps were recorded have no overlaps table
+        self._has_overlaps = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'overlaps'"
+        ).fetchone() is not None
+        # Nor donor columns before donor-level statistics were recorded
+        self._has_donors = "donor_count" in _columns(self._conn, "cell_sets")
+
+    def __enter__(self) -> "GraphStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def dataset_ids(self) -> List[str]:
+        """Get the IDs of the datasets in the store, in insertion order."""
+        return [row[0] for row in self._conn.execute("SELECT id FROM datasets ORDER BY rowid")]
+
+    def term_classes(self) -> Dict[str, Tuple[str, str]]:
+        """Get the term classes in the store, with their collection key and reverse slot."""
+        rows = self._conn.execute("SELECT term_class, collection, reverse_slot FROM term_classes ORDER BY rowid")
+        return {term_class: (collection, reverse_slot) for term_class, collection, reverse_slot in rows}
+
+    def select(
+        self,
+        dataset_id: Optional[str] = None,
+        obs_columns: Optional[Sequence[str]] = None,
+        cell_set_ids: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None,
+    ) -> int:
+        """
+        Select the cell sets that subsequent reads return.
+
+        Args:
+            dataset_id: Only cell sets of this dataset.
+            obs_columns: Only cell sets from these obs columns.
+            cell_set_ids: Only these cell sets.
+            limit: At most this many cell sets (the first ones in graph order).
+
+        Returns:
+            The number of selected cell sets.
+        """
+        sql = "INSERT INTO temp.selected SELECT c.id, c.rowid FROM cell_sets c"
+        if cell_set_ids is not None:
+            sql += " JOIN temp.requested r ON c.id = r.id"
+        where, params = [], []
+        if dataset_id is not None:
+            where.append("c.dataset_id = ?")
+            params.append(dataset_id)
+        if obs_columns:
+            where.append(f"c.obs_column IN ({','.join('?' * len(obs_columns))})")
+            params.extend(obs_columns)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY c.rowid"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self._conn:
+            self._conn.execute("DROP TABLE IF EXISTS temp.selected")
+            self._conn.execute("CREATE TEMP TABLE selected (id TEXT PRIMARY KEY, position INTEGER)")
+            if cell_set_ids is not None:
+                self._conn.execute("DROP TABLE IF EXISTS temp.requested")
+                self._conn.execute("CREATE TEMP TABLE requested (id TEXT PRIMARY KEY)")
+                self._conn.executemany("INSERT OR IGNORE INTO temp.requested VALUES (?)", ((i,) for i in cell_set_ids))
+            self._conn.execute(sql, params)
+        self._whole_dataset = dataset_id if not obs_columns and cell_set_ids is None and limit is None else None
+        return self._conn.execute("SELECT COUNT(*) FROM temp.selected").fetchone()[0]
+
+    def dataset_dict(self, dataset_id: str) -> Dict[str, Any]:
+        """Return the Dataset object for a dataset in the store."""
+        donor_column = "donor_column" if self._has_donors else "NULL"
+        row = self._conn.execute(
+            f"SELECT id, name, description, {donor_column} FROM datasets WHERE id = ?", (dataset_id,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"Dataset not found: {dataset_id}")
+        cell_sets = self._conn.execute("SELECT id FROM cell_sets WHERE dataset_id = ? ORDER BY rowid", (dataset_id,))
+        # Terms in the order of their class, then of the graph
+        terms = self._conn.execute(
+            "SELECT d.term_id FROM dataset_terms d JOIN terms t ON d.term_id = t.id "
+            "JOIN term_classes c ON t.term_class = c.term_class WHERE d.dataset_id = ? ORDER BY c.rowid, d.rowid",
+            (dataset_id,),
+        )
+        dataset = {
+            "id": row[0],
+            "name": row[1],
+            "description": row[2],
+            "cell_sets": [r[0] for r in cell_sets],
+            "ontology_terms": [r[0] for r in terms],
+        }
+        if row[3] is not None:
+            dataset["donor_column"] = row[3]
+        return dataset
+
+    def _donor_columns(self, alias: str) -> str:
+        """Select list of the donor columns of a table, NULLs for stores without them."""
+        if not self._has_donors:
+            return ", NULL" * len(DONOR_SLOTS)
+        return "".join(f", {alias}.{slot}" for slot in DONOR_SLOTS)
+
+    def _batch_rows(self, sql: str, ids: List[str]) -> Dict[str, List[Tuple]]:
+        rows = defaultdict(list)
+        for row in self._conn.execute(sql.format(ids=",".join("?" * len(ids))), ids):
+            rows[row[0]].append(row[1:])
+        return rows
+
+    def iter_cell_sets(self) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the selected cell sets as schema-shaped dictionaries.
+
+        Yields:
+            One dictionary per CellSet, in graph order.
+        """
+        cursor = self._conn.execute(
+            "SELECT c.id, c.name, c.description, c.obs_column, c.obs_value, c.cell_count, "
+            f"c.predominantly_consists_of, c.predominant_cell_type_fraction{self._donor_columns('c')} "
+            "FROM cell_sets c JOIN temp.selected s ON c.id = s.id ORDER BY s.position"
+        )
+        while True:
+            batch = cursor.fetchmany(_BATCH_SIZE)
+            if not batch:
+                break
+            ids = [row[0] for row in batch]
+            parents = self._batch_rows(
+                "SELECT cell_set_id, parent_id FROM subset_of WHERE cell_set_id IN ({ids}) ORDER BY rowid", ids,
+            )
+            overlaps = self._batch_rows(
+                "SELECT cell_set_id, other_id, intersection_count, jaccard, overlap_coefficient FROM overlaps "
+                "WHERE cell_set_id IN ({ids}) ORDER BY rowid", ids,
+            ) if self._has_overlaps else {}
+            associations = self._batch_rows(
+                f"SELECT a.cell_set_id, a.slot, a.term_id, a.count, a.cell_ratio{self._donor_columns('a')} "
+                "FROM associations a WHERE a.cell_set_id IN ({ids}) ORDER BY a.rowid", ids,
+            )
+            for id, name, description, obs_column, obs_value, cell_count, cell_type, fraction, *donors in batch:
+                obj = {
+                    "id": id,
+                    "name": name,
+                    "description": description,
+                    "obs_column": obs_column,
+                    "obs_value": obs_value,
+                    "cell_count": cell_count,
+                }
+                if cell_type is not None:
+                    obj["predominantly_consists_of"] = cell_type
+                if fraction is not None:
+                    obj["predominant_cell_type_fraction"] = fraction
+                obj.update((slot, value) for slot, value in zip(DONOR_SLOTS, donors) if value is not None)
+                if id in parents:
+                    obj["subset_of"] = [parent for parent, in parents[id]]
+                for other, count, jaccard, coefficient in overlaps.get(id, ()):
+                    obj.setdefault("overlaps_with", []).append({
+                        "cell_set": other,
+                        "intersection_count": count,
+                        "jaccard": jaccard,
+                        "overlap_coefficient": coefficient,
+                    })
+                for slot, term, count, cell_ratio, *donors in associations.get(id, ()):
+                    association = {"term": term, "count": count, "cell_ratio": cell_ratio}
+                    association.update((name, value) for name, value in zip(DONOR_SLOTS, donors) if value is not None)
+                    obj.setdefault(slot, []).append(association)
+                yield obj
+
+    def iter_terms(self, term_class: str) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the terms of a class referenced by the selected cell sets.
+
+        When a whole dataset is selected, all its terms are returned, including
+        those no cell set references. The reverse slot lists selected cell sets only.
+
+        Args:
+            term_class: The term class.
+
+        Yields:
+            One dictionary per term.
+        """
+        reverse_slot = self.term_classes()[term_class][1]
+        if reverse_slot == "predominantly_in":
+            refs = self._conn.execute(
+                "SELECT c.predominantly_consists_of, c.id FROM cell_sets c JOIN temp.selected s ON c.id = s.id "
+                "WHERE c.predominantly_consists_of IS NOT NULL ORDER BY s.position"
+            )
+        else:
+            refs = self._conn.execute(
+                "SELECT a.term_id, a.cell_set_id FROM associations a JOIN temp.selected s ON a.cell_set_id = s.id "
+                "JOIN terms t ON a.term_id = t.id WHERE t.term_class = ? ORDER BY s.position, a.rowid",
+                (term_class,),
+            )
+        referenced_by = defaultdict(list)
+        for term_id, cell_set_id in refs:
+            referenced_by[term_id].append(cell_set_id)
+
+        if self._whole_dataset is not None:
+            terms = self._conn.execute(
+                "SELECT t.id, t.name, t.description, t.source_uri FROM dataset_terms d JOIN terms t ON d.term_id = t.id "
+                "WHERE d.dataset_id = ? AND t.term_class = ? ORDER BY d.rowid",
+                (self._whole_dataset, term_class),
+            )
+        else:
+            terms = (
+                row for term_id in referenced_by for row in self._conn.execute(
+                    "SELECT id, name, description, source_uri FROM terms WHERE id = ?", (term_id,)
+                )
+            )
+        for id, name, description, source_uri in terms:
+            yield {
+                "id": id,
+                "name": name,
+                "description": description,
+                "source_uri": source_uri,
+                reverse_slot: referenced_by.get(id, []),
+            }
+
+    def iter_collections(self) -> Iterator[Tuple[str, Iterator[Dict[str, Any]]]]:
+        """
+        Iterate over the collections of the selection.
+
+        Yields:
+            (collection key, iterator of objects) for cell sets and each term class.
+        """
+        yield "cell_sets", self.iter_cell_sets()
+        for term_class, (collection, _) in self.term_classes().items():
+            yield collection, self.iter_terms(term_class)
+
+    def load(
+        self,
+        dataset_id: Optional[str] = None,
+        obs_columns: Optional[Sequence[str]] = None,
+        cell_set_ids: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Materialize a subgraph in the layout written by `save_objects`.
+
+        Args:
+            dataset_id: Dataset to read (default: the only dataset in the store).
+            obs_columns: Only cell sets from these obs columns.
+            cell_set_ids: Only these cell sets.
+            limit: At most this many cell sets.
+
+        Returns:
+            A dictionary with the dataset and one list per collection.
+        """
+        if dataset_id is None:
+            dataset_ids = self.dataset_ids()
+            if len(dataset_ids) != 1:
+                raise ValueError(f"{self.store_file} holds {len(dataset_ids)} datasets; select one by ID")
+            dataset_id = dataset_ids[0]
+        n_selected = self.select(dataset_id, obs_columns, cell_set_ids, limit)
+        logger.info(f"Loading {n_selected} cell sets of dataset {dataset_id} from {self.store_file}")
+        objects = {"dataset": self.dataset_dict(dataset_id)}
+        for key, items in self.iter_collections():
+            objects[key] = list(items)
+        return objects
+
+    def _batched(self, sql: str, ids: Sequence[str], params: Sequence[Any] = ()) -> Iterator[Tuple]:
+        for start in range(0, len(ids), _BATCH_SIZE):
+            batch = list(ids[start:start + _BATCH_SIZE])
+            yield from self._conn.execute(sql.format(ids=",".join("?" * len(batch))), [*batch, *params])
+
+    @staticmethod
+    def _cell_set_filter(
+        dataset_id: Optional[str] = None,
+        obs_columns: Optional[Sequence[str]] = None,
+    ) -> Tuple[str, Tuple[Any, ...]]:
+        """SQL condition (on a `{column}` placeholder) and parameters restricting cell set IDs to a dataset and obs columns."""
+        where, params = [], []
+        if dataset_id is not None:
+            where.append("dataset_id = ?")
+            params.append(dataset_id)
+        if obs_columns:
+            where.append(f"obs_column IN ({','.join('?' * len(obs_columns))})")
+            params.extend(obs_columns)
+        if not where:
+            return "", ()
+        return f" AND {{column}} IN (SELECT id FROM cell_sets WHERE {' AND '.join(where)})", tuple(params)
+
+    def edges_of(
+        self,
+        node_ids: Sequence[str],
+        include_metadata: bool = True,
+        dataset_id: Optional[str] = None,
+        obs_columns: Optional[Sequence[str]] = None,
+    ) -> List[Tuple[str, str, str, Dict[str, Any]]]:
+        """
+        Get the edges touching some nodes, in either direction, through the indexes.
+
+        Edges run from cell sets to their parents, overlapping cell sets,
+        predominant cell type and metadata terms; nodes may be cell sets or terms.
+
+        Args:
+            node_ids: IDs of cell sets and/or terms.
+            include_metadata: Whether to include `has_*` association edges.
+            dataset_id: Only edges of cell sets of this dataset (default: all datasets).
+            obs_columns: Only edges of cell sets from these obs columns (default: all columns).
+
+        Returns:
+            (source, target, edge type, attributes) of each edge.
+        """
+        node_ids = list(node_ids)
+        # Restrict the cell set ends of each edge to the dataset and obs columns
+        in_selection, params = self._cell_set_filter(dataset_id, obs_columns)
+        both_in_selection = in_selection + in_selection.replace("{column}", "{other}")
+        edges = []
+        for column in ("cell_set_id", "parent_id"):
+            sql = f"SELECT cell_set_id, parent_id FROM subset_of WHERE {column} IN ({{ids}})"
+            sql += both_in_selection.format(column="cell_set_id", other="parent_id")
+            for source, target in self._batched(sql, node_ids, params * 2):
+                edges.append((source, target, "subset_of", {}))
+        for column in ("cell_set_id", "other_id") if self._has_overlaps else ():
+            sql = f"SELECT cell_set_id, other_id, jaccard FROM overlaps WHERE {column} IN ({{ids}})"
+            sql += both_in_selection.format(column="cell_set_id", other="other_id")
+            for source, target, jaccard in self._batched(sql, node_ids, params * 2):
+                edges.append((source, target, "overlaps_with", {"jaccard": jaccard}))
+        for column in ("id", "predominantly_consists_of"):
+            sql = (f"SELECT id, predominantly_consists_of FROM cell_sets WHERE {column} IN ({{ids}}) "
+                   "AND predominantly_consists_of IS NOT NULL")
+            for source, target in self._batched(sql + in_selection.format(column="id"), node_ids, params):
+                edges.append((source, target, "predominantly_consists_of", {}))
+        if include_metadata:
+            for column in ("cell_set_id", "term_id"):
+                sql = f"SELECT cell_set_id, term_id, slot, count FROM associations WHERE {column} IN ({{ids}})"
+                for source, target, slot, count in self._batched(sql + in_selection.format(column="cell_set_id"), node_ids, params):
+                    edges.append((source, target, slot, {"count": count}))
+        return edges
+
+    def nodes(
+        self,
+        node_ids: Sequence[str],
+        dataset_id: Optional[str] = None,
+        obs_columns: Optional[Sequence[str]] = None,
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the names and classes of some cell sets and terms.
+
+        Args:
+            node_ids: IDs of cell sets and/or terms.
+            dataset_id: Only cell sets of this dataset (default: all datasets).
+            obs_columns: Only cell sets from these obs columns (default: all columns).
+
+        Returns:
+            By ID, a dictionary with the node's id, name and term_class
+            ("CellSet" for cell sets, which also have a cell_count).
+        """
+        node_ids = list(node_ids)
+        in_selection, params = self._cell_set_filter(dataset_id, obs_columns)
+        sql = "SELECT id, name, cell_count FROM cell_sets WHERE id IN ({ids})" + in_selection.format(column="id")
+        nodes = {}
+        for id, name, cell_count in self._batched(sql, node_ids, params):
+            nodes[id] = {"id": id, "name": name, "term_class": "CellSet", "cell_count": cell_count}
+        for id, name, term_class in self._batched("SELECT id, name, term_class FROM terms WHERE id IN ({ids})", node_ids):
+            nodes[id] = {"id": id, "name": name, "term_class": term_class}
+        return nodes
@@ -0,0 +1,171 @@
+"""
+Writing cell set IDs back into the input AnnData file in place.
+
+The original h5ad file (or Zarr store) is opened for appending and only the
+cell set ID obs columns (one categorical column per annotation column) and a
+`uns` entry holding the graph's dataset ID are added or replaced; X, layers
+and the other elements are left untouched.
+
+HDF5 does not reclaim the space of replaced columns, so an h5ad file grows by
+the size of the ID columns (about one byte per cell and column) each time
+they are rewritten; `h5repack` compacts it.
+"""
+
+import logging
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import numpy as np
+
+from instrumentation import NULL_PROFILER, Profiler
+from knowledge_graph import KnowledgeGraph
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Suffix of the obs column holding the cell set IDs of an annotation column
+CELL_SET_ID_SUFFIX = "_cell_set_id"
+
+# Key of the uns entry holding the dataset ID of the knowledge graph
+DATASET_ID_KEY = "kg_dataset_id"
+
+
+def cell_set_id_columns(
+    kg: KnowledgeGraph,
+    obs: "pd.DataFrame",
+    suffix: str = CELL_SET_ID_SUFFIX,
+) -> Dict[str, "pd.Categorical"]:
+    """
+    Map the annotation columns of the cell sets to per-cell cell set IDs.
+
+    Args:
+        kg: The knowledge graph built from obs.
+        obs: The obs columns the cell sets were built from.
+        suffix: Suffix appended to the annotation column names.
+
+    Returns:
+        Dictionary of ID column name -> categorical of cell set IDs (missing for
+        cells without a cell set).
+    """
+    import pandas as pd
+
+    from populate_schema import _column_codes
+
+    ids_by_column: Dict[str, Dict[str, str]] = {}
+    for record in kg.iter_cell_set_records():
+        ids_by_column.setdefault(record.obs_column, {})[record.obs_value] = record.id
+
+    columns = {}
+    for col, ids in ids_by_column.items():
+        if col not in obs.columns:
+            logger.warning(f"Column {col} not found in AnnData.obs, not writing its cell set IDs")
+            continue
+        codes, categories = _column_codes(obs[col])
+        id_categories = list(ids.values())
+        position = {cell_set_id: i for i, cell_set_id in enumerate(id_categories)}
+        # Category code -> cell set ID code, with -1 (and the -1 code itself) for cells without a cell set
+        lookup = np.array(
+            [position.get(ids.get(str(value)), -1) for value in categories] + [-1],
+            dtype=np.int32 if len(id_categories) > np.iinfo(np.int16).max else np.int16,
+        )
+        columns[f"{col}{suffix}"] = pd.Categorical.from_codes(lookup[codes], categories=id_categories)
+    return columns
+
+
+def _open(file_path: str, is_zarr: bool) -> Any:
+    if is_zarr:
+        import zarr
+
+        # Edit the group metadata itself; the consolidated copy is rewritten afterwards
+        kwargs = {"use_consolidated": False} if int(zarr.__version__.split(".")[0]) >= 3 else {}
+        return zarr.open_group(file_path, mode="r+", **kwargs)
+    import h5py
+
+    return h5py.File(file_path, "r+")
+
+
+def _set_column_order(group: Any, order: List[str]) -> None:
+    if hasattr(group, "file"):
+        import h5py
+
+        group.attrs["column-order"] = np.array(order, dtype=h5py.string_dtype())
+    else:
+        group.attrs["column-order"] = order
+
+
+def write_back(
+    file_path: str,
+    kg: KnowledgeGraph,
+    obs: "pd.DataFrame",
+    suffix: str = CELL_SET_ID_SUFFIX,
+    dataset_id_key: str = DATASET_ID_KEY,
+    profiler: Optional[Profiler] = None,
+) -> List[str]:
+    """
+    Add or replace the cell set ID columns and the dataset ID in an AnnData file in place.
+
+    Args:
+        file_path: Path to the h5ad file or AnnData Zarr store the graph was built from.
+        kg: The knowledge graph.
+        obs: The obs columns the cell sets were built from.
+        suffix: Suffix appended to the annotation column names.
+        dataset_id_key: Key of the uns entry holding the dataset ID.
+        profiler: Optional profiler recording the time spent writing.
+
+    Returns:
+        The names of the obs columns written.
+    """
+    try:
+        from anndata.io import write_elem
+    except ImportError:  # anndata < 0.11
+        from anndata.experimental import write_elem
+
+    profiler = profiler or NULL_PROFILER
+    with profiler.stage("write_back") as stage:
+        columns = cell_set_id_columns(kg, obs, suffix)
+        _write_elements(file_path, len(obs), columns, {dataset_id_key: kg.dataset_id}, write_elem)
+        stage.add_items(len(obs))
+
+    logger.info(f"Wrote {len(columns)} cell set ID columns and uns['{dataset_id_key}'] to {file_path}")
+    return list(columns)
+
+
+def _write_elements(
+    file_path: str,
+    n_obs: int,
+    columns: Dict[str, "pd.Categorical"],
+    uns_entries: Dict[str, Any],
+    write_elem: Any,
+) -> None:
+    from zarr_obs import is_zarr_store
+
+    is_zarr = is_zarr_store(file_path)
+    root = _open(file_path, is_zarr)
+    try:
+        obs_group = root["obs"]
+        n_file = obs_group[obs_group.attrs["_index"]].shape[0]
+        if n_file != n_obs:
+            raise ValueError(f"{file_path} has {n_file} cells, the knowledge graph was built from {n_obs}")
+
+        order = [str(col) for col in obs_group.attrs.get("column-order", [])]
+        for name, values in columns.items():
+            if name in obs_group:
+                del obs_group[name]
+            write_elem(obs_group, name, values)
+            if name not in order:
+                order.append(name)
+        _set_column_order(obs_group, order)
+
+        uns = root["uns"] if "uns" in root else root.create_group("uns")
+        for key, value in uns_entries.items():
+            if key in uns:
+                del uns[key]
+            write_elem(uns, key, value)
+    finally:
+        if not is_zarr:
+            root.close()
+    if is_zarr:
+        import zarr
+
+        zarr.consolidate_metadata(file_path)
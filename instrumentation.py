@@ -0,0 +1,273 @@
+"""
+Lightweight stage-level instrumentation for the schema population pipeline.
+
+A `Profiler` records wall time, CPU time, the process peak RSS and item counts
+for named stages (optionally labelled, e.g. per obs column) and writes them as
+a JSON report or in the Prometheus text exposition format. A stage's CPU time
+is that of the thread running it, so concurrent stages do not count each
+other's work; work it hands to other threads or processes is not included. Code under measurement
+always talks to a profiler; when profiling is disabled it gets
+`NULL_PROFILER`, whose methods do nothing.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def get_peak_rss_bytes() -> Optional[int]:
+    """
+    Get the peak resident set size of the current process.
+
+    Returns:
+        The peak RSS in bytes, or None if it cannot be determined on this platform.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageMetrics:
+    """
+    Accumulated metrics for one (stage, labels) combination.
+
+    Updates take the lock of the owning profiler, so threads running the same
+    stage can record into one instance.
+    """
+
+    __slots__ = ("stage", "labels", "calls", "wall_time", "cpu_time", "process_peak_rss_bytes_at_exit", "items", "_lock")
+
+    def __init__(self, stage: str, labels: Dict[str, str], lock: Optional[threading.Lock] = None):
+        self._lock = lock or threading.Lock()
+        self.stage = stage
+        self.labels = labels
+        self.calls = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        # Peak RSS of the whole process (not of the stage) when the stage last exited
+        self.process_peak_rss_bytes_at_exit = None
+        self.items = 0
+
+    def add_items(self, n: int) -> None:
+        """Add to the number of items processed by this stage."""
+        n = int(n)
+        with self._lock:
+            self.items += n
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the metrics as a JSON-serializable dictionary."""
+        return {
+            "stage": self.stage,
+            "labels": self.labels,
+            "calls": self.calls,
+            "wall_time_seconds": self.wall_time,
+            "cpu_time_seconds": self.cpu_time,
+            "process_peak_rss_bytes_at_exit": self.process_peak_rss_bytes_at_exit,
+            "items": self.items,
+        }
+
+
+class Profiler:
+    """
+    Collects per-stage metrics.
+
+    Stages nest: a stage entered while another is active (in the same thread)
+    is recorded under "<parent>/<child>", so the report mirrors the call
+    structure. Threads have their own stage stacks, so concurrent pipeline
+    stages can share one profiler.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self._metrics: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], StageMetrics] = {}
+        # Guards the metrics shared by threads running the same stage
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._wall_started = time.perf_counter()
+        self._cpu_started = time.process_time()
+
+    @property
+    def _stack(self) -> List[str]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _get(self, stage: str, labels: Dict[str, Any]) -> StageMetrics:
+        labels = {k: str(v) for k, v in labels.items()}
+        key = (stage, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._metrics:
+                self._metrics[key] = StageMetrics(stage, labels, self._lock)
+            return self._metrics[key]
+
+    @contextmanager
+    def stage(self, name: str, **labels: Any) -> Iterator[StageMetrics]:
+        """
+        Measure a block of code as a named stage.
+
+        Args:
+            name: Name of the stage.
+            **labels: Extra labels distinguishing repeated stages (e.g. column=...).
+
+        Yields:
+            The `StageMetrics` record, so the block can report item counts.
+        """
+        full_name = "/".join(self._stack + [name])
+        metrics = self._get(full_name, labels)
+        self._stack.append(name)
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield metrics
+        finally:
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.thread_time() - cpu_start
+            peak_rss = get_peak_rss_bytes()
+            with self._lock:
+                metrics.wall_time += wall_time
+                metrics.cpu_time += cpu_time
+                metrics.process_peak_rss_bytes_at_exit = peak_rss
+                metrics.calls += 1
+            self._stack.pop()
+
+    def count(self, name: str, n: int, **labels: Any) -> None:
+        """
+        Record item counts for a stage without timing it.
+
+        Args:
+            name: Name of the stage, relative to the currently active stage.
+            n: Number of items to add.
+            **labels: Extra labels for the stage.
+        """
+        self._get("/".join(self._stack + [name]), labels).add_items(n)
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Build the machine-readable report.
+
+        Returns:
+            A dictionary with overall totals and one entry per recorded stage.
+        """
+        return {
+            "total_wall_time_seconds": time.perf_counter() - self._wall_started,
+            "total_cpu_time_seconds": time.process_time() - self._cpu_started,
+            "peak_rss_bytes": get_peak_rss_bytes(),
+            "pid": os.getpid(),
+            "stages": [m.to_dict() for m in list(self._metrics.values())],
+        }
+
+    def write_json(self, output_file: str) -> None:
+        """Write the report as JSON."""
+        with open(output_file, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        logger.info(f"Saved profiling report to {output_file}")
+
+    def write_prometheus(self, output_file: str) -> None:
+        """Write the report in the Prometheus text exposition format."""
+        with open(output_file, "w") as f:
+            f.write(format_prometheus(self.report()))
+        logger.info(f"Saved Prometheus metrics to {output_file}")
+
+
+class _NullStage:
+    """Stand-in for `StageMetrics` when profiling is disabled."""
+
+    __slots__ = ()
+
+    def add_items(self, n: int) -> None:
+        pass
+
+
+class _NullStageContext:
+    """Reusable no-op context manager returned by `NullProfiler.stage`."""
+
+    __slots__ = ()
+    _stage = _NullStage()
+
+    def __enter__(self) -> _NullStage:
+        return self._stage
+
+    def __exit__(self, *exc_info) -> bool:
+        return False
+
+
+class NullProfiler:
+    """A profiler that records nothing, used when profiling is disabled."""
+
+    enabled = False
+    _context = _NullStageContext()
+
+    def stage(self, name: str, **labels: Any) -> _NullStageContext:
+        return self._context
+
+    def count(self, name: str, n: int, **labels: Any) -> None:
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_prometheus(report: Dict[str, Any], prefix: str = "cxg_kg") -> str:
+    """
+    Format a profiling report in the Prometheus text exposition format.
+
+    Args:
+        report: A report as returned by `Profiler.report`.
+        prefix: Metric name prefix.
+
+    Returns:
+        The metrics as text.
+    """
+    metrics = [
+        ("stage_wall_seconds", "wall_time_seconds", "Wall-clock time spent in a pipeline stage."),
+        ("stage_cpu_seconds", "cpu_time_seconds", "CPU time of the thread running a pipeline stage."),
+        ("stage_exit_process_peak_rss_bytes", "process_peak_rss_bytes_at_exit",
+         "Process peak resident set size when a pipeline stage last exited."),
+        ("stage_items", "items", "Number of items processed by a pipeline stage."),
+        ("stage_calls", "calls", "Number of times a pipeline stage was entered."),
+    ]
+
+    lines = []
+    for metric, key, help_text in metrics:
+        name = f"{prefix}_{metric}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for stage in report["stages"]:
+            if stage[key] is None:
+                continue
+            labels = {"stage": stage["stage"], **stage["labels"]}
+            label_text = ",".join(f'{k}="{_escape_label_value(v)}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {stage[key]}")
+
+    for metric, key, help_text in [
+        ("wall_seconds", "total_wall_time_seconds", "Total wall-clock time of the run."),
+        ("cpu_seconds", "total_cpu_time_seconds", "Total CPU time of the run."),
+        ("peak_rss_bytes", "peak_rss_bytes", "Peak resident set size of the run."),
+    ]:
+        if report[key] is None:
+            continue
+        name = f"{prefix}_{metric}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {report[key]}")
+
+    return "\n".join(lines) + "\n"
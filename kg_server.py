@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+"""
+Long-lived server running populate and validate jobs on warm worker processes.
+
+Jobs are posted as JSON to `POST /jobs` over HTTP, on a local TCP port or a
+Unix socket:
+
+    {"command": "populate", "args": ["data.h5ad", "-o", "data.json"], "cwd": "/data"}
+
+`args` are the command line options of the corresponding script and `cwd`
+(optional) is the directory relative paths are resolved against. The response
+is sent when the job finishes:
+
+    {"status": "ok", "command": "populate", "seconds": 0.41, "result": {...}}
+
+Each worker process imports the stack once and keeps compiled schema
+validators and label indexes across jobs. The number of running and queued
+jobs is bounded; when the bound is reached, new jobs are answered with 503.
+
+If a worker process dies (e.g. killed for running out of memory), the pool
+is replaced by a fresh warm one. Every job in flight fails with the broken
+pool, and the job that killed the worker cannot be told apart from the
+others, so they are all run once more on the new pool; a job whose worker
+dies again is answered with 500.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from validate_data import SCHEMA_FILE
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DESCRIPTION = "Serve populate and validate jobs from warm worker processes"
+
+# Commands accepted by the server: name -> module
+JOB_COMMANDS = {
+    "populate": "populate_schema",
+    "validate": "validate_data",
+}
+
+
+def _warm_worker(schema_file: Optional[str]) -> None:
+    """Worker initializer: import the stack and compile the schema validator once."""
+    import anndata  # noqa: F401
+    import linkml_runtime.utils.formatutils  # noqa: F401
+    import populate_schema  # noqa: F401
+    import validate_data
+
+    if schema_file is not None:
+        try:
+            validate_data.get_validator(schema_file)
+        except Exception as e:
+            logger.warning(f"Could not compile validator for {schema_file}: {e}")
+    logger.info(f"Worker {os.getpid()} ready")
+
+
+def _parse_job_args(module: Any, command: str, argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog=command, exit_on_error=False)
+    module.add_arguments(parser)
+    try:
+        return parser.parse_args(argv)
+    except SystemExit:
+        # argparse exits on some errors (e.g. missing arguments) even with exit_on_error=False
+        raise ValueError(f"Invalid arguments for {command}: {argv}")
+
+
+def run_job(command: str, argv: List[str], cwd: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Run one job in the current (worker) process.
+
+    Args:
+        command: "populate" or "validate".
+        argv: Command line options of the script.
+        cwd: Directory relative paths are resolved against (default: the server's).
+
+    Returns:
+        A JSON-serializable job result.
+    """
+    import importlib
+
+    module = importlib.import_module(JOB_COMMANDS[command])
+    started = time.perf_counter()
+    previous_cwd = os.getcwd()
+    if cwd is not None:
+        os.chdir(cwd)
+    try:
+        args = _parse_job_args(module, command, argv)
+        if command == "populate":
+            kg = module.run(args)
+            result = {
+                "output": os.path.abspath(args.output),
+                "cell_sets": kg.n_cell_sets,
+                "terms": kg.n_terms,
+                "associations": kg.n_associations,
+            }
+            status = "ok"
+        else:
+            for path in (args.schema, args.data_file):
+                if not os.path.exists(path):
+                    raise FileNotFoundError(f"File not found: {path}")
+            errors = module.validate_file(
+                args.data_file, args.schema, args.dataset_id, args.typed,
+                cache_file=None if args.no_cache else args.cache, cache_size=args.cache_size,
+                metadata_config=args.metadata_config,
+            )
+            result = {"errors": errors}
+            status = "invalid" if errors else "ok"
+    finally:
+        os.chdir(previous_cwd)
+    return {"status": status, "command": command, "seconds": round(time.perf_counter() - started, 4), "result": result}
+
+
+class JobServer:
+    """
+    Bounded pool of warm worker processes.
+
+    Args:
+        workers: Number of worker processes.
+        max_pending: Maximum number of running and queued jobs.
+        schema_file: Schema whose validator each worker compiles at startup.
+    """
+
+    def __init__(self, workers: int, max_pending: int, schema_file: Optional[str] = None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.schema_file = schema_file
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+        # Held while the pool is replaced, so that concurrent failures replace it once
+        self._pool_lock = threading.Lock()
+        self._pool = self._new_pool()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # Spawned workers do not inherit the server's threads or sockets
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_worker,
+            initargs=(self.schema_file,),
+        )
+
+    def _replace_pool(self, broken: ProcessPoolExecutor) -> None:
+        """Replace a broken pool by a fresh warm one, unless another job already did."""
+        with self._pool_lock:
+            if self._pool is not broken:
+                return
+            logger.warning("A worker process died; restarting the worker pool")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._new_pool()
+            self.warm_up()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def submit(self, job: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        Run a job and wait for its result.
+
+        Args:
+            job: The decoded request body.
+
+        Returns:
+            Tuple of (HTTP status code, response body).
+        """
+        command = job.get("command")
+        argv = job.get("args", [])
+        if command not in JOB_COMMANDS or not isinstance(argv, list) or not all(isinstance(a, str) for a in argv):
+            return 400, {"status": "error", "error": f"Expected a command in {sorted(JOB_COMMANDS)} and a list of string args"}
+        if not self._slots.acquire(blocking=False):
+            return 503, {"status": "busy", "error": f"{self.max_pending} jobs already pending"}
+        with self._lock:
+            self._pending += 1
+        try:
+            for _ in range(2):
+                pool = self._pool
+                try:
+                    return 200, pool.submit(run_job, command, argv, job.get("cwd")).result()
+                except BrokenProcessPool:
+                    self._replace_pool(pool)
+            logger.error(f"Job {command} {argv} failed: a worker process died while it was running")
+            return 500, {"status": "error", "command": command, "error": "A worker process died while the job was running"}
+        except Exception as e:
+            logger.error(f"Job {command} {argv} failed: {e}")
+            return 500, {"status": "error", "command": command, "error": str(e)}
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+
+    def warm_up(self) -> None:
+        """Start all workers now instead of on the first jobs."""
+        for future in [self._pool.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self) -> None:
+        self._pool.shutdown()
+
+
+class _JobHandler(BaseHTTPRequestHandler):
+    server_version = "cxg-kg"
+
+    def _send(self, code: int, body: Dict[str, Any]) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        if self.path != "/health":
+            self._send(404, {"status": "error", "error": "Not found"})
+            return
+        jobs = self.server.jobs
+        self._send(200, {"status": "ok", "workers": jobs.workers, "pending": jobs.pending, "max_pending": jobs.max_pending})
+
+    def do_POST(self) -> None:
+        if self.path != "/jobs":
+            self._send(404, {"status": "error", "error": "Not found"})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError as e:
+            self._send(400, {"status": "error", "error": f"Invalid JSON: {e}"})
+            return
+        if not isinstance(job, dict):
+            self._send(400, {"status": "error", "error": "Expected a JSON object"})
+            return
+        self._send(*self.server.jobs.submit(job))
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+def _terminate(signum: int, frame: Any) -> None:
+    """Shut down on SIGTERM as on Ctrl-C."""
+    raise KeyboardInterrupt
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self) -> Tuple[socket.socket, Tuple]:
+        request, _ = super().get_request()
+        return request, ()
+
+
+def serve(
+    workers: int = 4,
+    max_pending: Optional[int] = None,
+    socket_path: Optional[str] = None,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    schema_file: Optional[str] = SCHEMA_FILE,
+) -> None:
+    """
+    Serve jobs until interrupted.
+
+    Args:
+        workers: Number of worker processes.
+        max_pending: Maximum number of running and queued jobs (default: 2 * workers).
+        socket_path: Listen on this Unix socket instead of TCP.
+        host: TCP host to listen on.
+        port: TCP port to listen on.
+        schema_file: Schema whose validator each worker compiles at startup.
+    """
+    if schema_file is not None and not os.path.exists(schema_file):
+        schema_file = None
+    jobs = JobServer(workers, max_pending or 2 * workers, schema_file)
+    jobs.warm_up()
+
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        httpd = _UnixHTTPServer(socket_path, _JobHandler)
+        address = socket_path
+    else:
+        httpd = ThreadingHTTPServer((host, port), _JobHandler)
+        address = f"http://{host}:{httpd.server_address[1]}"
+    httpd.jobs = jobs
+
+    logger.info(f"Serving jobs on {address} with {workers} workers")
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        httpd.server_close()
+        jobs.shutdown()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line options of this script to a parser."""
+    parser.add_argument("--workers", type=int, default=4, help="Number of worker processes (default: 4)")
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="Maximum number of running and queued jobs; more are rejected with 503 (default: 2 * workers)")
+    parser.add_argument("--socket", default=None, help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP host to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port to listen on (default: 8765)")
+    parser.add_argument("--schema", "-s", default=SCHEMA_FILE,
+                        help="Schema whose validator is compiled when workers start "
+                             "(default: single_cell_schema.yaml next to this script)")
+
+
+def run(args: argparse.Namespace) -> None:
+    """Run the script with parsed command line options."""
+    serve(
+        workers=args.workers,
+        max_pending=args.max_pending,
+        socket_path=args.socket,
+        host=args.host,
+        port=args.port,
+        schema_file=args.schema,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,774 @@
+"""
+In-memory knowledge graph builder for single cell transcriptomics datasets.
+
+`KnowledgeGraph` holds the entities extracted from one dataset (cell sets,
+ontology terms and the metadata associations between them) as compact slotted
+records that reference each other by integer index. Metadata associations and
+overlaps between cell sets are kept in typed parallel arrays. Objects are only
+materialized when iterating or writing the graph, as the record classes
+generated from the schema (`records`), whose constructors check every slot, so
+the written graph is valid by construction. The graph can be written to any
+of the sinks in `graph_sinks`.
+"""
+
+import logging
+import uuid
+from typing import Dict, Any, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import records
+
+logger = logging.getLogger(__name__)
+
+# Default ontology term classes, with the key of their collection in the
+# serialized graph and the slot listing the cell sets that reference them.
+# Further classes can be registered per graph with `register_term_class`.
+TERM_CLASSES = {
+    "CellType": ("cell_types", "predominantly_in"),
+    "Tissue": ("tissues", "present_in_cell_sets"),
+    "Disease": ("diseases", "present_in_cell_sets"),
+    "DevelopmentalStage": ("developmental_stages", "present_in_cell_sets"),
+    "Assay": ("assays", "present_in_cell_sets"),
+}
+
+# Default cell set slots holding metadata associations, in serialization order
+ASSOCIATION_SLOTS = ["has_tissue", "has_disease", "has_developmental_stage", "has_assay"]
+
+
+class CellSetRecord:
+    """A set of cells sharing a common annotation value in one obs column."""
+
+    __slots__ = ("id", "name", "description", "obs_column", "obs_value", "cell_count",
+                 "subset_of", "predominantly_consists_of", "predominance_fraction")
+
+    def __init__(self, id: str, name: str, description: str, obs_column: str, obs_value: str, cell_count: int):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.obs_column = obs_column
+        self.obs_value = obs_value
+        self.cell_count = cell_count
+        # Indexes of parent cell sets, allocated on first use
+        self.subset_of: Optional[List[int]] = None
+        # Index of the predominant cell type term, or -1
+        self.predominantly_consists_of = -1
+        # Fraction of cells of the predominant cell type, if it was inferred
+        self.predominance_fraction: Optional[float] = None
+
+
+class TermRecord:
+    """An ontology term referenced by the graph."""
+
+    __slots__ = ("id", "term_class", "name", "description", "source_uri")
+
+    def __init__(self, id: str, term_class: str, name: str, description: str, source_uri: str):
+        self.id = id
+        self.term_class = term_class
+        self.name = name
+        self.description = description
+        self.source_uri = source_uri
+
+
+class AssociationArrays(NamedTuple):
+    """Column views of the metadata associations, one entry per association."""
+
+    cell_set: np.ndarray  # int32 cell set index
+    slot: np.ndarray  # int8 index into KnowledgeGraph.association_slots
+    term: np.ndarray  # int32 term index
+    count: np.ndarray  # int64 number of cells
+    cell_ratio: np.ndarray  # float32 fraction of the cell set
+
+
+class AssociationTable:
+    """
+    Growable typed parallel arrays holding metadata associations.
+
+    Capacity doubles as needed, so appending is amortized O(1) per association
+    and batches are copied in with a single slice assignment.
+    """
+
+    DTYPES = AssociationArrays(np.int32, np.int8, np.int32, np.int64, np.float32)
+
+    def __init__(self, capacity: int = 1024):
+        self._columns = [np.empty(capacity, dtype=dtype) for dtype in self.DTYPES]
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, n: int) -> None:
+        capacity = len(self._columns[0])
+        if self._size + n <= capacity:
+            return
+        while capacity < self._size + n:
+            capacity *= 2
+        for i, column in enumerate(self._columns):
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[i] = grown
+
+    def append(self, cell_set, slot, term, count, cell_ratio) -> None:
+        """
+        Append one or more associations.
+
+        Args:
+            cell_set: Cell set index or array of indexes.
+            slot: Slot index (scalar or array).
+            term: Term index or array of indexes.
+            count: Cell count or array of counts.
+            cell_ratio: Cell ratio or array of ratios.
+        """
+        n = len(np.atleast_1d(count))
+        self._reserve(n)
+        for column, values in zip(self._columns, (cell_set, slot, term, count, cell_ratio)):
+            column[self._size:self._size + n] = values
+        self._size += n
+
+    def arrays(self) -> AssociationArrays:
+        """Return views of the filled part of each column."""
+        return AssociationArrays(*(column[:self._size] for column in self._columns))
+
+
+class OverlapArrays(NamedTuple):
+    """Column views of the overlaps between cell sets, one entry per overlapping pair."""
+
+    cell_set: np.ndarray  # int32 index of the smaller cell set, which holds the overlap
+    other: np.ndarray  # int32 index of the other cell set
+    count: np.ndarray  # int64 number of cells in both
+    jaccard: np.ndarray  # float32 intersection over union
+    overlap_coefficient: np.ndarray  # float32 intersection over the smaller cell set
+
+
+class PreviewEstimates(NamedTuple):
+    """
+    Confidence intervals of the counts of a graph built from a cell sample (see `preview`).
+
+    Cell set arrays are indexed like the cell sets, association arrays like
+    `KnowledgeGraph.association_arrays()`.
+    """
+
+    sampled_cell_count: np.ndarray  # int64 sampled cells per cell set
+    cell_count_lower: np.ndarray  # int64
+    cell_count_upper: np.ndarray  # int64
+    count_lower: np.ndarray  # int64 per association
+    count_upper: np.ndarray  # int64
+    cell_ratio_lower: np.ndarray  # float32
+    cell_ratio_upper: np.ndarray  # float32
+    sample_fraction: float
+    sample_strategy: str
+    confidence_level: float
+    rare_labels: List[str]  # obs_column=obs_value labels with too few sampled cells
+
+
+class DonorSummary(NamedTuple):
+    """Distribution over donors of the cells of some cell sets or associations."""
+
+    donor_count: np.ndarray  # int32 donors with at least one cell
+    ratio_min: np.ndarray  # float32 minimum per-donor ratio
+    ratio_median: np.ndarray  # float32 median per-donor ratio
+    ratio_max: np.ndarray  # float32 maximum per-donor ratio
+
+
+def _decimals(values: np.ndarray, valid: Optional[np.ndarray] = None) -> List[Optional[float]]:
+    """Shortest decimal forms that round-trip stored float32 values, None where not valid."""
+    decimals = [float(value) for value in values.astype(str)]
+    if valid is not None:
+        decimals = [value if ok else None for value, ok in zip(decimals, valid.tolist())]
+    return decimals
+
+
+class KnowledgeGraph:
+    """
+    Builder and container for the knowledge graph of one dataset.
+
+    Entities are added with the `add_*` methods, which return integer indexes
+    used to link them. Consumers read the graph through the `iter_*`
+    iterators, which yield one schema-shaped dictionary at a time, or write it
+    out with `save`/`write`.
+    """
+
+    def __init__(self, name: str, description: str = "", dataset_id: Optional[str] = None):
+        """
+        Create an empty knowledge graph.
+
+        Args:
+            name: Name of the dataset.
+            description: Description of the dataset.
+            dataset_id: Identifier of the dataset (default: a new random ID).
+        """
+        self.dataset_id = dataset_id or f"schema:Dataset_{uuid.uuid4().hex[:8]}"
+        self.name = name
+        self.description = description
+        self._cell_sets: List[CellSetRecord] = []
+        self._cell_set_index: Dict[str, int] = {}
+        # Cell count of each cell set (capacity doubles as needed), for computing association ratios in batches
+        self._cell_counts = np.empty(1024, dtype=np.int64)
+        self._terms: List[TermRecord] = []
+        self._term_index: Dict[str, int] = {}
+        self._associations = AssociationTable()
+        self._overlaps: List[OverlapArrays] = []
+        self.term_classes: Dict[str, Tuple[str, str]] = dict(TERM_CLASSES)
+        self.association_slots: List[str] = list(ASSOCIATION_SLOTS)
+        # Confidence intervals, when the counts are estimates from a cell sample
+        self.preview: Optional[PreviewEstimates] = None
+        # Obs column of the donors, and batches of donor summaries of (cell set indexes)
+        # and of (the first association of a batch added with `add_associations`)
+        self.donor_column: Optional[str] = None
+        self._cell_set_donors: List[Tuple[np.ndarray, DonorSummary]] = []
+        self._association_donors: List[Tuple[int, DonorSummary]] = []
+
+    def register_term_class(self, term_class: str, collection: str, reverse_slot: str = "present_in_cell_sets") -> None:
+        """
+        Register an additional ontology term class.
+
+        Args:
+            term_class: Schema class of the terms.
+            collection: Key of the term collection in the serialized graph.
+            reverse_slot: Slot listing the cell sets that reference each term.
+        """
+        if self.term_classes.get(term_class, (collection, reverse_slot)) != (collection, reverse_slot):
+            raise ValueError(f"Term class {term_class} is already registered as {self.term_classes[term_class]}")
+        self.term_classes[term_class] = (collection, reverse_slot)
+
+    def register_association_slot(self, slot: str) -> None:
+        """Register an additional cell set slot holding metadata associations."""
+        if slot not in self.association_slots:
+            self.association_slots.append(slot)
+
+    @property
+    def n_cell_sets(self) -> int:
+        return len(self._cell_sets)
+
+    @property
+    def n_terms(self) -> int:
+        return len(self._terms)
+
+    @property
+    def n_associations(self) -> int:
+        return len(self._associations)
+
+    @property
+    def n_overlaps(self) -> int:
+        return sum(len(batch.count) for batch in self._overlaps)
+
+    def add_cell_set(
+        self,
+        cell_set_id: str,
+        name: str,
+        description: str,
+        obs_column: str,
+        obs_value: str,
+        cell_count: int,
+    ) -> int:
+        """
+        Add a cell set.
+
+        Args:
+            cell_set_id: Identifier of the cell set.
+            name: Name of the cell set.
+            description: Description of the cell set.
+            obs_column: The obs column the cell set was derived from.
+            obs_value: The annotation value shared by the cells in the set.
+            cell_count: Number of cells in the set.
+
+        Returns:
+            The index of the new cell set.
+        """
+        if cell_set_id in self._cell_set_index:
+            raise ValueError(f"Duplicate cell set ID: {cell_set_id}")
+        index = len(self._cell_sets)
+        self._cell_sets.append(CellSetRecord(cell_set_id, name, description, obs_column, obs_value, int(cell_count)))
+        self._cell_set_index[cell_set_id] = index
+        if index == len(self._cell_counts):
+            self._cell_counts = np.concatenate([self._cell_counts, np.empty_like(self._cell_counts)])
+        self._cell_counts[index] = cell_count
+        return index
+
+    def add_term(
+        self,
+        term_id: str,
+        term_class: str,
+        name: str,
+        description: str,
+        source_uri: Optional[str] = None,
+    ) -> int:
+        """
+        Add an ontology term, or return the index of an existing term with the same ID.
+
+        Args:
+            term_id: CURIE of the term.
+            term_class: Schema class of the term (a registered term class).
+            name: Name of the term.
+            description: Description of the term.
+            source_uri: URI of the source term (default: the term ID).
+
+        Returns:
+            The index of the term.
+        """
+        if term_id in self._term_index:
+            return self._term_index[term_id]
+        if term_class not in self.term_classes:
+            raise ValueError(f"Unsupported term class: {term_class}")
+        index = len(self._terms)
+        self._terms.append(TermRecord(term_id, term_class, name, description, source_uri or term_id))
+        self._term_index[term_id] = index
+        return index
+
+    def add_subset_of(self, cell_set: int, parent: int) -> None:
+        """Record that cell set `cell_set` is a subset of cell set `parent`."""
+        record = self._cell_sets[cell_set]
+        if record.subset_of is None:
+            record.subset_of = []
+        record.subset_of.append(parent)
+
+    def set_predominant_cell_type(self, cell_set: int, term: int, fraction: Optional[float] = None) -> None:
+        """
+        Record that a cell set predominantly consists of a cell type.
+
+        Args:
+            cell_set: Index of the cell set.
+            term: Index of the cell type term.
+            fraction: Fraction of the cell set's cells of that type, when inferred.
+        """
+        record = self._cell_sets[cell_set]
+        record.predominantly_consists_of = term
+        record.predominance_fraction = fraction
+
+    def add_overlaps(self, cell_sets: np.ndarray, others: np.ndarray, counts: np.ndarray) -> None:
+        """
+        Add a batch of overlaps between pairs of cell sets.
+
+        Each overlap is recorded on the smaller cell set of the pair (the first
+        one on ties), with its Jaccard index and overlap coefficient.
+
+        Args:
+            cell_sets: Array of cell set indexes.
+            others: Array of the indexes of the overlapping cell sets.
+            counts: Array of the numbers of cells in both cell sets.
+        """
+        cell_sets = np.asarray(cell_sets, dtype=np.int32)
+        others = np.asarray(others, dtype=np.int32)
+        counts = np.asarray(counts, dtype=np.int64)
+        totals = np.fromiter((cs.cell_count for cs in self._cell_sets), dtype=np.int64, count=len(self._cell_sets))
+        size, other_size = totals[cell_sets], totals[others]
+        swap = (other_size < size) | ((other_size == size) & (others < cell_sets))
+        cell_sets, others = np.where(swap, others, cell_sets), np.where(swap, cell_sets, others)
+        union = size + other_size - counts
+        self._overlaps.append(OverlapArrays(
+            cell_sets, others, counts,
+            np.divide(counts, union, out=np.zeros(len(counts)), where=union > 0).astype(np.float32),
+            np.divide(counts, np.minimum(size, other_size), out=np.zeros(len(counts)),
+                      where=np.minimum(size, other_size) > 0).astype(np.float32),
+        ))
+
+    def add_association(self, cell_set: int, slot: str, term: int, count: int) -> None:
+        """
+        Add a metadata association between a cell set and a term.
+
+        Args:
+            cell_set: Index of the cell set.
+            slot: Association slot (a registered association slot).
+            term: Index of the term.
+            count: Number of cells in the cell set annotated with the term.
+        """
+        total_cells = self._cell_sets[cell_set].cell_count
+        cell_ratio = float(count) / total_cells if total_cells > 0 else 0.0
+        self._associations.append(cell_set, self._slot_index(slot), term, int(count), cell_ratio)
+
+    def add_associations(
+        self,
+        cell_sets: np.ndarray,
+        slot: str,
+        terms: np.ndarray,
+        counts: np.ndarray,
+        donors: Optional[DonorSummary] = None,
+        cell_ratios: Optional[np.ndarray] = None,
+    ) -> None:
+        """
+        Add a batch of metadata associations for one slot.
+
+        Args:
+            cell_sets: Array of cell set indexes.
+            slot: Association slot (a registered association slot).
+            terms: Array of term indexes.
+            counts: Array of cell counts.
+            donors: Optional distribution over donors of the cells of each association.
+            cell_ratios: Ratios of the cell sets' cells in each association (default: the
+                counts over the cell set sizes), e.g. weighted ratios of a cell sample.
+        """
+        if donors is not None:
+            self._association_donors.append((len(self._associations), donors))
+        cell_sets = np.asarray(cell_sets, dtype=np.int32)
+        counts = np.asarray(counts, dtype=np.int64)
+        if cell_ratios is None:
+            totals = self._cell_counts[cell_sets]
+            cell_ratios = np.divide(counts, totals, out=np.zeros(len(counts)), where=totals > 0)
+        self._associations.append(cell_sets, self._slot_index(slot), terms, counts, cell_ratios)
+
+    def set_preview(self, cell_counts: np.ndarray, association_counts: np.ndarray, preview: PreviewEstimates) -> None:
+        """
+        Replace the counts measured on a cell sample by estimates for the whole dataset.
+
+        Cell ratios are kept: the (weighted) ratio measured in the sample estimates the ratio in the dataset.
+
+        Args:
+            cell_counts: Estimated number of cells of each cell set.
+            association_counts: Estimated number of cells of each association.
+            preview: The confidence intervals of the estimates.
+        """
+        for record, count in zip(self._cell_sets, np.asarray(cell_counts).tolist()):
+            record.cell_count = int(count)
+        self._cell_counts[:len(self._cell_sets)] = cell_counts
+        self._associations.arrays().count[:] = association_counts
+        self.preview = preview
+
+    def set_cell_set_donors(self, cell_sets: np.ndarray, donors: DonorSummary) -> None:
+        """
+        Record the distribution over donors of the cells of some cell sets.
+
+        Args:
+            cell_sets: Array of cell set indexes.
+            donors: The distribution of each cell set.
+        """
+        self._cell_set_donors.append((np.asarray(cell_sets, dtype=np.int64), donors))
+
+    def donor_summaries(self) -> Tuple[Optional[DonorSummary], Optional[DonorSummary]]:
+        """
+        Get the donor distributions of all cell sets and all associations.
+
+        Returns:
+            (cell set summaries, association summaries), indexed like the cell sets
+            and `association_arrays()`, with a donor_count of -1 where unknown; None
+            when no distribution was recorded.
+        """
+        def gather(batches: List[Tuple[np.ndarray, DonorSummary]], n: int) -> Optional[DonorSummary]:
+            if not batches:
+                return None
+            summary = DonorSummary(
+                np.full(n, -1, dtype=np.int32), *(np.full(n, np.nan, dtype=np.float32) for _ in range(3)),
+            )
+            for positions, batch in batches:
+                for column, values in zip(summary, batch):
+                    column[positions] = values
+            return summary
+
+        return (
+            gather(self._cell_set_donors, len(self._cell_sets)),
+            gather(
+                [(np.arange(start, start + len(batch.donor_count)), batch) for start, batch in self._association_donors],
+                len(self._associations),
+            ),
+        )
+
+    def _slot_index(self, slot: str) -> int:
+        try:
+            return self.association_slots.index(slot)
+        except ValueError:
+            raise ValueError(f"Unsupported association slot: {slot}")
+
+    def cell_set(self, index: int) -> CellSetRecord:
+        """Get a cell set record by index."""
+        return self._cell_sets[index]
+
+    def term(self, index: int) -> TermRecord:
+        """Get a term record by index."""
+        return self._terms[index]
+
+    def cell_set_index(self, cell_set_id: str) -> int:
+        """Get the index of a cell set from its ID."""
+        return self._cell_set_index[cell_set_id]
+
+    def term_index(self, term_id: str) -> int:
+        """Get the index of a term from its ID."""
+        return self._term_index[term_id]
+
+    def iter_cell_set_records(self) -> Iterator[CellSetRecord]:
+        return iter(self._cell_sets)
+
+    def iter_term_records(self, term_class: Optional[str] = None) -> Iterator[TermRecord]:
+        return (t for t in self._terms if term_class is None or t.term_class == term_class)
+
+    def association_arrays(self) -> AssociationArrays:
+        """Return the metadata associations as typed parallel arrays."""
+        return self._associations.arrays()
+
+    def overlap_arrays(self) -> OverlapArrays:
+        """Return the overlaps between cell sets as typed parallel arrays."""
+        if not self._overlaps:
+            return OverlapArrays(*(np.empty(0, dtype=dtype) for dtype in (np.int32, np.int32, np.int64, np.float32, np.float32)))
+        return OverlapArrays(*(np.concatenate(columns) for columns in zip(*self._overlaps)))
+
+    @staticmethod
+    def _group_offsets(keys: np.ndarray, n_groups: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Group array positions by key, keeping insertion order within each group.
+
+        Returns:
+            (order, offsets): positions of group g are order[offsets[g]:offsets[g + 1]].
+        """
+        order = np.argsort(keys, kind="stable")
+        offsets = np.zeros(n_groups + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys, minlength=n_groups), out=offsets[1:])
+        return order, offsets
+
+    def _referencing_cell_sets(self) -> List[np.ndarray]:
+        """Derive, for each term, the indexes of the cell sets that reference it."""
+        predominant = np.fromiter(
+            (cs.predominantly_consists_of for cs in self._cell_sets), dtype=np.int32, count=len(self._cell_sets)
+        )
+        linked = np.flatnonzero(predominant >= 0).astype(np.int32)
+        assoc = self._associations.arrays()
+        # Cell types are referenced through predominantly_consists_of, other terms
+        # through associations; concatenating both keeps each group in cell set order
+        terms = np.concatenate([predominant[linked], assoc.term])
+        cell_sets = np.concatenate([linked, assoc.cell_set])
+        order, offsets = self._group_offsets(terms, len(self._terms))
+        cell_sets = cell_sets[order]
+        return [cell_sets[offsets[t]:offsets[t + 1]] for t in range(len(self._terms))]
+
+    def iter_records(self) -> Iterator[records.CellSet]:
+        """
+        Iterate over the cell sets as schema records.
+
+        Yields:
+            One CellSet record per cell set.
+        """
+        assoc = self._associations.arrays()
+        order, offsets = self._group_offsets(assoc.cell_set, len(self._cell_sets))
+        slots = [self.association_slots[slot] for slot in assoc.slot[order].tolist()]
+        term_ids = [term.id for term in self._terms]
+        terms = [term_ids[term] for term in assoc.term[order].tolist()]
+        counts = assoc.count[order].tolist()
+        # Shortest decimal form that round-trips the stored float32 ratio
+        ratios = [float(ratio) for ratio in assoc.cell_ratio[order].astype(str)]
+        offsets = offsets.tolist()
+        overlaps = self.overlap_arrays()
+        overlap_order, overlap_offsets = self._group_offsets(overlaps.cell_set, len(self._cell_sets))
+        overlap_others = overlaps.other[overlap_order]
+        overlap_counts = overlaps.count[overlap_order]
+        jaccard = overlaps.jaccard[overlap_order].astype(str)
+        coefficients = overlaps.overlap_coefficient[overlap_order].astype(str)
+        cell_extras, association_extras = self._extra_slots(order)
+        for i, cs in enumerate(self._cell_sets):
+            associations: Dict[str, List[records.MetadataAssociation]] = {}
+            for j in range(offsets[i], offsets[i + 1]):
+                associations.setdefault(slots[j], []).append(
+                    records.MetadataAssociation(terms[j], counts[j], ratios[j]) if association_extras is None
+                    else records.MetadataAssociation(terms[j], counts[j], ratios[j], *association_extras[j])
+                )
+            yield records.CellSet(
+                id=cs.id,
+                name=cs.name,
+                description=cs.description,
+                obs_column=cs.obs_column,
+                obs_value=cs.obs_value,
+                cell_count=cs.cell_count,
+                **(cell_extras[i] if cell_extras else {}),
+                subset_of=[self._cell_sets[p].id for p in cs.subset_of] if cs.subset_of else None,
+                overlaps_with=[
+                    records.CellSetOverlap(
+                        cell_set=self._cell_sets[overlap_others[j]].id,
+                        intersection_count=int(overlap_counts[j]),
+                        jaccard=float(jaccard[j]),
+                        overlap_coefficient=float(coefficients[j]),
+                    )
+                    for j in range(overlap_offsets[i], overlap_offsets[i + 1])
+                ] or None,
+                predominantly_consists_of=(
+                    self._terms[cs.predominantly_consists_of].id if cs.predominantly_consists_of >= 0 else None
+                ),
+                predominant_cell_type_fraction=cs.predominance_fraction,
+                **associations,
+            )
+
+    def _extra_slots(self, order: np.ndarray) -> Tuple[Optional[List[Dict[str, Any]]], Optional[List[tuple]]]:
+        """
+        Collect the optional slots of the cell sets and associations: preview intervals and donor distributions.
+
+        Args:
+            order: Order in which the associations are serialized.
+
+        Returns:
+            (keyword arguments of each cell set record, positional arguments of each
+            association record after term, count and cell_ratio), or None for either
+            when there are no optional slots.
+        """
+        preview = self.preview
+        cell_donors, association_donors = self.donor_summaries()
+        if preview is None and cell_donors is None and association_donors is None:
+            return None, None
+
+        cell_columns: Dict[str, List[Any]] = {}
+        n_associations = len(order)
+        association_columns = [[None] * n_associations for _ in range(4)]
+        if preview is not None:
+            cell_columns["sampled_cell_count"] = preview.sampled_cell_count.tolist()
+            cell_columns["cell_count_lower"] = preview.cell_count_lower.tolist()
+            cell_columns["cell_count_upper"] = preview.cell_count_upper.tolist()
+            association_columns = [
+                preview.count_lower[order].tolist(),
+                preview.count_upper[order].tolist(),
+                _decimals(preview.cell_ratio_lower[order]),
+                _decimals(preview.cell_ratio_upper[order]),
+            ]
+        # Unknown donor counts are -1 and unknown ratios NaN
+        if cell_donors is not None:
+            cell_columns["donor_count"] = [n if n >= 0 else None for n in cell_donors.donor_count.tolist()]
+            for slot, values in zip(("donor_ratio_min", "donor_ratio_median", "donor_ratio_max"), cell_donors[1:]):
+                cell_columns[slot] = _decimals(values, ~np.isnan(values))
+        if association_donors is not None:
+            association_columns.append([n if n >= 0 else None for n in association_donors.donor_count[order].tolist()])
+            for values in association_donors[1:]:
+                values = values[order]
+                association_columns.append(_decimals(values, ~np.isnan(values)))
+
+        cell_extras = [dict(zip(cell_columns, values)) for values in zip(*cell_columns.values())]
+        return cell_extras, list(zip(*association_columns))
+
+    def iter_cell_sets(self) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the cell sets as schema-shaped dictionaries.
+
+        Yields:
+            One dictionary per CellSet.
+        """
+        for record in self.iter_records():
+            yield record.to_dict()
+
+    def iter_terms(self, term_class: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the ontology terms as schema-shaped dictionaries.
+
+        Terms of classes with a schema record class are built as records first.
+
+        Args:
+            term_class: Only yield terms of this class (default: all terms).
+
+        Yields:
+            One dictionary per term.
+        """
+        yield from self._iter_terms(term_class, self._referencing_cell_sets())
+
+    def iter_term_classes(self) -> Iterator[Tuple[str, Iterator[Dict[str, Any]]]]:
+        """
+        Iterate over the terms of each term class, deriving the cell sets referencing the terms once.
+
+        Yields:
+            (term class, iterator of term dictionaries as from `iter_terms`) for each term class.
+        """
+        referenced_by = self._referencing_cell_sets()
+        for term_class in self.term_classes:
+            yield term_class, self._iter_terms(term_class, referenced_by)
+
+    def _iter_terms(self, term_class: Optional[str], referenced_by: List[np.ndarray]) -> Iterator[Dict[str, Any]]:
+        for term, cell_sets in zip(self._terms, referenced_by):
+            if term_class is not None and term.term_class != term_class:
+                continue
+            obj = {
+                "id": term.id,
+                "name": term.name,
+                "description": term.description,
+                "source_uri": term.source_uri,
+                self.term_classes[term.term_class][1]: [self._cell_sets[i].id for i in cell_sets],
+            }
+            record_class = records.RECORD_CLASSES.get(term.term_class)
+            yield record_class(**obj).to_dict() if record_class is not None else obj
+
+    def dataset_dict(self) -> Dict[str, Any]:
+        """Return the Dataset object for this graph."""
+        ontology_terms = [t.id for term_class in self.term_classes for t in self.iter_term_records(term_class)]
+        preview = self.preview
+        return records.Dataset(
+            id=self.dataset_id,
+            name=self.name,
+            description=self.description,
+            cell_sets=[cs.id for cs in self._cell_sets],
+            ontology_terms=ontology_terms,
+            sample_fraction=preview.sample_fraction if preview else None,
+            sample_strategy=preview.sample_strategy if preview else None,
+            confidence_level=preview.confidence_level if preview else None,
+            rare_labels=list(preview.rare_labels) if preview else None,
+            donor_column=self.donor_column,
+        ).to_dict()
+
+    def statistics(self) -> Dict[str, int]:
+        """
+        Count the entities and relationships of the graph without serializing it.
+
+        Returns:
+            Dictionary with the number of cell sets, of terms (in total and per collection), of
+            subset_of, predominantly_consists_of and overlaps_with relationships,
+            and of associations per association slot.
+        """
+        stats = {"cell_sets": len(self._cell_sets), "terms": len(self._terms)}
+        class_index = {term_class: i for i, term_class in enumerate(self.term_classes)}
+        term_counts = np.bincount(
+            np.array([class_index[t.term_class] for t in self._terms], dtype=np.int64), minlength=len(class_index),
+        )
+        for (key, _), n in zip(self.term_classes.values(), term_counts.tolist()):
+            stats[key] = n
+        stats["subset_of"] = sum(1 for cs in self._cell_sets if cs.subset_of)
+        stats["predominantly_consists_of"] = sum(1 for cs in self._cell_sets if cs.predominantly_consists_of >= 0)
+        stats["overlaps_with"] = self.n_overlaps
+        slot_counts = np.bincount(self._associations.arrays().slot, minlength=len(self.association_slots))
+        for slot, n in zip(self.association_slots, slot_counts.tolist()):
+            stats[slot] = n
+        return stats
+
+    def iter_collections(self) -> Iterator[Tuple[str, Iterator[Dict[str, Any]]]]:
+        """
+        Iterate over the top-level collections of the serialized graph.
+
+        Yields:
+            (collection key, iterator of objects) for cell sets and each term class.
+        """
+        yield "cell_sets", self.iter_cell_sets()
+        for term_class, terms in self.iter_term_classes():
+            yield self.term_classes[term_class][0], terms
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Materialize the whole graph in the layout written by `save_objects`.
+
+        Returns:
+            A dictionary with the dataset and one list per collection.
+        """
+        objects = {"dataset": self.dataset_dict()}
+        for key, items in self.iter_collections():
+            objects[key] = list(items)
+        return objects
+
+    def to_legacy_dicts(self) -> Tuple[Dict, Dict, Dict, Dict, Dict, Dict]:
+        """
+        Materialize the graph as the dictionaries returned by `get_cell_sets_from_anndata`.
+
+        Terms of classes registered with `register_term_class` are not included.
+
+        Returns:
+            Tuple of dictionaries keyed by ID: (cell_sets, cell_types, tissues, diseases, dev_stages, assays)
+        """
+        cell_sets = {cs["id"]: cs for cs in self.iter_cell_sets()}
+        terms = [{t["id"]: t for t in terms} for term_class, terms in self.iter_term_classes() if term_class in TERM_CLASSES]
+        return (cell_sets, *terms)
+
+    def write(self, sink) -> None:
+        """
+        Write the graph to a sink.
+
+        Args:
+            sink: An object with a `write(graph)` method, e.g. from `graph_sinks`.
+        """
+        sink.write(self)
+
+    def save(self, output: str, format: str = "json", schema_file: Optional[str] = None) -> None:
+        """
+        Write the graph to a file or directory using the sink registered for `format`.
+
+        Args:
+            output: Output path.
+            format: Output format (a key of `graph_sinks.SINKS`).
+            schema_file: LinkML schema used by sinks that read it (default: the bundled schema).
+        """
+        from graph_sinks import get_sink
+        self.write(get_sink(format, output, schema_file))
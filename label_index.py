@@ -0,0 +1,349 @@
+"""
+Offline resolution of free-text author labels to ontology terms.
+
+A `LabelIndex` is built from local ontology files (OBO, or TSV with columns
+id, label and optional '|'-separated exact synonyms). Labels and synonyms are
+normalized to lower-case, singularized tokens. Exact matches are found by
+hashing the normalized form, and approximate matches by scoring character
+trigram overlap through an inverted index. Built indexes are pickled next to
+a fingerprint of their source files, and a `LabelResolver` keeps resolutions
+in a SQLite cache so that a label seen in any earlier run is never resolved
+twice.
+"""
+
+import csv
+import hashlib
+import logging
+import os
+import pickle
+import re
+import sqlite3
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Version of the normalization and index layout; bump to invalidate cached indexes
+INDEX_VERSION = 1
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+_OBO_SYNONYM = re.compile(r'^synonym:\s*"((?:[^"\\]|\\.)*)"\s+(EXACT|RELATED|BROAD|NARROW)')
+_STOPWORDS = frozenset({"of", "the", "a", "an", "in"})
+
+# Indexes loaded by this process, by fingerprint
+_loaded: Dict[str, "LabelIndex"] = {}
+
+
+class Resolution(NamedTuple):
+    """The ontology term an author label resolved to."""
+
+    term_id: str
+    term_label: str
+    score: float  # 1.0 for exact matches, trigram Dice coefficient otherwise
+    method: str  # "exact" or "trigram"
+
+
+def _singular(token: str) -> str:
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def normalize_label(label: str) -> str:
+    """
+    Normalize a label for matching.
+
+    Accents and punctuation are removed, case is folded, stopwords are dropped
+    and tokens are singularized, so "T-cells" and "T cell" normalize alike.
+
+    Args:
+        label: The label to normalize.
+
+    Returns:
+        The normalized label (space-separated tokens).
+    """
+    text = unicodedata.normalize("NFKD", label).encode("ascii", "ignore").decode("ascii").lower()
+    tokens = [_singular(t) for t in _NON_ALNUM.split(text) if t and t not in _STOPWORDS]
+    return " ".join(tokens)
+
+
+def trigrams(normalized: str) -> List[str]:
+    """Get the distinct character trigrams of a normalized label, padded at word boundaries."""
+    padded = f"  {normalized} "
+    return sorted({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+def parse_obo(file_path: str) -> Iterable[Tuple[str, str, List[str]]]:
+    """
+    Parse the terms of an OBO file.
+
+    Args:
+        file_path: Path to the OBO file.
+
+    Yields:
+        (term ID, label, exact synonyms) for each non-obsolete term.
+    """
+    term_id, label, synonyms, obsolete, in_term = None, None, [], False, False
+    with open(file_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("["):
+                if in_term and term_id and label and not obsolete:
+                    yield term_id, label, synonyms
+                in_term = line == "[Term]"
+                term_id, label, synonyms, obsolete = None, None, [], False
+            elif not in_term:
+                continue
+            elif line.startswith("id:"):
+                term_id = line[3:].strip()
+            elif line.startswith("name:"):
+                label = line[5:].strip()
+            elif line.startswith("is_obsolete:"):
+                obsolete = line.endswith("true")
+            else:
+                match = _OBO_SYNONYM.match(line)
+                if match and match.group(2) == "EXACT":
+                    synonyms.append(match.group(1).replace('\\"', '"'))
+    if in_term and term_id and label and not obsolete:
+        yield term_id, label, synonyms
+
+
+def parse_tsv(file_path: str) -> Iterable[Tuple[str, str, List[str]]]:
+    """
+    Parse a TSV label file with columns id, label and optional '|'-separated exact synonyms.
+
+    Args:
+        file_path: Path to the TSV file.
+
+    Yields:
+        (term ID, label, exact synonyms) for each row.
+    """
+    with open(file_path, encoding="utf-8", newline="") as f:
+        for row in csv.reader(f, delimiter="\t"):
+            if not row or row[0].startswith("#") or len(row) < 2:
+                continue
+            synonyms = [s for s in row[2].split("|") if s] if len(row) > 2 else []
+            yield row[0].strip(), row[1].strip(), synonyms
+
+
+def _parse_file(file_path: str) -> Iterable[Tuple[str, str, List[str]]]:
+    if file_path.endswith(".obo"):
+        return parse_obo(file_path)
+    if file_path.endswith((".tsv", ".txt")):
+        return parse_tsv(file_path)
+    raise ValueError(f"Unsupported ontology file format: {file_path}. Must be OBO or TSV.")
+
+
+def fingerprint_files(file_paths: List[str]) -> str:
+    """Fingerprint ontology files by path, size and modification time."""
+    digest = hashlib.sha256(f"v{INDEX_VERSION}".encode())
+    for path in sorted(file_paths):
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+    return digest.hexdigest()[:16]
+
+
+class LabelIndex:
+    """Exact-match hash and trigram inverted index over ontology labels and exact synonyms."""
+
+    def __init__(self, fingerprint: str = ""):
+        self.fingerprint = fingerprint
+        self.labels: Dict[str, str] = {}  # term ID -> primary label
+        self.entries: List[Tuple[str, str]] = []  # (term ID, normalized text)
+        self.exact: Dict[str, List[str]] = {}  # normalized text -> term IDs
+        self.postings: Dict[str, List[int]] = {}  # trigram -> entry numbers
+        self.entry_sizes: List[int] = []  # number of trigrams per entry
+
+    @classmethod
+    def build(cls, file_paths: List[str]) -> "LabelIndex":
+        """
+        Build an index from ontology files.
+
+        Args:
+            file_paths: OBO or TSV files.
+
+        Returns:
+            The index.
+        """
+        index = cls(fingerprint_files(file_paths))
+        exact = defaultdict(set)
+        postings = defaultdict(list)
+        seen = set()
+        for path in file_paths:
+            logger.info(f"Indexing ontology labels from {path}")
+            for term_id, label, synonyms in _parse_file(path):
+                index.labels.setdefault(term_id, label)
+                for text in [label] + synonyms:
+                    normalized = normalize_label(text)
+                    if not normalized or (term_id, normalized) in seen:
+                        continue
+                    seen.add((term_id, normalized))
+                    exact[normalized].add(term_id)
+                    entry = len(index.entries)
+                    index.entries.append((term_id, normalized))
+                    grams = trigrams(normalized)
+                    index.entry_sizes.append(len(grams))
+                    for gram in grams:
+                        postings[gram].append(entry)
+        index.exact = {k: sorted(v) for k, v in exact.items()}
+        index.postings = dict(postings)
+        logger.info(f"Indexed {len(index.entries)} labels and synonyms of {len(index.labels)} terms")
+        return index
+
+    @classmethod
+    def load_or_build(cls, file_paths: List[str], cache_dir: Optional[str] = None) -> "LabelIndex":
+        """
+        Load a pickled index for these files, building and pickling it if missing or stale.
+
+        Indexes are also kept in memory, so a long-lived process loads each one once.
+
+        Args:
+            file_paths: OBO or TSV files.
+            cache_dir: Directory for pickled indexes (default: no persistence).
+
+        Returns:
+            The index.
+        """
+        fingerprint = fingerprint_files(file_paths)
+        if fingerprint in _loaded:
+            return _loaded[fingerprint]
+        path = os.path.join(cache_dir, f"label_index_{fingerprint}.pkl") if cache_dir is not None else None
+        if path is not None and os.path.exists(path):
+            logger.info(f"Loading label index from {path}")
+            with open(path, "rb") as f:
+                index = pickle.load(f)
+        else:
+            index = cls.build(file_paths)
+            if path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+        _loaded[fingerprint] = index
+        return index
+
+    def lookup(self, label: str, prefixes: Tuple[str, ...] = (), min_score: float = 0.85) -> Optional[Resolution]:
+        """
+        Resolve one label.
+
+        Args:
+            label: The author label.
+            prefixes: Only consider terms with these ID prefixes (default: all).
+            min_score: Minimum trigram Dice coefficient for approximate matches.
+
+        Returns:
+            The resolution, or None if no unambiguous match was found.
+        """
+        normalized = normalize_label(label)
+        if not normalized:
+            return None
+
+        def allowed(term_id: str) -> bool:
+            return not prefixes or term_id.replace("_", ":", 1).split(":", 1)[0] in prefixes
+
+        candidates = [t for t in self.exact.get(normalized, []) if allowed(t)]
+        if len(candidates) == 1:
+            return Resolution(candidates[0], self.labels[candidates[0]], 1.0, "exact")
+        if candidates:
+            return None
+
+        grams = trigrams(normalized)
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for entry in self.postings.get(gram, ()):
+                shared[entry] += 1
+
+        best: Dict[str, float] = {}
+        for entry, n_shared in shared.items():
+            term_id = self.entries[entry][0]
+            if not allowed(term_id):
+                continue
+            score = 2.0 * n_shared / (len(grams) + self.entry_sizes[entry])
+            if score > best.get(term_id, 0.0):
+                best[term_id] = score
+        if not best:
+            return None
+        ranked = sorted(best.items(), key=lambda item: (-item[1], item[0]))
+        term_id, score = ranked[0]
+        if score < min_score or (len(ranked) > 1 and ranked[1][1] == score):
+            return None
+        return Resolution(term_id, self.labels[term_id], round(score, 4), "trigram")
+
+
+class LabelResolver:
+    """
+    Resolves batches of labels through a `LabelIndex`, with a persistent cache.
+
+    Cached entries are keyed by the index fingerprint, the prefix filter, the
+    score threshold and the normalized label, so changing any of them (or the
+    ontology files) never returns stale resolutions.
+    """
+
+    def __init__(self, index: LabelIndex, cache_file: Optional[str] = None, min_score: float = 0.85):
+        self.index = index
+        self.min_score = min_score
+        self._db = None
+        if cache_file is not None:
+            self._db = sqlite3.connect(cache_file)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS resolutions ("
+                " context TEXT NOT NULL, label TEXT NOT NULL,"
+                " term_id TEXT, term_label TEXT, score REAL, method TEXT,"
+                " PRIMARY KEY (context, label))"
+            )
+            self._db.commit()
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _context(self, prefixes: Tuple[str, ...]) -> str:
+        return f"{self.index.fingerprint}|{','.join(sorted(prefixes))}|{self.min_score}"
+
+    def resolve(self, labels: Iterable[str], prefixes: Tuple[str, ...] = ()) -> Dict[str, Optional[Resolution]]:
+        """
+        Resolve a batch of labels.
+
+        Each distinct normalized label is looked up once; labels already in the
+        cache are not looked up at all.
+
+        Args:
+            labels: Author labels, possibly repeated.
+            prefixes: Only consider terms with these ID prefixes (default: all).
+
+        Returns:
+            A dictionary mapping each distinct label to its resolution (or None).
+        """
+        by_normalized: Dict[str, List[str]] = defaultdict(list)
+        for label in set(labels):
+            by_normalized[normalize_label(label)].append(label)
+
+        context = self._context(prefixes)
+        resolved: Dict[str, Optional[Resolution]] = {}
+        if self._db is not None and by_normalized:
+            keys = list(by_normalized)
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT label, term_id, term_label, score, method FROM resolutions"
+                    f" WHERE context = ? AND label IN ({','.join('?' * len(chunk))})",
+                    [context, *chunk],
+                )
+                for normalized, term_id, term_label, score, method in rows:
+                    resolved[normalized] = Resolution(term_id, term_label, score, method) if term_id else None
+
+        misses = [n for n in by_normalized if n not in resolved]
+        for normalized in misses:
+            resolved[normalized] = self.index.lookup(normalized, prefixes, self.min_score)
+        if self._db is not None and misses:
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?, ?, ?)",
+                    [(context, n, *(resolved[n] or (None, None, None, None))) for n in misses],
+                )
+        logger.info(f"Resolved {len(by_normalized)} distinct labels ({len(by_normalized) - len(misses)} from cache)")
+
+        return {label: resolved[normalized] for normalized, group in by_normalized.items() for label in group}
@@ -0,0 +1,134 @@
+"""
+Declarative mapping of AnnData obs columns to ontology-backed metadata associations.
+
+Each `MetadataColumn` names an obs column, the ontology prefixes its values
+may carry, the schema class of the resulting terms, the CellSet slot holding
+the associations and the key of the term collection in the serialized graph.
+Mappings can be loaded from a YAML file with `load_metadata_config`:
+
+    metadata_columns:
+      - name: dev_stage
+        column: development_stage_ontology_term_id
+        prefixes: [HsapDv, MmusDv]
+        term_class: DevelopmentalStage
+        slot: has_developmental_stage
+        collection: developmental_stages
+
+An entry with an empty `prefixes` list accepts any value and creates
+schema-local terms named after the value, whose IDs percent-encode it (e.g.
+`schema:SuspensionType_single%20nucleus`). An entry with
+`required: false` is skipped silently (logged at debug level) when its column
+is missing; other missing columns are warned about.
+"""
+
+import logging
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataColumn(NamedTuple):
+    """Mapping of one obs column to a metadata association."""
+
+    name: str  # Metadata type, used in logs and term descriptions
+    column: str  # Column name in AnnData.obs
+    prefixes: Tuple[str, ...]  # Accepted ontology prefixes (empty: any value)
+    term_class: str  # Schema class of the terms
+    slot: str  # CellSet slot holding the associations
+    collection: str  # Key of the term collection in the serialized graph
+    required: bool = True  # Whether a missing column is warned about
+
+
+def default_metadata_columns(
+    tissue_column: str = "tissue",
+    disease_column: str = "disease",
+    dev_stage_column: str = "development_stage",
+    assay_column: str = "assay",
+) -> List[MetadataColumn]:
+    """
+    Get the default metadata column mapping.
+
+    Covers tissue, disease, developmental stage (human and mouse) and assay,
+    plus the CellXGene sex, organism, self-reported ethnicity and suspension
+    type columns, which are not required.
+
+    Args:
+        tissue_column: Column name in AnnData.obs that contains tissue annotations.
+        disease_column: Column name in AnnData.obs that contains disease annotations.
+        dev_stage_column: Column name in AnnData.obs that contains developmental stage annotations.
+        assay_column: Column name in AnnData.obs that contains assay annotations.
+
+    Returns:
+        A list of metadata column mappings.
+    """
+    return [
+        MetadataColumn("tissue", tissue_column, ("UBERON",), "Tissue", "has_tissue", "tissues"),
+        MetadataColumn("disease", disease_column, ("MONDO",), "Disease", "has_disease", "diseases"),
+        MetadataColumn("dev_stage", dev_stage_column, ("HsapDv", "MmusDv"), "DevelopmentalStage",
+                       "has_developmental_stage", "developmental_stages"),
+        MetadataColumn("assay", assay_column, ("EFO",), "Assay", "has_assay", "assays"),
+        MetadataColumn("sex", "sex_ontology_term_id", ("PATO",), "Sex", "has_sex", "sexes", required=False),
+        MetadataColumn("organism", "organism_ontology_term_id", ("NCBITaxon",), "Organism",
+                       "has_organism", "organisms", required=False),
+        MetadataColumn("self_reported_ethnicity", "self_reported_ethnicity_ontology_term_id", ("HANCESTRO",),
+                       "SelfReportedEthnicity", "has_self_reported_ethnicity", "self_reported_ethnicities",
+                       required=False),
+        MetadataColumn("suspension_type", "suspension_type", (), "SuspensionType",
+                       "has_suspension_type", "suspension_types", required=False),
+    ]
+
+
+def _parse_entry(entry: Dict[str, Any]) -> MetadataColumn:
+    missing = [key for key in ("name", "column", "term_class", "slot") if key not in entry]
+    if missing:
+        raise ValueError(f"Metadata column entry {entry} is missing: {', '.join(missing)}")
+    prefixes = entry.get("prefixes", [])
+    if isinstance(prefixes, str):
+        prefixes = [prefixes]
+    return MetadataColumn(
+        name=entry["name"],
+        column=entry["column"],
+        prefixes=tuple(prefixes),
+        term_class=entry["term_class"],
+        slot=entry["slot"],
+        collection=entry.get("collection", f"{entry['name']}_terms"),
+        required=bool(entry.get("required", True)),
+    )
+
+
+def load_metadata_config(config_file: str) -> List[MetadataColumn]:
+    """
+    Load a metadata column mapping from a YAML file.
+
+    Args:
+        config_file: Path to a YAML file with a `metadata_columns` list.
+
+    Returns:
+        A list of metadata column mappings.
+    """
+    logger.info(f"Loading metadata column config from {config_file}")
+    with open(config_file) as f:
+        config = yaml.safe_load(f) or {}
+    entries = config.get("metadata_columns")
+    if not isinstance(entries, list):
+        raise ValueError(f"{config_file} must define a 'metadata_columns' list")
+    return [_parse_entry(entry) for entry in entries]
+
+
+def match_prefix(value: str, prefixes: Tuple[str, ...]) -> Optional[str]:
+    """
+    Find the ontology prefix of a value.
+
+    Args:
+        value: An obs value, e.g. "UBERON:0000178" or "UBERON_0000178".
+        prefixes: Accepted prefixes.
+
+    Returns:
+        The matching prefix, or None if the value carries none of them.
+    """
+    for prefix in prefixes:
+        if value.startswith((f"{prefix}:", f"{prefix}_")):
+            return prefix
+    return None
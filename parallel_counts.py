@@ -0,0 +1,162 @@
+"""
+Parallel crosstabulation of obs code arrays.
+
+`CrosstabExecutor` counts co-occurrences for many pairs of code arrays on a
+thread or process pool. Each pair is split into ranges of cells so that even a
+few pairs over a large dataset keep every worker busy; partial counts are
+summed in the caller. Thread workers read the arrays directly. For process
+workers the arrays are copied once into shared memory and workers attach to
+them by name, so code arrays are never pickled.
+"""
+
+import logging
+import math
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Supported executor kinds
+EXECUTORS = ("thread", "process")
+
+# Shared memory handle: (block name, shape, dtype)
+SharedHandle = Tuple[str, Tuple[int, ...], str]
+
+# Shared memory blocks attached by this worker process, by name
+_attached: Dict[str, Tuple[shared_memory.SharedMemory, np.ndarray]] = {}
+
+
+def crosstab(
+    codes_a: np.ndarray, n_a: int, codes_b: np.ndarray, n_b: int, weights: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Count co-occurrences of two code arrays in a single pass.
+
+    Args:
+        codes_a: Codes of the first column (-1 for missing).
+        n_a: Number of categories of the first column.
+        codes_b: Codes of the second column (-1 for missing).
+        n_b: Number of categories of the second column.
+        weights: Optional weight of each cell, summed instead of counting cells.
+
+    Returns:
+        An (n_a, n_b) array of cell counts (or float sums of weights).
+    """
+    valid = (codes_a >= 0) & (codes_b >= 0)
+    keys = codes_a[valid].astype(np.int64) * n_b + codes_b[valid]
+    return np.bincount(
+        keys, weights=None if weights is None else weights[valid], minlength=n_a * n_b,
+    ).reshape(n_a, n_b)
+
+
+def _attach(handle: SharedHandle) -> np.ndarray:
+    """Attach to a shared memory block (once per worker process) and view it as an array."""
+    name, shape, dtype = handle
+    if name not in _attached:
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    return _attached[name][1]
+
+
+def _shared_crosstab(handle_a: SharedHandle, n_a: int, handle_b: SharedHandle, n_b: int, start: int, stop: int) -> np.ndarray:
+    """Process pool task: crosstabulate a range of cells of two shared code arrays."""
+    return crosstab(_attach(handle_a)[start:stop], n_a, _attach(handle_b)[start:stop], n_b)
+
+
+class CrosstabExecutor:
+    """
+    Thread or process pool computing crosstabs between named code arrays.
+
+    Use as a context manager; shared memory and the pool are released on exit.
+
+    Args:
+        codes: Code arrays by key, all of the same length (one entry per cell).
+        sizes: Number of categories of each code array, by key.
+        workers: Number of workers.
+        kind: "thread" or "process".
+        min_chunk: Minimum number of cells per task.
+    """
+
+    def __init__(
+        self,
+        codes: Dict[Hashable, np.ndarray],
+        sizes: Dict[Hashable, int],
+        workers: int,
+        kind: str = "thread",
+        min_chunk: int = 1 << 20,
+    ):
+        if kind not in EXECUTORS:
+            raise ValueError(f"Unsupported executor: {kind}")
+        self.codes = codes
+        self.sizes = sizes
+        self.workers = max(1, workers)
+        self.kind = kind
+        self.min_chunk = min_chunk
+        self.n_cells = len(next(iter(codes.values()))) if codes else 0
+        self._pool: Optional[Executor] = None
+        self._blocks: List[shared_memory.SharedMemory] = []
+        self._handles: Dict[Hashable, SharedHandle] = {}
+
+    def __enter__(self) -> "CrosstabExecutor":
+        if self.kind == "process":
+            for key, array in self.codes.items():
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self._blocks.append(shm)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+                self._handles[key] = (shm.name, array.shape, array.dtype.str)
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+        self._handles = {}
+
+    def _ranges(self, n_pairs: int) -> List[Tuple[int, int]]:
+        """Split the cells into enough ranges to give every worker a task."""
+        n_chunks = math.ceil(self.workers / max(n_pairs, 1))
+        n_chunks = max(1, min(n_chunks, self.n_cells // self.min_chunk))
+        bounds = np.linspace(0, self.n_cells, n_chunks + 1).astype(np.int64)
+        return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    def crosstabs(self, pairs: List[Tuple[Hashable, Hashable]]) -> Dict[Tuple[Hashable, Hashable], np.ndarray]:
+        """
+        Crosstabulate pairs of code arrays in parallel.
+
+        Args:
+            pairs: (key_a, key_b) pairs of code array keys.
+
+        Returns:
+            A dictionary mapping each pair to its (sizes[key_a], sizes[key_b]) count array.
+        """
+        if self._pool is None:
+            raise RuntimeError("CrosstabExecutor must be used as a context manager")
+        ranges = self._ranges(len(pairs))
+        logger.info(f"Counting {len(pairs)} column pairs in {len(pairs) * len(ranges)} tasks "
+                    f"on {self.workers} {self.kind} workers")
+
+        futures = {}
+        for key_a, key_b in pairs:
+            n_a, n_b = self.sizes[key_a], self.sizes[key_b]
+            for start, stop in ranges:
+                if self.kind == "process":
+                    future = self._pool.submit(
+                        _shared_crosstab, self._handles[key_a], n_a, self._handles[key_b], n_b, start, stop,
+                    )
+                else:
+                    future = self._pool.submit(
+                        crosstab, self.codes[key_a][start:stop], n_a, self.codes[key_b][start:stop], n_b,
+                    )
+                futures.setdefault((key_a, key_b), []).append(future)
+
+        return {pair: sum(f.result() for f in pair_futures) for pair, pair_futures in futures.items()}
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+"""
+Populate the schema for many AnnData files with overlapped stages.
+
+Loading, extraction, validation, serialization and statistics run as
+concurrent stages (one thread each) connected by bounded queues: while one
+dataset is being extracted, the next one is read from disk and the previous
+one is written out. The queues bound how many datasets are held in memory at
+once, and the wall time of a batch approaches that of its slowest stage
+rather than the sum of all stages. Statistics are computed from the
+in-memory graph, without re-reading the output.
+"""
+
+import argparse
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, NamedTuple, Optional
+
+from instrumentation import NULL_PROFILER, Profiler
+from validate_data import SCHEMA_FILE
+
+if TYPE_CHECKING:
+    from knowledge_graph import KnowledgeGraph
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DESCRIPTION = "Populate the schema for many AnnData files with overlapped stages"
+
+# Stages, in pipeline order
+STAGES = ("load", "extract", "validate", "serialize", "statistics")
+
+# Output file extension of each format (the columnar format writes a directory)
+EXTENSIONS = {"json": ".json", "yaml": ".yaml", "rdf": ".nt", "columnar": "", "sqlite": ".db"}
+
+# Marks the end of the stream of jobs on a queue
+_DONE = object()
+
+
+class PipelineJob(NamedTuple):
+    """One AnnData file to populate the schema from."""
+
+    input_file: str
+    output: str
+    dataset_name: str
+
+
+class PipelineResult:
+    """
+    Outcome of one job.
+
+    Attributes:
+        job: The job.
+        statistics: Entity and relationship counts of the graph (see `KnowledgeGraph.statistics`).
+        validation_errors: Validation errors, if the graph was validated.
+        error: The exception that stopped the job, if any.
+        graph: The knowledge graph, when kept.
+    """
+
+    def __init__(self, job: PipelineJob):
+        self.job = job
+        self.statistics: Optional[Dict[str, int]] = None
+        self.validation_errors: List[str] = []
+        self.error: Optional[BaseException] = None
+        self.graph: Optional["KnowledgeGraph"] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.validation_errors
+
+
+def plan_jobs(input_files: List[str], output_dir: str, format: str = "json") -> List[PipelineJob]:
+    """
+    Name the output and dataset of each input after its file name.
+
+    Inputs sharing a file name are prefixed with the name of their parent
+    directory, and those still sharing a name are numbered, so every output
+    and dataset name is unique.
+
+    Args:
+        input_files: h5ad files and/or AnnData Zarr stores.
+        output_dir: Directory of the outputs.
+        format: Output format (one of graph_sinks.SINKS).
+
+    Returns:
+        One job per input.
+    """
+    paths = [os.path.abspath(input_file) for input_file in input_files]
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    counts = Counter(stems)
+    stems = [
+        f"{os.path.basename(os.path.dirname(path))}_{stem}" if counts[stem] > 1 else stem
+        for path, stem in zip(paths, stems)
+    ]
+    counts, seen, taken = Counter(stems), Counter(), set(stems)
+    for i, stem in enumerate(stems):
+        if counts[stem] > 1:
+            name = stem
+            while name in taken:
+                seen[stem] += 1
+                name = f"{stem}_{seen[stem]}"
+            taken.add(name)
+            stems[i] = name
+
+    extension = EXTENSIONS.get(format, f".{format}")
+    return [
+        PipelineJob(input_file, os.path.join(output_dir, stem + extension), stem)
+        for input_file, stem in zip(input_files, stems)
+    ]
+
+
+def _stage_worker(
+    name: str,
+    process: Callable[[PipelineResult, Any], Any],
+    inbox: "queue.Queue",
+    outbox: Optional["queue.Queue"],
+    profiler: Profiler,
+) -> None:
+    """Apply a stage to each (result, payload) item of its inbox and pass the output on."""
+    while True:
+        with profiler.stage("pipeline_wait", stage=name):
+            item = inbox.get()
+        if item is _DONE:
+            break
+        result, payload = item
+        if result.error is None:
+            try:
+                payload = process(result, payload)
+            except Exception as e:
+                logger.error(f"{name} failed for {result.job.input_file}: {e}")
+                result.error = e
+                payload = None
+        if outbox is not None:
+            outbox.put((result, payload))
+    if outbox is not None:
+        outbox.put(_DONE)
+
+
+def run_pipeline(
+    jobs: List[PipelineJob],
+    extract_options: Optional[Dict[str, Any]] = None,
+    format: str = "json",
+    validate: bool = False,
+    schema_file: str = SCHEMA_FILE,
+    typed: bool = False,
+    queue_size: int = 1,
+    read_workers: int = 8,
+    keep_graphs: bool = False,
+    profiler: Optional[Profiler] = None,
+) -> List[PipelineResult]:
+    """
+    Populate the schema for a batch of inputs with the stages running concurrently.
+
+    Args:
+        jobs: The inputs and outputs.
+        extract_options: Keyword arguments of `populate_schema.build_knowledge_graph`
+            (cell type columns, metadata columns, workers, ...); the label resolver
+            is not supported, its SQLite connection cannot move across threads.
+        format: Output format (one of graph_sinks.SINKS).
+        validate: Validate each graph before writing it.
+        schema_file: Path to the LinkML schema file, used for validation and RDF output.
+        typed: Validate with the generated record classes.
+        queue_size: Maximum number of datasets waiting between two stages, which
+            bounds how many datasets are held in memory.
+        read_workers: Number of threads reading obs chunks from Zarr stores.
+        keep_graphs: Keep the knowledge graphs in the results.
+        profiler: Optional profiler recording the time each stage spends working
+            and waiting for input ("pipeline_wait").
+
+    Returns:
+        One result per job, in job order.
+    """
+    from populate_schema import build_knowledge_graph, load_anndata, obs_columns_used, save_knowledge_graph
+
+    profiler = profiler or NULL_PROFILER
+    extract_options = dict(extract_options or {})
+    extract_options.pop("label_resolver", None)
+    # Without explicit cell type columns, Zarr stores are read whole
+    obs_columns = None
+    if "cell_type_columns" in extract_options:
+        obs_columns = obs_columns_used(**{
+            key: extract_options[key] for key in (
+                "cell_type_columns", "metadata_columns", "tissue_column", "disease_column",
+                "dev_stage_column", "assay_column", "cl_id_column", "donor_column",
+            ) if key in extract_options
+        })
+
+    def load(result: PipelineResult, _: Any) -> Any:
+        return load_anndata(
+            result.job.input_file, profiler=profiler, obs_columns=obs_columns, read_workers=read_workers,
+        )
+
+    def extract(result: PipelineResult, adata: Any) -> "KnowledgeGraph":
+        return build_knowledge_graph(
+            adata=adata, dataset_name=result.job.dataset_name, profiler=profiler, **extract_options,
+        )
+
+    def check(result: PipelineResult, kg: "KnowledgeGraph") -> "KnowledgeGraph":
+        from validate_data import validate_graph
+
+        with profiler.stage("validate") as stage:
+            result.validation_errors = validate_graph(kg, schema_file, typed=typed)
+            stage.add_items(kg.n_cell_sets + kg.n_terms + 1)
+        if result.validation_errors:
+            logger.error(f"{len(result.validation_errors)} validation errors in {result.job.input_file}")
+        return kg
+
+    def serialize(result: PipelineResult, kg: "KnowledgeGraph") -> "KnowledgeGraph":
+        save_knowledge_graph(kg, result.job.output, format=format, profiler=profiler, schema_file=schema_file)
+        return kg
+
+    def statistics(result: PipelineResult, kg: "KnowledgeGraph") -> None:
+        with profiler.stage("statistics"):
+            result.statistics = kg.statistics()
+        if keep_graphs:
+            result.graph = kg
+
+    processes = {"load": load, "extract": extract, "validate": check, "serialize": serialize, "statistics": statistics}
+    stages = [name for name in STAGES if validate or name != "validate"]
+
+    results = [PipelineResult(job) for job in jobs]
+    # queues[i] feeds stage i: the first one carries jobs, the others loaded datasets or graphs
+    queues = [queue.Queue(maxsize=max(1, queue_size)) for _ in stages]
+    threads = [
+        threading.Thread(
+            target=_stage_worker, name=f"pipeline-{name}",
+            args=(name, processes[name], queues[i], queues[i + 1] if i + 1 < len(stages) else None, profiler),
+            daemon=True,
+        )
+        for i, name in enumerate(stages)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for result in results:
+        queues[0].put((result, None))
+    queues[0].put(_DONE)
+    for thread in threads:
+        thread.join()
+
+    failed = sum(1 for result in results if not result.ok)
+    logger.info(f"Pipeline processed {len(results)} inputs ({failed} failed) in {time.perf_counter() - started:.2f}s")
+    return results
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line options of this script to a parser."""
+    from graph_sinks import SINKS
+
+    parser.add_argument("input_files", nargs="+", help="Input h5ad files and/or AnnData Zarr stores")
+    parser.add_argument("--output-dir", "-o", default=".",
+                        help="Directory of the outputs, named after the inputs (default: current directory)")
+    parser.add_argument("--format", "-f", choices=sorted(SINKS), default="json", help="Output format (default: json)")
+    parser.add_argument("--cell-type-columns", nargs="+", default=["cell_type", "cell_ontology_term"],
+                        help="Column names in AnnData.obs that contain cell type annotations (default: ['cell_type', 'cell_ontology_term'])")
+    parser.add_argument("--tissue-column", default="tissue",
+                        help="Column name in AnnData.obs that contains tissue annotations (default: 'tissue')")
+    parser.add_argument("--disease-column", default="disease",
+                        help="Column name in AnnData.obs that contains disease annotations (default: 'disease')")
+    parser.add_argument("--dev-stage-column", default="development_stage",
+                        help="Column name in AnnData.obs that contains developmental stage annotations (default: 'development_stage')")
+    parser.add_argument("--assay-column", default="assay",
+                        help="Column name in AnnData.obs that contains assay annotations (default: 'assay')")
+    parser.add_argument("--metadata-config", default=None,
+                        help="YAML file mapping obs columns to ontology prefixes, schema classes and association slots "
+                             "(replaces the default mapping and the --*-column options)")
+    parser.add_argument("--cl-id-column", default=None,
+                        help="Column name in AnnData.obs that contains Cell Ontology IDs, used to infer the predominant "
+                             "cell type of cell sets from free-text annotation columns (default: no inference)")
+    parser.add_argument("--donor-column", default=None,
+                        help="Column name in AnnData.obs identifying donors (or samples); adds the number of donors and "
+                             "the min/median/max per-donor ratio to cell sets and associations (default: none)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of threads counting cell type and metadata column pairs of each dataset (default: 1)")
+    parser.add_argument("--read-workers", type=int, default=8,
+                        help="Number of threads reading obs chunks from a Zarr store (default: 8)")
+    parser.add_argument("--validate", action="store_true", help="Validate each graph before writing it")
+    parser.add_argument("--typed", action="store_true",
+                        help="With --validate, check objects with the generated record classes instead of LinkML")
+    parser.add_argument("--schema", "-s", default=SCHEMA_FILE,
+                        help="Path to the LinkML schema file, used for validation and RDF output "
+                             "(default: single_cell_schema.yaml next to this script)")
+    parser.add_argument("--queue-size", type=int, default=1,
+                        help="Maximum number of datasets waiting between two stages (default: 1)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record per-stage busy and wait times and write them to <output-dir>/pipeline.profile.json")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Enable verbose output")
+
+
+def run(args: argparse.Namespace) -> List[PipelineResult]:
+    """Run the script with parsed command line options and return the results."""
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    missing = [path for path in args.input_files if not os.path.exists(path)]
+    if missing:
+        logger.error(f"Input files not found: {', '.join(missing)}")
+        sys.exit(1)
+
+    metadata_columns = None
+    if args.metadata_config:
+        from metadata_config import load_metadata_config
+
+        metadata_columns = load_metadata_config(args.metadata_config)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    profiler = Profiler() if args.profile else None
+    results = run_pipeline(
+        plan_jobs(args.input_files, args.output_dir, args.format),
+        extract_options=dict(
+            cell_type_columns=args.cell_type_columns,
+            tissue_column=args.tissue_column,
+            disease_column=args.disease_column,
+            dev_stage_column=args.dev_stage_column,
+            assay_column=args.assay_column,
+            metadata_columns=metadata_columns,
+            cl_id_column=args.cl_id_column,
+            donor_column=args.donor_column,
+            workers=args.workers,
+        ),
+        format=args.format,
+        validate=args.validate,
+        schema_file=args.schema,
+        typed=args.typed,
+        queue_size=args.queue_size,
+        read_workers=args.read_workers,
+        profiler=profiler,
+    )
+    if profiler is not None:
+        profiler.write_json(os.path.join(args.output_dir, "pipeline.profile.json"))
+
+    for result in results:
+        if result.error is not None:
+            print(f"❌ {result.job.input_file}: {result.error}")
+        elif result.validation_errors:
+            print(f"❌ {result.job.input_file}: {len(result.validation_errors)} validation errors")
+        else:
+            stats = result.statistics
+            print(f"✅ {result.job.output}: {stats['cell_sets']} cell sets, {stats['terms']} terms")
+    if not all(result.ok for result in results):
+        sys.exit(1)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
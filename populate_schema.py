@@ -3,39 +3,72 @@
 Script to populate the single cell transcriptomics schema from AnnData (h5ad) files.
 """
 
+from __future__ import annotations
+
 import argparse
 import logging
 import os
 import uuid
 from collections import defaultdict
-from typing import Dict, List, Optional, Set, Tuple, Any, Union
+from urllib.parse import quote
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple, Any, Union
 
-import anndata
 import numpy as np
-import pandas as pd
-import scanpy as sc
-from linkml_runtime import SchemaView
-from linkml_runtime.utils.formatutils import camelcase
-from linkml_runtime.dumpers import json_dumper, yaml_dumper
 
+from cube import Cube
+from instrumentation import NULL_PROFILER, Profiler
+from graph_sinks import SINKS
+from validate_data import SCHEMA_FILE
+from knowledge_graph import DonorSummary, KnowledgeGraph
+from label_index import LabelIndex, LabelResolver, Resolution
+from metadata_config import MetadataColumn, default_metadata_columns, load_metadata_config, match_prefix
+from parallel_counts import EXECUTORS, CrosstabExecutor, crosstab
+from preview import DEFAULT_RARE_THRESHOLD, STRATEGIES as PREVIEW_STRATEGIES, build_preview_graph
+
+if TYPE_CHECKING:
+    import anndata
+    import pandas as pd
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+DESCRIPTION = "Populate single cell transcriptomics schema from AnnData (h5ad) files"
 
-def load_anndata(file_path: str) -> anndata.AnnData:
+
+def load_anndata(
+    file_path: str,
+    profiler: Optional[Profiler] = None,
+    obs_columns: Optional[List[str]] = None,
+    read_workers: int = 8,
+) -> anndata.AnnData:
     """
-    Load an AnnData object from an h5ad file.
+    Load an AnnData object from an h5ad file or AnnData Zarr store.
+    
+    From a Zarr store, only the obs columns are read (in parallel chunks), into
+    an object with the same obs, n_obs and n_vars attributes as AnnData.
     
     Args:
-        file_path: Path to the h5ad file.
+        file_path: Path to the h5ad file or Zarr store.
+        profiler: Optional profiler recording the time spent loading.
+        obs_columns: Obs columns to read from a Zarr store (default: all).
+        read_workers: Number of threads reading chunks from a Zarr store.
         
     Returns:
         An AnnData object.
     """
+    import anndata
+    
+    from zarr_obs import is_zarr_store, read_obs
+    
+    profiler = profiler or NULL_PROFILER
     logger.info(f"Loading AnnData from {file_path}")
     try:
-        adata = sc.read_h5ad(file_path)
+        with profiler.stage("load_anndata") as stage:
+            if is_zarr_store(file_path):
+                adata = read_obs(file_path, obs_columns, workers=read_workers)
+            else:
+                adata = anndata.read_h5ad(file_path)
+            stage.add_items(adata.n_obs)
         logger.info(f"Loaded AnnData with {adata.n_obs} cells and {adata.n_vars} genes")
         return adata
     except Exception as e:
@@ -43,6 +76,30 @@ def load_anndata(file_path: str) -> anndata.AnnData:
         raise
 
 
+def obs_columns_used(
+    cell_type_columns: List[str],
+    metadata_columns: Optional[List[MetadataColumn]] = None,
+    tissue_column: str = "tissue",
+    disease_column: str = "disease",
+    dev_stage_column: str = "development_stage",
+    assay_column: str = "assay",
+    cl_id_column: Optional[str] = None,
+    cube_cell_type_column: Optional[str] = None,
+    donor_column: Optional[str] = None,
+) -> List[str]:
+    """
+    List the obs columns read to build a knowledge graph (and cube) with the given options.
+    
+    Returns:
+        The cell type columns, the metadata columns and the optional CL ID, cube cell type and donor columns.
+    """
+    if metadata_columns is None:
+        metadata_columns = default_metadata_columns(tissue_column, disease_column, dev_stage_column, assay_column)
+    return list(cell_type_columns) + [spec.column for spec in metadata_columns] + [
+        col for col in (cl_id_column, cube_cell_type_column, donor_column) if col is not None
+    ]
+
+
 def create_ontology_term_id(term_id: str, prefix: str) -> str:
     """
     Create a properly formatted ontology term ID.
@@ -64,6 +121,93 @@ def create_ontology_term_id(term_id: str, prefix: str) -> str:
     return f"{prefix}:{term_id}"
 
 
+def build_knowledge_graph(
+    adata: anndata.AnnData,
+    cell_type_columns: List[str],
+    tissue_column: str,
+    disease_column: str,
+    dev_stage_column: str,
+    assay_column: str,
+    dataset_name: str,
+    profiler: Optional[Profiler] = None,
+    metadata_columns: Optional[List[MetadataColumn]] = None,
+    cl_id_column: Optional[str] = None,
+    predominance_threshold: float = 0.5,
+    predominance_ties: str = "skip",
+    label_resolver: Optional[LabelResolver] = None,
+    workers: int = 1,
+    executor: str = "thread",
+    overlap_threshold: Optional[float] = None,
+    overlap_metric: str = "jaccard",
+    donor_column: Optional[str] = None,
+    cell_weights: Optional[np.ndarray] = None,
+) -> KnowledgeGraph:
+    """
+    Extract cell sets and their relationships from an AnnData object into a knowledge graph.
+    
+    Args:
+        adata: The AnnData object.
+        cell_type_columns: List of column names in adata.obs that contain cell type annotations.
+        tissue_column: Column name in adata.obs that contains tissue annotations.
+        disease_column: Column name in adata.obs that contains disease annotations.
+        dev_stage_column: Column name in adata.obs that contains developmental stage annotations.
+        assay_column: Column name in adata.obs that contains assay annotations.
+        dataset_name: Name of the dataset.
+        profiler: Optional profiler recording per-column and per-step metrics.
+        metadata_columns: Metadata column mapping to use instead of the default one
+            (in which case the tissue/disease/dev_stage/assay column names are ignored).
+        cl_id_column: Column name in adata.obs holding Cell Ontology IDs, used to infer the
+            predominant cell type of cell sets from free-text annotation columns.
+        predominance_threshold: Minimum fraction of a cell set's cells that must share a
+            cell type for it to be recorded as predominant.
+        predominance_ties: How to resolve several cell types sharing the highest count:
+            "skip" records none, "lowest_id" records the one with the lowest CL ID.
+        label_resolver: Optional resolver of free-text labels to ontology terms. Cell type
+            labels are resolved to CL terms and metadata labels to terms with the column's
+            prefixes.
+        workers: Number of workers counting (cell type column, metadata column) pairs in
+            parallel; 1 counts all metadata columns in one sequential pass per cell type column.
+        executor: "thread" or "process"; process workers read the obs codes from shared memory.
+        overlap_threshold: If given, record overlaps between cell sets of different columns
+            whose `overlap_metric` is at least this value (default: no overlaps).
+        overlap_metric: "jaccard" or "overlap_coefficient".
+        donor_column: Column name in adata.obs identifying donors (or samples); if given,
+            cell sets and associations also get the number of donors contributing cells
+            and the min/median/max of their per-donor ratios.
+        cell_weights: Optional weight of each cell, e.g. the number of cells of a dataset
+            that each cell of a sample stands for. Association ratios and predominant cell
+            type fractions are then ratios of the weights; counts are still cell counts.
+        
+    Returns:
+        The populated KnowledgeGraph.
+    """
+    profiler = profiler or NULL_PROFILER
+    logger.info("Extracting cell sets and relationships from AnnData")
+    
+    if metadata_columns is None:
+        metadata_columns = default_metadata_columns(tissue_column, disease_column, dev_stage_column, assay_column)
+    if predominance_ties not in PREDOMINANCE_TIES:
+        raise ValueError(f"Unsupported tie handling: {predominance_ties}")
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unsupported executor: {executor}")
+    if overlap_metric not in OVERLAP_METRICS:
+        raise ValueError(f"Unsupported overlap metric: {overlap_metric}")
+    
+    kg = KnowledgeGraph(
+        name=dataset_name,
+        description=f"Single cell transcriptomics dataset with {adata.n_obs} cells",
+    )
+    with profiler.stage("build_knowledge_graph"):
+        _extract_cell_sets(
+            kg, adata, cell_type_columns, metadata_columns, profiler,
+            cl_id_column, predominance_threshold, predominance_ties, label_resolver,
+            workers, executor, overlap_threshold, overlap_metric, donor_column, cell_weights,
+        )
+    
+    logger.info(f"Extracted {kg.n_cell_sets} cell sets, {kg.n_terms} terms and {kg.n_associations} associations")
+    return kg
+
+
 def get_cell_sets_from_anndata(
     adata: anndata.AnnData,
     cell_type_columns: List[str],
@@ -71,10 +215,14 @@ def get_cell_sets_from_anndata(
     disease_column: str,
     dev_stage_column: str,
     assay_column: str,
+    profiler: Optional[Profiler] = None,
 ) -> Tuple[Dict, Dict, Dict, Dict, Dict, Dict]:
     """
     Extract cell sets and their relationships from an AnnData object.
     
+    This materializes the graph built by `build_knowledge_graph` as plain
+    dictionaries for use with `create_dataset` and `save_objects`.
+    
     Args:
         adata: The AnnData object.
         cell_type_columns: List of column names in adata.obs that contain cell type annotations.
@@ -82,19 +230,360 @@ def get_cell_sets_from_anndata(
         disease_column: Column name in adata.obs that contains disease annotations.
         dev_stage_column: Column name in adata.obs that contains developmental stage annotations.
         assay_column: Column name in adata.obs that contains assay annotations.
+        profiler: Optional profiler recording per-column and per-step metrics.
         
     Returns:
         Tuple of dictionaries: (cell_sets, cell_types, tissues, diseases, dev_stages, assays)
     """
-    logger.info("Extracting cell sets and relationships from AnnData")
+    kg = build_knowledge_graph(
+        adata, cell_type_columns, tissue_column, disease_column, dev_stage_column, assay_column,
+        dataset_name="", profiler=profiler,
+    )
+    return kg.to_legacy_dicts()
+
+
+# Ways of resolving ties between equally frequent cell types
+PREDOMINANCE_TIES = ("skip", "lowest_id")
+
+# Similarity measures selecting the recorded overlaps between cell sets
+OVERLAP_METRICS = ("jaccard", "overlap_coefficient")
+
+
+def _column_codes(values: pd.Series) -> Tuple[np.ndarray, pd.Index]:
+    """
+    Get the integer codes and categories of an obs column.
+    
+    Args:
+        values: The obs column.
+        
+    Returns:
+        Tuple of (codes, categories); missing values have code -1.
+    """
+    import pandas as pd
+    
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    codes, uniques = pd.factorize(values)
+    return codes, pd.Index(uniques)
+
+
+def _multi_crosstab(
+    codes: np.ndarray,
+    n_categories: int,
+    other_codes: List[np.ndarray],
+    other_sizes: List[int],
+    chunk_size: int = 1 << 20,
+    weights: Optional[np.ndarray] = None,
+) -> List[np.ndarray]:
+    """
+    Count co-occurrences of one code array with several others in one pass over the cells.
+    
+    The other columns are laid side by side in a single joint category space
+    (with one extra bin per column for missing values), so each chunk of cells
+    is counted with a single bincount regardless of the number of columns.
+    
+    Args:
+        codes: Codes of the reference column (-1 for missing).
+        n_categories: Number of categories of the reference column.
+        other_codes: Codes of the other columns (-1 for missing).
+        other_sizes: Number of categories of each other column.
+        chunk_size: Number of cells counted per bincount call, bounding temporary memory.
+        weights: Optional weight of each cell, summed instead of counting cells.
+        
+    Returns:
+        One (n_categories, other_size) count array per other column (float sums of
+        weights if `weights` is given).
+    """
+    offsets = np.zeros(len(other_sizes) + 1, dtype=np.int64)
+    np.cumsum(np.asarray(other_sizes, dtype=np.int64) + 1, out=offsets[1:])
+    width = int(offsets[-1])
+    counts = np.zeros((n_categories + 1) * width, dtype=np.int64 if weights is None else np.float64)
+    
+    for start in range(0, len(codes), chunk_size):
+        stop = start + chunk_size
+        rows = (codes[start:stop].astype(np.int64) + 1) * width
+        keys = np.empty((len(rows), len(other_codes)), dtype=np.int64)
+        for i, other in enumerate(other_codes):
+            np.add(other[start:stop], offsets[i] + 1, out=keys[:, i], casting="unsafe")
+        keys += rows[:, None]
+        chunk_weights = None if weights is None else np.repeat(weights[start:stop], len(other_codes))
+        counts += np.bincount(keys.ravel(), weights=chunk_weights, minlength=counts.size)
+    
+    # Drop the bins of cells missing a value in the reference column or the other column
+    counts = counts.reshape(n_categories + 1, width)[1:]
+    return [counts[:, offsets[i] + 1:offsets[i + 1]] for i in range(len(other_codes))]
+
+
+def _resolve_labels(
+    resolver: Optional[LabelResolver],
+    categories: pd.Index,
+    prefixes: Tuple[str, ...],
+    profiler: Profiler,
+    column: str,
+) -> Dict[str, Resolution]:
+    """Resolve the categories of a column that do not carry one of `prefixes` in one batch."""
+    if resolver is None:
+        return {}
+    labels = [v for v in categories if isinstance(v, str) and match_prefix(v, prefixes) is None]
+    if not labels:
+        return {}
+    with profiler.stage("resolve_labels", column=column) as stage:
+        resolved = {label: r for label, r in resolver.resolve(labels, prefixes).items() if r is not None}
+        stage.add_items(len(resolved))
+    logger.info(f"Resolved {len(resolved)} of {len(labels)} labels in column {column}")
+    return resolved
+
+
+def _metadata_terms(
+    categories: pd.Index, spec: MetadataColumn, resolved: Dict[str, Resolution],
+) -> List[Optional[Tuple[str, str]]]:
+    """Map the categories of a metadata column to (term ID, name), or None for values that are not terms."""
+    terms = []
+    for value in categories:
+        if not isinstance(value, str):
+            terms.append(None)
+        elif not spec.prefixes:
+            # Percent-encode the value so that e.g. spaces still give a valid CURIE
+            terms.append((f"schema:{spec.term_class}_{quote(value, safe='')}", value))
+        elif value in resolved:
+            resolution = resolved[value]
+            prefix = match_prefix(resolution.term_id, spec.prefixes)
+            terms.append((create_ontology_term_id(resolution.term_id, prefix), resolution.term_label))
+        else:
+            prefix = match_prefix(value, spec.prefixes)
+            terms.append((create_ontology_term_id(value, prefix), value) if prefix else None)
+    return terms
+
+
+def _infer_predominant_cell_types(
+    kg: KnowledgeGraph,
+    codes: np.ndarray,
+    counts: np.ndarray,
+    cell_set_of_code: np.ndarray,
+    cl_codes: np.ndarray,
+    cl_categories: pd.Index,
+    threshold: float,
+    ties: str,
+    weights: Optional[np.ndarray] = None,
+) -> int:
+    """
+    Infer the predominant cell type of the cell sets of one annotation column.
+    
+    The column is crosstabulated once against a column of Cell Ontology IDs. A cell
+    set whose most frequent CL term covers at least `threshold` of its cells is
+    linked to that term, with the fraction recorded. Cell sets that already have a
+    cell type (because their value is a CL ID) are left unchanged.
+    
+    Args:
+        kg: The knowledge graph holding the cell sets.
+        codes: Codes of the annotation column.
+        counts: Number of cells per code of the annotation column.
+        cell_set_of_code: Cell set index per code of the annotation column (-1 for none).
+        cl_codes: Codes of the CL ID column.
+        cl_categories: Categories of the CL ID column.
+        threshold: Minimum fraction of cells for a cell type to be predominant.
+        ties: "skip" or "lowest_id".
+        weights: Optional weight of each cell; fractions are then fractions of the weights.
+        
+    Returns:
+        The number of cell sets linked to an inferred cell type.
+    """
+    is_cl = np.array([isinstance(v, str) and v.startswith(("CL:", "CL_")) for v in cl_categories], dtype=bool)
+    if not is_cl.any():
+        return 0
+    cl_ids = np.array([create_ontology_term_id(v, "CL") for v in cl_categories[is_cl]], dtype=object)
+    
+    # Order the CL columns by ID so that argmax picks the lowest ID among ties
+    order = np.argsort(cl_ids, kind="stable")
+    table = crosstab(codes, len(counts), cl_codes, len(cl_categories), weights)[:, np.flatnonzero(is_cl)[order]]
+    cl_ids = cl_ids[order]
+    if weights is not None:
+        valid = codes >= 0
+        counts = np.bincount(codes[valid], weights=weights[valid], minlength=len(counts))
+    
+    best = table.argmax(axis=1)
+    best_count = table[np.arange(len(best)), best]
+    n_best = (table == best_count[:, None]).sum(axis=1)
+    fraction = np.divide(best_count, counts, out=np.zeros(len(counts)), where=counts > 0)
+    
+    eligible = (cell_set_of_code >= 0) & (best_count > 0) & (fraction >= threshold)
+    if ties == "skip":
+        eligible &= n_best == 1
+    
+    n_linked = 0
+    for code in np.flatnonzero(eligible):
+        cs_index = int(cell_set_of_code[code])
+        if kg.cell_set(cs_index).predominantly_consists_of >= 0:
+            continue
+        cell_type_id = cl_ids[best[code]]
+        term_index = kg.add_term(
+            cell_type_id, "CellType", name=cell_type_id, description=f"Cell type: {cell_type_id}",
+        )
+        kg.set_predominant_cell_type(cs_index, term_index, fraction=float(fraction[code]))
+        n_linked += 1
+    return n_linked
+
+
+# Largest (row, donor) key space counted with a dense bincount
+DENSE_DONOR_KEYS = 1 << 22
+
+
+def _donor_counts(row_codes: np.ndarray, n_rows: int, donor_codes: np.ndarray, n_donors: int) -> Any:
+    """
+    Count the cells of each (row code, donor) pair into a sparse matrix.
+    
+    As in `_multi_crosstab`, missing codes are shifted into an extra bin rather
+    than masked out. Pairs are counted with a bincount over the joint (row, donor)
+    key space when it is small enough, else by sorting the keys; the nonzero keys,
+    in order, are the CSR entries.
+    
+    Args:
+        row_codes: Row code of each cell (-1 for missing).
+        n_rows: Number of row codes.
+        donor_codes: Donor code of each cell (-1 for missing).
+        n_donors: Number of donors.
+        
+    Returns:
+        A (n_rows, n_donors) CSR matrix in canonical format (sorted indices, no duplicates).
+    """
+    from scipy import sparse
+    
+    width = n_donors + 1
+    keys = row_codes.astype(np.int64) + 1
+    keys *= width
+    keys += donor_codes
+    keys += 1
+    if (n_rows + 1) * width <= DENSE_DONOR_KEYS:
+        counts = np.bincount(keys, minlength=(n_rows + 1) * width)
+        keys = np.flatnonzero(counts)
+        counts = counts[keys]
+    else:
+        keys, counts = np.unique(keys, return_counts=True)
+    # Drop the bins of cells missing a row code or a donor
+    rows, donors = np.divmod(keys, width)
+    keep = (rows > 0) & (donors > 0)
+    rows, donors, counts = rows[keep] - 1, donors[keep] - 1, counts[keep]
+    indptr = np.searchsorted(rows, np.arange(n_rows + 1))
+    return sparse.csr_matrix((counts, donors, indptr), shape=(n_rows, n_donors))
+
+
+def _donor_summary(indptr: np.ndarray, ratios: np.ndarray, population: np.ndarray) -> DonorSummary:
+    """
+    Summarize per-donor ratios stored row by row like the data of a CSR matrix.
+    
+    Each row has one explicit ratio per donor with cells and, up to `population`
+    donors, implicit zero ratios. The order statistics of all rows are read at once
+    from the explicit ratios sorted within each row, after the row's implicit zeros.
+    
+    Args:
+        indptr: CSR index pointer of the rows.
+        ratios: The explicit (non-zero) ratios.
+        population: Number of donors, explicit or not, of each row.
+        
+    Returns:
+        The donor count and min/median/max ratio of each row; NaN ratios for rows
+        without donors.
+    """
+    donor_count = np.diff(indptr)
+    rows = np.repeat(np.arange(len(donor_count)), donor_count)
+    # Sorted ratios of each row, and a trailing zero so that empty rows can be indexed
+    ordered = np.append(ratios[np.lexsort((ratios, rows))], 0.0)
+    zeros = population - donor_count
+    
+    def statistic(position: np.ndarray) -> np.ndarray:
+        index = np.clip(indptr[:-1] + position - zeros, 0, len(ordered) - 1)
+        return np.where(position >= zeros, ordered[index], 0.0)
+    
+    empty = population == 0
+    median = (statistic((population - 1) // 2) + statistic(population // 2)) / 2
+    return DonorSummary(
+        donor_count.astype(np.int32),
+        *(np.where(empty, np.nan, values).astype(np.float32)
+          for values in (statistic(np.zeros_like(population)), median, statistic(population - 1))),
+    )
+
+
+def _cell_set_overlaps(
+    kg: KnowledgeGraph,
+    cell_type_codes: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]],
+    n_cells: int,
+    threshold: float,
+    metric: str,
+) -> int:
+    """
+    Record the overlaps between cell sets of different columns above a threshold.
     
-    # Initialize dictionaries to store entities
-    cell_sets = {}
-    cell_types = {}
-    tissues = {}
-    diseases = {}
-    dev_stages = {}
-    assays = {}
+    The cells' memberships form a sparse (cells x cell sets) matrix M with one
+    entry per cell and cell type column; all pairwise intersection sizes are the
+    off-diagonal entries of the single sparse product M.T @ M. Pairs where one
+    cell set is a strict subset of the other are already linked by `subset_of`
+    and are skipped.
+    
+    Returns:
+        The number of overlaps recorded.
+    """
+    from scipy import sparse
+    
+    rows, cols = [], []
+    for codes, _, cell_set_of_code in cell_type_codes.values():
+        valid = np.flatnonzero(codes >= 0)
+        rows.append(valid)
+        cols.append(cell_set_of_code[codes[valid]])
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    membership = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(n_cells, kg.n_cell_sets),
+    )
+    intersections = sparse.triu(membership.T @ membership, k=1).tocoo()
+    
+    a, b, counts = intersections.row, intersections.col, intersections.data.astype(np.int64)
+    sizes = np.fromiter((cs.cell_count for cs in kg.iter_cell_set_records()), dtype=np.int64, count=kg.n_cell_sets)
+    size_a, size_b = sizes[a], sizes[b]
+    if metric == "jaccard":
+        scores = counts / (size_a + size_b - counts)
+    else:
+        scores = counts / np.minimum(size_a, size_b)
+    is_strict_subset = (counts == np.minimum(size_a, size_b)) & (size_a != size_b)
+    keep = (counts > 0) & (scores >= threshold) & ~is_strict_subset
+    kg.add_overlaps(a[keep], b[keep], counts[keep])
+    return int(keep.sum())
+
+
+def _extract_cell_sets(
+    kg: KnowledgeGraph,
+    adata: anndata.AnnData,
+    cell_type_columns: List[str],
+    metadata_columns: List[MetadataColumn],
+    profiler: Profiler,
+    cl_id_column: Optional[str] = None,
+    predominance_threshold: float = 0.5,
+    predominance_ties: str = "skip",
+    label_resolver: Optional[LabelResolver] = None,
+    workers: int = 1,
+    executor: str = "thread",
+    overlap_threshold: Optional[float] = None,
+    overlap_metric: str = "jaccard",
+    donor_column: Optional[str] = None,
+    cell_weights: Optional[np.ndarray] = None,
+) -> None:
+    """Body of `build_knowledge_graph`, run inside its profiling stage."""
+    from linkml_runtime.utils.formatutils import camelcase
+    from scipy import sparse
+    
+    # Codes and categories of each cell type column, and the cell set index of each code
+    cell_type_codes = {}
+    
+    # Codes and cell counts of the donors
+    donors = None
+    if donor_column is not None:
+        if donor_column not in adata.obs.columns:
+            logger.warning(f"Donor column {donor_column} not found in AnnData.obs")
+        else:
+            donor_codes, donor_categories = _column_codes(adata.obs[donor_column])
+            donor_totals = np.bincount(donor_codes[donor_codes >= 0], minlength=len(donor_categories))
+            donors = (donor_codes, donor_totals)
+            kg.donor_column = donor_column
+    # (cell set x donor) cell counts of each cell type column
+    donor_tables = {}
     
     # Process each cell type column to create cell sets
     for col in cell_type_columns:
@@ -103,124 +592,353 @@ def get_cell_sets_from_anndata(
             continue
             
         logger.info(f"Processing cell type column: {col}")
+
+        with profiler.stage("cell_type_column", column=col) as stage:
+            codes, categories = _column_codes(adata.obs[col])
+            counts = np.bincount(codes[codes >= 0], minlength=len(categories))
+            cell_set_of_code = np.full(len(categories), -1, dtype=np.int64)
+            resolved = _resolve_labels(label_resolver, categories[counts > 0], ("CL",), profiler, col)
         
-        # Get unique values in this column
-        unique_values = adata.obs[col].unique()
-        
-        for value in unique_values:
-            if pd.isna(value):
-                continue
+            for code, value in enumerate(categories):
+                if counts[code] == 0:
+                    continue
                 
-            # Create a unique ID for this cell set
-            cell_set_id = f"schema:CellSet_{camelcase(col)}_{uuid.uuid4().hex[:8]}"
+                # Create a unique ID for this cell set
+                cell_set_id = f"schema:CellSet_{camelcase(col)}_{uuid.uuid4().hex[:8]}"
             
-            # Get cells with this annotation
-            mask = adata.obs[col] == value
-            cell_count = mask.sum()
+                # Create cell set
+                cs_index = kg.add_cell_set(
+                    cell_set_id,
+                    name=f"{value} cells from {col}",
+                    description=f"Cells annotated as {value} in the {col} column",
+                    obs_column=col,
+                    obs_value=str(value),
+                    cell_count=int(counts[code]),
+                )
+                cell_set_of_code[code] = cs_index
+                stage.add_items(1)
             
-            # Create cell set
-            cell_sets[cell_set_id] = {
-                "id": cell_set_id,
-                "name": f"{value} cells from {col}",
-                "description": f"Cells annotated as {value} in the {col} column",
-                "obs_column": col,
-                "cell_count": int(cell_count),
-            }
+                # Check if this value corresponds to a Cell Ontology term
+                if isinstance(value, str) and value.startswith(("CL:", "CL_")):
+                    # Create cell type entity and link the cell set to it
+                    cell_type_id = create_ontology_term_id(value, "CL")
+                    term_index = kg.add_term(
+                        cell_type_id, "CellType", name=value, description=f"Cell type: {value}",
+                    )
+                    kg.set_predominant_cell_type(cs_index, term_index)
+                elif value in resolved:
+                    # Link free-text labels that resolve to a Cell Ontology term
+                    resolution = resolved[value]
+                    term_index = kg.add_term(
+                        create_ontology_term_id(resolution.term_id, "CL"), "CellType",
+                        name=resolution.term_label, description=f"Cell type: {resolution.term_label}",
+                    )
+                    kg.set_predominant_cell_type(cs_index, term_index)
+        
+            cell_type_codes[col] = (codes, counts, cell_set_of_code)
             
-            # Check if this value corresponds to a Cell Ontology term
-            if isinstance(value, str) and value.startswith(("CL:", "CL_")):
-                # Create cell type entity
-                cell_type_id = create_ontology_term_id(value, "CL")
-                
-                if cell_type_id not in cell_types:
-                    cell_types[cell_type_id] = {
-                        "id": cell_type_id,
-                        "name": value,
-                        "description": f"Cell type: {value}",
-                        "source_uri": cell_type_id,
-                        "predominantly_in": []
-                    }
-                
-                # Link cell set to cell type
-                cell_sets[cell_set_id]["predominantly_consists_of"] = cell_type_id
-                cell_types[cell_type_id]["predominantly_in"].append(cell_set_id)
+            # Fraction of each donor's cells in each cell set, over all donors with cells
+            if donors is not None:
+                donor_codes, donor_totals = donors
+                table = _donor_counts(codes, len(categories), donor_codes, len(donor_totals))
+                donor_tables[col] = table
+                used = np.flatnonzero(counts)
+                rows = table[used]
+                kg.set_cell_set_donors(cell_set_of_code[used], _donor_summary(
+                    rows.indptr, rows.data / donor_totals[rows.indices],
+                    np.full(len(used), np.count_nonzero(donor_totals)),
+                ))
+    
+    # Infer predominant cell types of free-text cell sets from the CL ID column
+    if cl_id_column is not None:
+        if cl_id_column not in adata.obs.columns:
+            logger.warning(f"Cell type ID column {cl_id_column} not found in AnnData.obs")
+        else:
+            logger.info(f"Inferring predominant cell types from column: {cl_id_column}")
+            with profiler.stage("predominant_cell_types", column=cl_id_column) as stage:
+                cl_codes, cl_categories = _column_codes(adata.obs[cl_id_column])
+                for col, (codes, counts, cell_set_of_code) in cell_type_codes.items():
+                    if col == cl_id_column:
+                        continue
+                    stage.add_items(_infer_predominant_cell_types(
+                        kg, codes, counts, cell_set_of_code, cl_codes, cl_categories,
+                        predominance_threshold, predominance_ties, cell_weights,
+                    ))
     
     # Process subset relationships between cell sets
-    # We assume that a cell set is a subset of another if its cells are a proper subset
-    for cs1_id, cs1 in cell_sets.items():
-        cs1_mask = adata.obs[cs1["obs_column"]] == cs1["name"].split()[0]  # Extract the value part
-        
-        for cs2_id, cs2 in cell_sets.items():
-            if cs1_id == cs2_id:
-                continue
+    # A cell set is a subset of another if its cells are a proper subset. Cell sets
+    # from the same column are disjoint, so only pairs of columns are compared,
+    # using their crosstab: a is a subset of b iff all cells of a are in b and b is larger.
+    with profiler.stage("subset_of") as stage:
+        for col1, (codes1, counts1, cs_of_code1) in cell_type_codes.items():
+            for col2, (codes2, counts2, cs_of_code2) in cell_type_codes.items():
+                if col1 == col2:
+                    continue
                 
-            cs2_mask = adata.obs[cs2["obs_column"]] == cs2["name"].split()[0]  # Extract the value part
-            
-            # Check if cs1 is a subset of cs2
-            if np.all(cs1_mask & cs2_mask == cs1_mask) and np.any(cs2_mask & ~cs1_mask):
-                if "subset_of" not in cs1:
-                    cs1["subset_of"] = []
-                cs1["subset_of"].append(cs2_id)
+                overlap = crosstab(codes1, len(counts1), codes2, len(counts2))
+                is_subset = (overlap == counts1[:, None]) & (counts2[None, :] > counts1[:, None]) & (overlap > 0)
+                for code1, code2 in zip(*np.nonzero(is_subset)):
+                    kg.add_subset_of(int(cs_of_code1[code1]), int(cs_of_code2[code2]))
+                    stage.add_items(1)
     
-    # Process metadata columns to create metadata associations
-    metadata_columns = {
-        "tissue": (tissue_column, tissues, "UBERON", "has_tissue"),
-        "disease": (disease_column, diseases, "MONDO", "has_disease"),
-        "dev_stage": (dev_stage_column, dev_stages, "HsapDv", "has_developmental_stage"),
-        "assay": (assay_column, assays, "EFO", "has_assay")
-    }
+    # Record overlaps between cell sets of different columns
+    if overlap_threshold is not None and len(cell_type_codes) > 1:
+        with profiler.stage("overlaps", metric=overlap_metric) as stage:
+            n_overlaps = _cell_set_overlaps(kg, cell_type_codes, adata.n_obs, overlap_threshold, overlap_metric)
+            stage.add_items(n_overlaps)
+        logger.info(f"Recorded {n_overlaps} overlaps with {overlap_metric} >= {overlap_threshold}")
     
-    for metadata_type, (col_name, term_dict, prefix, assoc_slot) in metadata_columns.items():
-        if col_name not in adata.obs.columns:
-            logger.warning(f"{metadata_type.capitalize()} column {col_name} not found in AnnData.obs")
+    # Process metadata columns to create metadata associations
+    present = []
+    for spec in metadata_columns:
+        if spec.column not in adata.obs.columns:
+            log = logger.warning if spec.required else logger.debug
+            log(f"{spec.name.capitalize()} column {spec.column} not found in AnnData.obs")
             continue
+        kg.register_term_class(spec.term_class, spec.collection)
+        kg.register_association_slot(spec.slot)
+        present.append(spec)
+    
+    if not present or not cell_type_codes:
+        return
+    
+    logger.info(f"Processing metadata from columns: {', '.join(spec.column for spec in present)}")
+    
+    # Terms of each metadata column, by code
+    metadata_codes = []
+    metadata_terms = []
+    for spec in present:
+        codes, categories = _column_codes(adata.obs[spec.column])
+        term_of_code = np.full(len(categories), -1, dtype=np.int64)
+        resolved = _resolve_labels(label_resolver, categories, spec.prefixes, profiler, spec.column) if spec.prefixes else {}
+        for code, term in enumerate(_metadata_terms(categories, spec, resolved)):
+            if term is not None:
+                term_id, name = term
+                term_of_code[code] = kg.add_term(
+                    term_id, spec.term_class, name=name, description=f"{spec.name.capitalize()}: {name}",
+                )
+        metadata_codes.append(codes)
+        metadata_terms.append(term_of_code)
+    
+    sizes = [len(t) for t in metadata_terms]
+    
+    def count_by_donor(n_codes: int) -> bool:
+        """Whether to count the cells of a cell type column by (code, donor) with dense bincounts."""
+        return donors is not None and n_codes * (len(donors[1]) + 1) * (sum(sizes) + len(sizes)) <= DENSE_DONOR_KEYS
+    
+    def joint_donor_codes(codes: np.ndarray) -> np.ndarray:
+        """Codes of (cell type code, donor) with a bin for cells missing a donor."""
+        donor_codes, n_donors = donors[0], len(donors[1])
+        return np.where(codes >= 0, codes.astype(np.int64) * (n_donors + 1) + donor_codes + 1, -1)
+    
+    # Count the (cell type column, metadata column) pairs on a worker pool, by donor
+    # where the donors are counted densely
+    pair_tables = {}
+    cell_type_keys = {}
+    if workers > 1:
+        with profiler.stage("metadata_crosstabs", executor=executor) as stage:
+            codes_by_key = {("metadata", i): c for i, c in enumerate(metadata_codes)}
+            key_sizes = {("metadata", i): size for i, size in enumerate(sizes)}
+            for col, (codes, counts, _) in cell_type_codes.items():
+                if count_by_donor(len(counts)):
+                    key = ("cell_type_donor", col)
+                    codes_by_key[key] = joint_donor_codes(codes)
+                    key_sizes[key] = len(counts) * (len(donors[1]) + 1)
+                else:
+                    key = ("cell_type", col)
+                    codes_by_key[key] = codes
+                    key_sizes[key] = len(counts)
+                cell_type_keys[col] = key
+            pairs = [(cell_type_keys[col], ("metadata", i)) for col in cell_type_codes for i in range(len(present))]
+            with CrosstabExecutor(codes_by_key, key_sizes, workers, kind=executor) as pool:
+                pair_tables = pool.crosstabs(pairs)
+            stage.add_items(len(pairs))
+    
+    # Otherwise count all metadata columns against each cell type column in one pass
+    for col, (codes, counts, cell_set_of_code) in cell_type_codes.items():
+        with profiler.stage("metadata_associations", column=col) as stage:
+            by_donor = None
+            counted_by_donor = cell_type_keys[col][0] == "cell_type_donor" if pair_tables else count_by_donor(len(counts))
+            if donors is not None and not counted_by_donor:
+                logger.info(f"Counting the donors of the associations of column {col} in one sparse pass per metadata column")
+            if pair_tables:
+                tables = [pair_tables[(cell_type_keys[col], ("metadata", i))] for i in range(len(present))]
+            elif counted_by_donor:
+                # Count by (cell type code, donor) in the same pass
+                tables = _multi_crosstab(
+                    joint_donor_codes(codes), len(counts) * (len(donors[1]) + 1), metadata_codes, sizes,
+                )
+            else:
+                tables = _multi_crosstab(codes, len(counts), metadata_codes, sizes)
+            if counted_by_donor:
+                # Sum the donors out
+                by_donor = [table.reshape(len(counts), len(donors[1]) + 1, -1) for table in tables]
+                tables = [table.sum(axis=1) for table in by_donor]
+            if cell_weights is not None:
+                # Ratios of the weights of each cell set's cells carrying each term
+                weighted_tables = _multi_crosstab(codes, len(counts), metadata_codes, sizes, weights=cell_weights)
+                valid = codes >= 0
+                set_weights = np.bincount(codes[valid], weights=cell_weights[valid], minlength=len(counts))
             
-        logger.info(f"Processing {metadata_type} metadata from column: {col_name}")
+            for i, (spec, table, term_of_code) in enumerate(zip(present, tables, metadata_terms)):
+                is_term = term_of_code >= 0
+                cs_codes, md_codes = np.nonzero(table[:, is_term])
+                md_codes = np.flatnonzero(is_term)[md_codes]
+                association_donors = None
+                if donors is not None:
+                    if by_donor is not None:
+                        pair_donors = sparse.csr_matrix(by_donor[i][cs_codes, 1:, md_codes])
+                    else:
+                        pair_donors = _pair_donor_counts(
+                            codes, len(counts), metadata_codes[i], sizes[i], donors[0], len(donors[1]), cs_codes, md_codes,
+                        )
+                    association_donors = _association_donors(donor_tables[col], pair_donors, cs_codes)
+                cell_ratios = None
+                if cell_weights is not None:
+                    cell_ratios = weighted_tables[i][cs_codes, md_codes] / set_weights[cs_codes]
+                kg.add_associations(
+                    cell_set_of_code[cs_codes], spec.slot, term_of_code[md_codes], table[cs_codes, md_codes],
+                    donors=association_donors, cell_ratios=cell_ratios,
+                )
+                stage.add_items(len(cs_codes))
+
+
+def _pair_donor_counts(
+    codes: np.ndarray,
+    n_categories: int,
+    metadata_codes: np.ndarray,
+    n_metadata: int,
+    donor_codes: np.ndarray,
+    n_donors: int,
+    cs_codes: np.ndarray,
+    md_codes: np.ndarray,
+) -> Any:
+    """
+    Count the cells of (cell type code, metadata code) pairs by donor.
+    
+    Args:
+        codes: Cell type codes of the cells (-1 for missing).
+        n_categories: Number of cell type codes.
+        metadata_codes: Metadata codes of the cells (-1 for missing).
+        n_metadata: Number of metadata codes.
+        donor_codes: Donor codes of the cells (-1 for missing).
+        n_donors: Number of donors.
+        cs_codes: Cell type code of each pair.
+        md_codes: Metadata code of each pair.
         
-        # Get unique values in this column
-        unique_values = adata.obs[col_name].unique()
+    Returns:
+        A (pairs, n_donors) CSR matrix.
+    """
+    # Rows of all pairs with an extra bin for missing codes, whose rows are never looked up
+    pairs = codes.astype(np.int64) + 1
+    pairs *= n_metadata + 1
+    pairs += metadata_codes
+    pairs += 1
+    table = _donor_counts(pairs, (n_categories + 1) * (n_metadata + 1), donor_codes, n_donors)
+    return table[(cs_codes.astype(np.int64) + 1) * (n_metadata + 1) + md_codes + 1]
+
+
+def _association_donors(cell_set_donors: Any, association_donors: Any, cs_codes: np.ndarray) -> DonorSummary:
+    """
+    Summarize over donors the cells of metadata associations.
+    
+    A donor's ratio is the fraction of its cells in the cell set that are in the
+    association, over the donors with cells in the cell set.
+    
+    Args:
+        cell_set_donors: (cell type code x donor) cell counts, from `_donor_counts`.
+        association_donors: (association x donor) cell counts, as a CSR matrix.
+        cs_codes: Cell type code of each association.
         
-        for value in unique_values:
-            if pd.isna(value):
-                continue
-                
-            # Check if this value corresponds to an ontology term
-            if isinstance(value, str) and value.startswith((f"{prefix}:", f"{prefix}_")):
-                # Create ontology term entity
-                term_id = create_ontology_term_id(value, prefix)
-                
-                if term_id not in term_dict:
-                    term_dict[term_id] = {
-                        "id": term_id,
-                        "name": value,
-                        "description": f"{metadata_type.capitalize()}: {value}",
-                        "source_uri": term_id,
-                        "present_in_cell_sets": []
-                    }
-                
-                # For each cell set, count cells with this metadata
-                for cs_id, cs in cell_sets.items():
-                    cs_mask = adata.obs[cs["obs_column"]] == cs["name"].split()[0]
-                    metadata_mask = adata.obs[col_name] == value
-                    cell_count = (cs_mask & metadata_mask).sum()
-                    
-                    if cell_count > 0:
-                        if assoc_slot not in cs:
-                            cs[assoc_slot] = []
-                            
-                        # Calculate cell_ratio (proportion of cells in the cell set)
-                        total_cells = cs["cell_count"]
-                        cell_ratio = float(cell_count) / total_cells if total_cells > 0 else 0.0
-                        
-                        cs[assoc_slot].append({
-                            "term": term_id,
-                            "count": int(cell_count),
-                            "cell_ratio": cell_ratio
-                        })
-                        
-                        term_dict[term_id]["present_in_cell_sets"].append(cs_id)
-    
-    return cell_sets, cell_types, tissues, diseases, dev_stages, assays
+    Returns:
+        The donor summary of each association.
+    """
+    n_donors = cell_set_donors.shape[1]
+    # Cells of the cell set from each donor, looked up by (cell type code, donor) key
+    cs_rows = np.repeat(np.arange(cell_set_donors.shape[0]), np.diff(cell_set_donors.indptr))
+    cs_keys = cs_rows * n_donors + cell_set_donors.indices
+    keys = np.repeat(cs_codes.astype(np.int64), np.diff(association_donors.indptr)) * n_donors + association_donors.indices
+    totals = cell_set_donors.data[np.searchsorted(cs_keys, keys)]
+    return _donor_summary(
+        association_donors.indptr, association_donors.data / totals, np.diff(cell_set_donors.indptr)[cs_codes],
+    )
+
+
+# Metadata dimensions of the cube by default, by metadata column name
+CUBE_DIMENSIONS = ("tissue", "disease", "assay")
+
+
+def build_cube(
+    adata: anndata.AnnData,
+    cell_type_column: str,
+    metadata_columns: List[MetadataColumn],
+    dataset_id: str,
+    dimensions: Tuple[str, ...] = CUBE_DIMENSIONS,
+    profiler: Optional[Profiler] = None,
+    label_resolver: Optional[LabelResolver] = None,
+) -> Optional[Cube]:
+    """
+    Count the cells of every (cell type, metadata...) label combination of a dataset.
+    
+    Unlike the `has_*` associations, which count each metadata column against the
+    cell type columns separately, the cube keeps joint counts (e.g. cells of a type
+    in a tissue under a disease). Values are labelled with the ontology term IDs the
+    graph uses for them, so cubes of different datasets can be merged.
+    
+    Args:
+        adata: The AnnData object.
+        cell_type_column: Column name in adata.obs of the cell type dimension.
+        metadata_columns: Metadata column mapping.
+        dataset_id: ID of the dataset.
+        dimensions: Names of the metadata columns used as further dimensions.
+        profiler: Optional profiler recording the time spent.
+        label_resolver: Optional resolver of free-text labels to ontology terms.
+        
+    Returns:
+        The cube, or None if the cell type column is missing.
+    """
+    profiler = profiler or NULL_PROFILER
+    if cell_type_column not in adata.obs.columns:
+        logger.warning(f"Cube cell type column {cell_type_column} not found in AnnData.obs")
+        return None
+    
+    specs = {spec.name: spec for spec in metadata_columns}
+    dims, codes, code_labels = ["cell_type"], [], []
+    for name in dimensions:
+        if name not in specs:
+            logger.warning(f"Cube dimension {name} is not a configured metadata column")
+        elif specs[name].column not in adata.obs.columns:
+            logger.warning(f"Cube dimension {name}: column {specs[name].column} not found in AnnData.obs")
+        else:
+            dims.append(name)
+    
+    with profiler.stage("build_cube", dimensions=len(dims)) as stage:
+        ct_codes, ct_categories = _column_codes(adata.obs[cell_type_column])
+        resolved = _resolve_labels(label_resolver, ct_categories, ("CL",), profiler, cell_type_column)
+        labels = []
+        for value in ct_categories:
+            if isinstance(value, str) and value.startswith(("CL:", "CL_")):
+                labels.append(create_ontology_term_id(value, "CL"))
+            elif value in resolved:
+                labels.append(create_ontology_term_id(resolved[value].term_id, "CL"))
+            else:
+                labels.append(str(value))
+        codes.append(ct_codes)
+        code_labels.append(labels)
+        
+        for name in dims[1:]:
+            spec = specs[name]
+            md_codes, categories = _column_codes(adata.obs[spec.column])
+            resolved = _resolve_labels(label_resolver, categories, spec.prefixes, profiler, spec.column) if spec.prefixes else {}
+            terms = _metadata_terms(categories, spec, resolved)
+            codes.append(md_codes)
+            code_labels.append([term[0] if term is not None else str(value) for term, value in zip(terms, categories)])
+        
+        cube = Cube.from_codes(dims, codes, code_labels, dataset_id)
+        stage.add_items(len(cube))
+    
+    logger.info(f"Built cube over {dims} with {len(cube)} non-empty cells")
+    return cube
 
 
 def create_dataset(
@@ -232,6 +950,7 @@ def create_dataset(
     dev_stages: Dict,
     assays: Dict,
     dataset_name: str,
+    profiler: Optional[Profiler] = None,
 ) -> Dict:
     """
     Create a dataset object that contains all the entities.
@@ -245,24 +964,28 @@ def create_dataset(
         dev_stages: Dictionary of developmental stages.
         assays: Dictionary of assays.
         dataset_name: Name of the dataset.
+        profiler: Optional profiler recording the time spent.
         
     Returns:
         A dictionary representing the dataset.
     """
+    profiler = profiler or NULL_PROFILER
     logger.info("Creating dataset object")
     
-    dataset_id = f"schema:Dataset_{uuid.uuid4().hex[:8]}"
-    
-    # Combine all ontology terms
-    ontology_terms = list(cell_types.keys()) + list(tissues.keys()) + list(diseases.keys()) + list(dev_stages.keys()) + list(assays.keys())
-    
-    dataset = {
-        "id": dataset_id,
-        "name": dataset_name,
-        "description": f"Single cell transcriptomics dataset with {adata.n_obs} cells",
-        "cell_sets": list(cell_sets.keys()),
-        "ontology_terms": ontology_terms,
-    }
+    with profiler.stage("create_dataset") as stage:
+        dataset_id = f"schema:Dataset_{uuid.uuid4().hex[:8]}"
+        
+        # Combine all ontology terms
+        ontology_terms = list(cell_types.keys()) + list(tissues.keys()) + list(diseases.keys()) + list(dev_stages.keys()) + list(assays.keys())
+        
+        dataset = {
+            "id": dataset_id,
+            "name": dataset_name,
+            "description": f"Single cell transcriptomics dataset with {adata.n_obs} cells",
+            "cell_sets": list(cell_sets.keys()),
+            "ontology_terms": ontology_terms,
+        }
+        stage.add_items(len(cell_sets) + len(ontology_terms))
     
     return dataset
 
@@ -277,6 +1000,7 @@ def save_objects(
     dev_stages: Dict,
     assays: Dict,
     format: str = "json",
+    profiler: Optional[Profiler] = None,
 ) -> None:
     """
     Save all objects to a file.
@@ -291,7 +1015,9 @@ def save_objects(
         dev_stages: Dictionary of developmental stages.
         assays: Dictionary of assays.
         format: Output format ("json" or "yaml").
+        profiler: Optional profiler recording the time spent serializing.
     """
+    profiler = profiler or NULL_PROFILER
     logger.info(f"Saving objects to {output_file} in {format} format")
     
     # Combine all objects
@@ -307,16 +1033,19 @@ def save_objects(
     
     # Save to file
     try:
-        if format.lower() == "json":
-            # Use standard json module since LinkML's dumper doesn't support indent
-            with open(output_file, "w") as f:
-                import json
-                json.dump(objects, f, indent=2)
-        elif format.lower() == "yaml":
-            yaml_dumper.dump(objects, output_file)
-        else:
-            logger.error(f"Unsupported format: {format}")
-            raise ValueError(f"Unsupported format: {format}")
+        with profiler.stage("save_objects", format=format.lower()) as stage:
+            if format.lower() == "json":
+                # Use standard json module since LinkML's dumper doesn't support indent
+                with open(output_file, "w") as f:
+                    import json
+                    json.dump(objects, f, indent=2)
+            elif format.lower() == "yaml":
+                from linkml_runtime.dumpers import yaml_dumper
+                yaml_dumper.dump(objects, output_file)
+            else:
+                logger.error(f"Unsupported format: {format}")
+                raise ValueError(f"Unsupported format: {format}")
+            stage.add_items(sum(len(v) for k, v in objects.items() if k != "dataset") + 1)
             
         logger.info(f"Successfully saved data to {output_file}")
     except Exception as e:
@@ -324,12 +1053,46 @@ def save_objects(
         raise
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Populate single cell transcriptomics schema from AnnData (h5ad) files")
-    parser.add_argument("input_file", help="Path to the input h5ad file")
+def save_knowledge_graph(
+    kg: KnowledgeGraph,
+    output: str,
+    format: str = "json",
+    profiler: Optional[Profiler] = None,
+    schema_file: Optional[str] = None,
+) -> None:
+    """
+    Save a knowledge graph with the sink for the given format.
+    
+    Args:
+        kg: The knowledge graph.
+        output: Path to the output file (or directory for the columnar format).
+        format: Output format (one of graph_sinks.SINKS).
+        profiler: Optional profiler recording the time spent serializing.
+        schema_file: LinkML schema used by the RDF sink (default: the bundled schema).
+    """
+    profiler = profiler or NULL_PROFILER
+    logger.info(f"Saving objects to {output} in {format} format")
+    
+    try:
+        with profiler.stage("save_objects", format=format.lower()) as stage:
+            kg.save(output, format=format, schema_file=schema_file)
+            stage.add_items(kg.n_cell_sets + kg.n_terms + 1)
+        logger.info(f"Successfully saved data to {output}")
+    except Exception as e:
+        logger.error(f"Error saving data: {e}")
+        raise
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line options of this script to a parser."""
+    parser.add_argument("input_file", help="Path to the input h5ad file or AnnData Zarr store")
     parser.add_argument("--output", "-o", default="dataset.json", help="Path to the output file (default: dataset.json)")
-    parser.add_argument("--format", "-f", choices=["json", "yaml"], default="json", help="Output format (default: json)")
+    parser.add_argument("--format", "-f", choices=sorted(SINKS), default="json",
+                        help="Output format; 'columnar' writes a directory of tables (default: json)")
     parser.add_argument("--dataset-name", default=None, help="Name of the dataset (default: derived from input filename)")
+    parser.add_argument("--schema", "-s", default=SCHEMA_FILE,
+                        help="Path to the LinkML schema file, whose prefixes expand RDF output "
+                             "(default: single_cell_schema.yaml next to this script)")
     parser.add_argument("--cell-type-columns", nargs="+", default=["cell_type", "cell_ontology_term"], 
                         help="Column names in AnnData.obs that contain cell type annotations (default: ['cell_type', 'cell_ontology_term'])")
     parser.add_argument("--tissue-column", default="tissue", 
@@ -340,52 +1103,162 @@ def main():
                         help="Column name in AnnData.obs that contains developmental stage annotations (default: 'development_stage')")
     parser.add_argument("--assay-column", default="assay", 
                         help="Column name in AnnData.obs that contains assay annotations (default: 'assay')")
-    
-    args = parser.parse_args()
-    
+    parser.add_argument("--cl-id-column", default=None,
+                        help="Column name in AnnData.obs that contains Cell Ontology IDs, used to infer the predominant "
+                             "cell type of cell sets from free-text annotation columns (default: no inference)")
+    parser.add_argument("--predominance-threshold", type=float, default=0.5,
+                        help="Minimum fraction of a cell set's cells sharing a cell type for it to be predominant (default: 0.5)")
+    parser.add_argument("--predominance-ties", choices=PREDOMINANCE_TIES, default="skip",
+                        help="How to resolve ties between equally frequent cell types (default: skip)")
+    parser.add_argument("--metadata-config", default=None,
+                        help="YAML file mapping obs columns to ontology prefixes, schema classes and association slots "
+                             "(replaces the default mapping and the --*-column options)")
+    parser.add_argument("--ontology-files", nargs="+", default=None,
+                        help="Local ontology label files (OBO, or TSV with id, label and '|'-separated synonyms) used to "
+                             "resolve free-text labels to ontology terms (default: no label resolution)")
+    parser.add_argument("--label-cache-dir", default=".label_cache",
+                        help="Directory holding the label index and the resolution cache shared across runs (default: .label_cache)")
+    parser.add_argument("--min-label-score", type=float, default=0.85,
+                        help="Minimum trigram similarity for approximate label matches (default: 0.85)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of workers counting cell type and metadata column pairs in parallel (default: 1)")
+    parser.add_argument("--executor", choices=EXECUTORS, default="thread",
+                        help="Worker pool type; process workers share the obs codes through shared memory (default: thread)")
+    parser.add_argument("--read-workers", type=int, default=8,
+                        help="Number of threads reading obs chunks from a Zarr store (default: 8)")
+    parser.add_argument("--overlap-threshold", type=float, default=None,
+                        help="Record overlaps between cell sets of different cell type columns whose "
+                             "--overlap-metric is at least this value (default: no overlaps)")
+    parser.add_argument("--overlap-metric", choices=OVERLAP_METRICS, default="jaccard",
+                        help="Similarity measure compared with --overlap-threshold (default: jaccard)")
+    parser.add_argument("--donor-column", default=None,
+                        help="Column name in AnnData.obs identifying donors (or samples); adds the number of donors and "
+                             "the min/median/max per-donor ratio to cell sets and associations (default: none)")
+    parser.add_argument("--preview-cells", type=int, default=None,
+                        help="Build an approximate graph from a sample of this many cells, with counts scaled up to "
+                             "the whole dataset and confidence intervals (default: use all cells)")
+    parser.add_argument("--preview-strategy", choices=PREVIEW_STRATEGIES, default="stratified",
+                        help="How preview cells are sampled; stratified samples every label of --preview-stratify-column "
+                             "(default: stratified)")
+    parser.add_argument("--preview-stratify-column", default=None,
+                        help="Column whose labels are the strata of stratified previews (default: the first cell type column)")
+    parser.add_argument("--preview-confidence", type=float, default=0.95,
+                        help="Confidence level of the preview's count and ratio intervals (default: 0.95)")
+    parser.add_argument("--preview-rare-threshold", type=int, default=DEFAULT_RARE_THRESHOLD,
+                        help=f"Report labels with fewer sampled cells as rare (default: {DEFAULT_RARE_THRESHOLD})")
+    parser.add_argument("--preview-seed", type=int, default=0, help="Seed of the preview sample (default: 0)")
+    parser.add_argument("--cube", default=None,
+                        help="Also write a cube of joint cell counts (cell type x metadata) to this .npz file "
+                             "(merge and query cubes with cube.py)")
+    parser.add_argument("--cube-dimensions", nargs="+", default=list(CUBE_DIMENSIONS),
+                        help=f"Metadata columns (by name) used as cube dimensions besides the cell type "
+                             f"(default: {' '.join(CUBE_DIMENSIONS)})")
+    parser.add_argument("--cube-cell-type-column", default=None,
+                        help="Column name in AnnData.obs of the cube's cell type dimension "
+                             "(default: --cl-id-column, else the first cell type column present)")
+    parser.add_argument("--write-back", action="store_true",
+                        help="Add the cell set ID of each cell (one <column>_cell_set_id obs column per cell type column) "
+                             "and the dataset ID (uns['kg_dataset_id']) to the input file in place, without rewriting X")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record per-stage timing and memory metrics and write them to <output>.profile.json")
+    parser.add_argument("--profile-prometheus", action="store_true",
+                        help="With --profile, also write the metrics in Prometheus text format to <output>.prom")
+
+
+def run(args: argparse.Namespace) -> KnowledgeGraph:
+    """Run the script with parsed command line options and return the knowledge graph."""
     # Set dataset name if not provided
     if args.dataset_name is None:
         args.dataset_name = os.path.splitext(os.path.basename(args.input_file))[0]
     
-    # Load the AnnData object
-    adata = load_anndata(args.input_file)
+    profiler = Profiler() if args.profile else None
+    metadata_columns = load_metadata_config(args.metadata_config) if args.metadata_config else None
     
-    # Extract cell sets and relationships
-    cell_sets, cell_types, tissues, diseases, dev_stages, assays = get_cell_sets_from_anndata(
-        adata=adata,
+    label_resolver = None
+    if args.ontology_files:
+        os.makedirs(args.label_cache_dir, exist_ok=True)
+        label_index = LabelIndex.load_or_build(args.ontology_files, cache_dir=args.label_cache_dir)
+        label_resolver = LabelResolver(
+            label_index, os.path.join(args.label_cache_dir, "resolutions.sqlite"), min_score=args.min_label_score,
+        )
+    
+    # Load the AnnData object (from Zarr stores, only the obs columns used below)
+    obs_columns = obs_columns_used(
+        args.cell_type_columns, metadata_columns, args.tissue_column, args.disease_column, args.dev_stage_column,
+        args.assay_column, cl_id_column=args.cl_id_column, cube_cell_type_column=args.cube_cell_type_column,
+        donor_column=args.donor_column,
+    )
+    adata = load_anndata(args.input_file, profiler=profiler, obs_columns=obs_columns, read_workers=args.read_workers)
+    
+    # Extract cell sets and relationships, from a sample of the cells for previews
+    build_options = dict(
         cell_type_columns=args.cell_type_columns,
         tissue_column=args.tissue_column,
         disease_column=args.disease_column,
         dev_stage_column=args.dev_stage_column,
         assay_column=args.assay_column,
-    )
-    
-    # Create dataset object
-    dataset = create_dataset(
-        adata=adata,
-        cell_sets=cell_sets,
-        cell_types=cell_types,
-        tissues=tissues,
-        diseases=diseases,
-        dev_stages=dev_stages,
-        assays=assays,
         dataset_name=args.dataset_name,
+        profiler=profiler,
+        metadata_columns=metadata_columns,
+        cl_id_column=args.cl_id_column,
+        predominance_threshold=args.predominance_threshold,
+        predominance_ties=args.predominance_ties,
+        label_resolver=label_resolver,
+        workers=args.workers,
+        executor=args.executor,
+        overlap_threshold=args.overlap_threshold,
+        overlap_metric=args.overlap_metric,
+        donor_column=args.donor_column,
     )
+    if args.preview_cells is not None:
+        kg = build_preview_graph(
+            adata, args.preview_cells, args.preview_strategy, args.preview_stratify_column,
+            confidence=args.preview_confidence, rare_threshold=args.preview_rare_threshold, seed=args.preview_seed,
+            **build_options,
+        )
+    else:
+        kg = build_knowledge_graph(adata=adata, **build_options)
+    
+    # Count joint cell type and metadata combinations
+    if args.cube:
+        cube_column = args.cube_cell_type_column or args.cl_id_column or next(
+            (col for col in args.cell_type_columns if col in adata.obs.columns), args.cell_type_columns[0],
+        )
+        cube = build_cube(
+            adata, cube_column, metadata_columns or default_metadata_columns(
+                args.tissue_column, args.disease_column, args.dev_stage_column, args.assay_column,
+            ),
+            kg.dataset_id, dimensions=tuple(args.cube_dimensions), profiler=profiler, label_resolver=label_resolver,
+        )
+        if cube is not None:
+            cube.save(args.cube)
+    
+    if label_resolver is not None:
+        label_resolver.close()
     
     # Save all objects
-    save_objects(
-        output_file=args.output,
-        dataset=dataset,
-        cell_sets=cell_sets,
-        cell_types=cell_types,
-        tissues=tissues,
-        diseases=diseases,
-        dev_stages=dev_stages,
-        assays=assays,
-        format=args.format,
-    )
+    save_knowledge_graph(kg, args.output, format=args.format, profiler=profiler, schema_file=args.schema)
+    
+    # Add the cell set IDs to the input file, once the graph they refer to is saved
+    if args.write_back:
+        from h5ad_writeback import write_back
+        
+        write_back(args.input_file, kg, adata.obs, profiler=profiler)
+    
+    # Write the profiling report alongside the output
+    if profiler is not None:
+        profiler.write_json(f"{args.output}.profile.json")
+        if args.profile_prometheus:
+            profiler.write_prometheus(f"{args.output}.prom")
     
     logger.info("Done!")
+    return kg
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,331 @@
+"""
+Approximate knowledge graphs from a sample of cells.
+
+For triage, a preview graph is built from a uniform or stratified sample of
+the cells instead of all of them. Cell sets, `subset_of` candidates and
+metadata associations are extracted from the sample as usual, then each
+count is scaled back up to the whole dataset:
+
+- A sampled cell stands for N/n cells (uniform sampling) or for N_h/n_h
+  cells of its stratum h (stratified sampling, by one cell type column;
+  the cell sets of that column then get exact counts).
+- The cell count of a cell set is the sum of the weights of its sampled
+  cells; its interval is the Wilson score interval of its estimated
+  fraction of the dataset over the effective sample size, scaled back up.
+- The cell ratio of an association is the ratio of the weights of the cell
+  set's sampled cells carrying the term, with a Wilson interval over the
+  cell set's effective sample size; its count is the ratio times the cell
+  set's estimated size, with an interval derived like the cell set's (or
+  from the ratio's interval for exactly known cell sets).
+
+The effective sample size of weighted cells is (sum w)^2 / sum w^2 (Kish);
+for uniform samples it is the number of sampled cells.
+
+Intervals use a finite population correction, so they shrink to the
+estimate as the sample approaches the whole dataset. Labels with fewer
+than `rare_threshold` sampled cells, or absent from the sample, are listed
+in the Dataset's `rare_labels`, since their cell sets may be inaccurate or
+missing. `subset_of` relations found in the sample are candidates: a cell
+outside the parent that was not sampled would have ruled them out.
+"""
+
+import logging
+from statistics import NormalDist
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from instrumentation import NULL_PROFILER, Profiler
+from knowledge_graph import KnowledgeGraph, PreviewEstimates
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Cell sampling strategies
+STRATEGIES = ("uniform", "stratified")
+
+# Minimum number of sampled cells per stratum, so rare labels of the stratification column are sampled
+DEFAULT_MIN_PER_STRATUM = 20
+
+# Labels with fewer sampled cells are reported as rare
+DEFAULT_RARE_THRESHOLD = 10
+
+
+class CellSample(NamedTuple):
+    """A sample of the cells of a dataset."""
+
+    indices: np.ndarray  # Sorted positions of the sampled cells
+    weights: np.ndarray  # Number of cells of the dataset each sampled cell stands for
+    n_total: int  # Number of cells in the dataset
+    strategy: str  # "uniform" or "stratified:<column>"
+
+
+def wilson_interval(
+    successes: np.ndarray,
+    trials: np.ndarray,
+    confidence: float = 0.95,
+    population: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Wilson score intervals of binomial proportions.
+
+    Args:
+        successes: Number of successes of each proportion.
+        trials: Number of trials of each proportion.
+        confidence: Confidence level of the intervals.
+        population: Optional size of the population each sample was drawn from
+            (without replacement), for the finite population correction.
+
+    Returns:
+        (lower, upper) bounds of the proportions, in [0, 1]; [0, 1] when there are no trials.
+    """
+    k = np.asarray(successes, dtype=np.float64)
+    n = np.asarray(trials, dtype=np.float64)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    if population is not None:
+        N = np.asarray(population, dtype=np.float64)
+        fpc = np.divide(N - n, N - 1, out=np.zeros_like(n * N), where=N > 1)
+        z = z * np.sqrt(np.clip(fpc, 0.0, 1.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = k / n
+        z2 = z * z
+        center = (p + z2 / (2 * n)) / (1 + z2 / n)
+        half = z / (1 + z2 / n) * np.sqrt(p * (1 - p) / n + z2 / (4 * n * n))
+    lower = np.where(n > 0, np.clip(center - half, 0.0, 1.0), 0.0)
+    upper = np.where(n > 0, np.clip(center + half, 0.0, 1.0), 1.0)
+    # The sample proportion is always inside its interval (half is 0 when z is)
+    return np.minimum(lower, np.nan_to_num(p)), np.maximum(upper, np.nan_to_num(p))
+
+
+def sample_cells(
+    obs: "pd.DataFrame",
+    sample_size: int,
+    strategy: str = "uniform",
+    stratify_column: Optional[str] = None,
+    min_per_stratum: int = DEFAULT_MIN_PER_STRATUM,
+    seed: int = 0,
+) -> CellSample:
+    """
+    Sample cells without replacement.
+
+    Stratified sampling allocates the sample to the labels of `stratify_column`
+    proportionally to their size, with at least `min_per_stratum` cells each
+    (or all of their cells), so small populations are represented. The minimum
+    is lowered (down to one cell) when there are too many labels for it.
+
+    Args:
+        obs: The obs columns of the dataset.
+        sample_size: Number of cells to sample (stratified samples may be somewhat larger).
+        strategy: "uniform" or "stratified".
+        stratify_column: Column whose labels are the strata (required for "stratified").
+        min_per_stratum: Minimum number of cells sampled per stratum.
+        seed: Seed of the random generator.
+
+    Returns:
+        The sampled cells and their weights.
+    """
+    from populate_schema import _column_codes
+
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unsupported sampling strategy: {strategy}")
+    rng = np.random.default_rng(seed)
+    n_total = len(obs)
+    sample_size = min(max(int(sample_size), 1), n_total)
+
+    if strategy == "uniform":
+        indices = np.sort(rng.choice(n_total, size=sample_size, replace=False))
+        return CellSample(indices, np.full(sample_size, n_total / sample_size), n_total, "uniform")
+
+    if stratify_column is None or stratify_column not in obs.columns:
+        raise ValueError(f"Stratified sampling needs an obs column to stratify by, got {stratify_column}")
+    codes, categories = _column_codes(obs[stratify_column])
+    # Missing values form their own stratum
+    codes = np.where(codes >= 0, codes, len(categories))
+    order = np.argsort(codes, kind="stable")
+    sizes = np.bincount(codes, minlength=len(categories) + 1)
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    # With many strata, the minimum shrinks so that the sample stays close to its requested size
+    floor = min(min_per_stratum, max(1, sample_size // max(1, np.count_nonzero(sizes))))
+    allocation = np.minimum(sizes, np.maximum(np.rint(sample_size * sizes / n_total), floor)).astype(np.int64)
+
+    indices, weights = [], []
+    for stratum in np.flatnonzero(allocation):
+        members = order[offsets[stratum]:offsets[stratum + 1]]
+        indices.append(rng.choice(members, size=allocation[stratum], replace=False))
+        weights.append(np.full(allocation[stratum], sizes[stratum] / allocation[stratum]))
+    indices, weights = np.concatenate(indices), np.concatenate(weights)
+    position = np.argsort(indices)
+    return CellSample(indices[position], weights[position], n_total, f"stratified:{stratify_column}")
+
+
+def estimate_counts(
+    kg: KnowledgeGraph,
+    obs: "pd.DataFrame",
+    sample: CellSample,
+    confidence: float = 0.95,
+    rare_threshold: int = DEFAULT_RARE_THRESHOLD,
+) -> None:
+    """
+    Scale the counts of a graph built from a cell sample up to the whole dataset, with confidence intervals.
+
+    Args:
+        kg: The graph built from the sampled cells (with the sample weights); its counts
+            are replaced in place.
+        obs: The obs columns of the dataset.
+        sample: The sample.
+        confidence: Confidence level of the intervals.
+        rare_threshold: Labels with fewer sampled cells are reported as rare.
+    """
+    from populate_schema import _column_codes
+
+    n_sample = len(sample.indices)
+    cell_sets = list(kg.iter_cell_set_records())
+    n = len(cell_sets)
+    sampled = np.fromiter((cs.cell_count for cs in cell_sets), dtype=np.int64, count=n)
+    estimates = np.zeros(n)
+    squared_weights = np.zeros(n)
+    stratified_by = sample.strategy.split(":", 1)[1] if ":" in sample.strategy else None
+
+    rare_labels: List[str] = []
+    index_by_column: Dict[str, Dict[str, int]] = {}
+    for i, cs in enumerate(cell_sets):
+        index_by_column.setdefault(cs.obs_column, {})[cs.obs_value] = i
+    exact = np.zeros(n, dtype=bool)
+    for col, indexes in index_by_column.items():
+        codes, categories = _column_codes(obs[col])
+        totals = np.bincount(codes[codes >= 0], minlength=len(categories))
+        codes = codes[sample.indices]
+        valid = codes >= 0
+        weights = sample.weights[valid]
+        weighted = np.bincount(codes[valid], weights=weights, minlength=len(categories))
+        weighted_squares = np.bincount(codes[valid], weights=weights * weights, minlength=len(categories))
+        for code, value in enumerate(categories):
+            if totals[code] == 0:
+                continue
+            i = indexes.get(str(value))
+            if i is None:
+                # A label of the dataset that no sampled cell carries
+                rare_labels.append(f"{col}={value}")
+                continue
+            estimates[i] = weighted[code]
+            squared_weights[i] = weighted_squares[code]
+            exact[i] = col == stratified_by
+            if sampled[i] < rare_threshold:
+                rare_labels.append(f"{col}={value}")
+
+    # Intervals of the estimated fraction of the dataset in each cell set, over the
+    # effective size of the whole sample
+    n_total = sample.n_total
+    n_effective = n_total ** 2 / np.sum(sample.weights ** 2)
+    lower, upper = wilson_interval(
+        estimates / n_total * n_effective, np.full(n, n_effective), confidence, np.full(n, n_total),
+    )
+    cell_count_lower = np.where(exact, estimates, np.maximum(np.floor(lower * n_total), sampled))
+    cell_count_upper = np.where(exact, estimates, np.ceil(upper * n_total))
+    cell_counts = np.rint(estimates)
+
+    # Association ratios are weighted ratios among the cell set's sampled cells
+    assoc = kg.association_arrays()
+    set_sizes = estimates[assoc.cell_set]
+    ratios = assoc.cell_ratio.astype(np.float64)
+    set_effective = np.divide(
+        estimates ** 2, squared_weights, out=np.zeros(n), where=squared_weights > 0,
+    )[assoc.cell_set]
+    ratio_lower, ratio_upper = wilson_interval(
+        ratios * set_effective, set_effective, confidence, np.maximum(set_sizes, set_effective),
+    )
+    association_counts = np.rint(ratios * set_sizes)
+    # Counts of exactly known cell sets vary with the ratio only; other counts are
+    # estimated fractions of the dataset, with intervals like the cell set counts
+    n_assoc = len(assoc.count)
+    lower, upper = wilson_interval(
+        association_counts / n_total * n_effective, np.full(n_assoc, n_effective), confidence, np.full(n_assoc, n_total),
+    )
+    set_exact = exact[assoc.cell_set]
+    count_lower = np.maximum(
+        np.where(set_exact, np.floor(ratio_lower * set_sizes), np.floor(lower * n_total)), assoc.count,
+    )
+    count_upper = np.where(set_exact, np.ceil(ratio_upper * set_sizes), np.ceil(upper * n_total))
+
+    kg.set_preview(
+        cell_counts.astype(np.int64),
+        association_counts.astype(np.int64),
+        PreviewEstimates(
+            sampled_cell_count=sampled,
+            cell_count_lower=np.minimum(np.rint(cell_count_lower), cell_counts).astype(np.int64),
+            cell_count_upper=np.maximum(np.rint(cell_count_upper), cell_counts).astype(np.int64),
+            count_lower=np.minimum(count_lower, association_counts).astype(np.int64),
+            count_upper=np.maximum(count_upper, association_counts).astype(np.int64),
+            cell_ratio_lower=np.minimum(ratio_lower, assoc.cell_ratio).astype(np.float32),
+            cell_ratio_upper=np.maximum(ratio_upper, assoc.cell_ratio).astype(np.float32),
+            sample_fraction=n_sample / n_total,
+            sample_strategy=sample.strategy,
+            confidence_level=confidence,
+            rare_labels=rare_labels,
+        ),
+    )
+    if rare_labels:
+        logger.warning(f"{len(rare_labels)} labels have fewer than {rare_threshold} sampled cells or were not sampled: "
+                       f"{', '.join(rare_labels[:10])}{' ...' if len(rare_labels) > 10 else ''}")
+
+
+def build_preview_graph(
+    adata: Any,
+    sample_size: int,
+    strategy: str = "uniform",
+    stratify_column: Optional[str] = None,
+    confidence: float = 0.95,
+    rare_threshold: int = DEFAULT_RARE_THRESHOLD,
+    seed: int = 0,
+    profiler: Optional[Profiler] = None,
+    **build_options: Any,
+) -> KnowledgeGraph:
+    """
+    Build an approximate knowledge graph from a sample of the cells.
+
+    Args:
+        adata: The AnnData object (only obs is used).
+        sample_size: Number of cells to sample.
+        strategy: "uniform" or "stratified".
+        stratify_column: Column whose labels are the strata (default: the first
+            cell type column present).
+        confidence: Confidence level of the count and ratio intervals.
+        rare_threshold: Labels with fewer sampled cells are reported as rare.
+        seed: Seed of the random generator.
+        profiler: Optional profiler recording the time spent.
+        **build_options: Options of `populate_schema.build_knowledge_graph`;
+            overlaps between cell sets are not computed in previews.
+
+    Returns:
+        The knowledge graph, with estimated counts and their intervals.
+    """
+    from populate_schema import build_knowledge_graph
+    from zarr_obs import ObsData
+
+    profiler = profiler or NULL_PROFILER
+    if build_options.pop("overlap_threshold", None) is not None:
+        logger.warning("Overlaps between cell sets are not computed in preview mode")
+    if strategy == "stratified" and stratify_column is None:
+        stratify_column = next(
+            (col for col in build_options.get("cell_type_columns", []) if col in adata.obs.columns), None,
+        )
+
+    with profiler.stage("preview_sample") as stage:
+        sample = sample_cells(adata.obs, sample_size, strategy, stratify_column, seed=seed)
+        sample_obs = adata.obs.iloc[sample.indices]
+        stage.add_items(len(sample.indices))
+    logger.info(f"Building a preview from {len(sample.indices)} of {sample.n_total} cells ({sample.strategy})")
+
+    kg = build_knowledge_graph(
+        adata=ObsData(sample_obs, adata.n_vars), profiler=profiler, cell_weights=sample.weights, **build_options,
+    )
+    with profiler.stage("preview_estimates") as stage:
+        estimate_counts(kg, adata.obs, sample, confidence, rare_threshold)
+        stage.add_items(kg.n_cell_sets + kg.n_associations)
+    kg.description = (
+        f"Single cell transcriptomics dataset with {sample.n_total} cells "
+        f"(preview from a sample of {len(sample.indices)} cells)"
+    )
+    return kg
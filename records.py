@@ -0,0 +1,727 @@
+"""
+Record classes of the single cell transcriptomics schema.
+
+Generated by generate_records.py from single_cell_schema.yaml; do not edit.
+
+Constructors check each slot against its range, bounds and cardinality and
+raise RecordError on invalid values, so records are valid by construction.
+"""
+
+import re
+from numbers import Integral, Real
+from typing import Any, Callable, Dict, List, Optional
+
+# Digest of the schema file the classes were generated from (see validate_data.schema_digest)
+SCHEMA_DIGEST = "5707cd33804daccb91b43620820e6a27"
+
+# CURIE (prefix:reference) or URI without whitespace
+_CURIE = re.compile(r"^[A-Za-z_][A-Za-z0-9_.+-]*:\S+$")
+
+
+class RecordError(ValueError):
+    """Raised when a slot value does not conform to the schema."""
+
+
+def _str(value: Any, where: str) -> Optional[str]:
+    if value is not None and not isinstance(value, str):
+        raise RecordError(f"{where}: expected a string, got {value!r}")
+    return value
+
+
+def _curie(value: Any, where: str) -> Optional[str]:
+    if value is not None and not (isinstance(value, str) and _CURIE.match(value)):
+        raise RecordError(f"{where}: expected a CURIE or URI, got {value!r}")
+    return value
+
+
+def _int(value: Any, where: str, minimum: Optional[float] = None, maximum: Optional[float] = None) -> Optional[int]:
+    if value is None:
+        return None
+    # Exact type checks first: isinstance against the numbers ABCs is slow
+    if type(value) is not int:
+        if not isinstance(value, Integral) or isinstance(value, bool):
+            raise RecordError(f"{where}: expected an integer, got {value!r}")
+        value = int(value)
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise RecordError(f"{where}: {value} is outside [{minimum}, {maximum}]")
+    return value
+
+
+def _float(value: Any, where: str, minimum: Optional[float] = None, maximum: Optional[float] = None) -> Optional[float]:
+    if value is None:
+        return None
+    if type(value) is not float:
+        if not isinstance(value, Real) or isinstance(value, bool):
+            raise RecordError(f"{where}: expected a number, got {value!r}")
+        value = float(value)
+    # Written so that NaN fails the bounds
+    if (minimum is not None and not value >= minimum) or (maximum is not None and not value <= maximum):
+        raise RecordError(f"{where}: {value} is outside [{minimum}, {maximum}]")
+    return value
+
+
+def _list(values: Any, check: Callable, where: str, *bounds: Optional[float]) -> Optional[List[Any]]:
+    if values is None:
+        return None
+    if not isinstance(values, list):
+        raise RecordError(f"{where}: expected a list, got {values!r}")
+    return [check(value, where, *bounds) for value in values]
+
+
+def _inlined(values: Any, cls: type, where: str) -> Optional[List[Any]]:
+    if values is None:
+        return None
+    if not isinstance(values, list):
+        raise RecordError(f"{where}: expected a list, got {values!r}")
+    return [value if isinstance(value, cls) else cls.from_dict(value, where) for value in values]
+
+
+class _Record:
+    __slots__ = ()
+    _identifier: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, data: Any, where: Optional[str] = None) -> Any:
+        """Build a record from a schema-shaped dictionary."""
+        where = where or cls.__name__
+        if not isinstance(data, dict):
+            raise RecordError(f"{where}: expected an object, got {data!r}")
+        unknown = [key for key in data if key not in cls.__slots__]
+        if unknown:
+            raise RecordError(f"{where}: unknown slots {unknown}")
+        if cls._identifier is not None and data.get(cls._identifier) is None:
+            raise RecordError(f"{where}: missing required slot {cls._identifier}")
+        return cls(**data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the record as a schema-shaped dictionary, without unset slots."""
+        raise NotImplementedError
+
+    def __eq__(self, other: Any) -> bool:
+        return type(self) is type(other) and all(getattr(self, s) == getattr(other, s) for s in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+class CellSet(_Record):
+    """A set of cells sharing a common annotation in a named obs column."""
+
+    __slots__ = ("id", "name", "description", "obs_column", "obs_value", "cell_count", "cell_count_lower", "cell_count_upper", "sampled_cell_count", "donor_count", "donor_ratio_min", "donor_ratio_median", "donor_ratio_max", "cells", "subset_of", "overlaps_with", "predominantly_consists_of", "predominant_cell_type_fraction", "has_tissue", "has_disease", "has_developmental_stage", "has_assay", "has_sex", "has_organism", "has_self_reported_ethnicity", "has_suspension_type")
+    _identifier = "id"
+
+    def __init__(
+        self,
+        id: str,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        obs_column: Optional[str] = None,
+        obs_value: Optional[str] = None,
+        cell_count: Optional[int] = None,
+        cell_count_lower: Optional[int] = None,
+        cell_count_upper: Optional[int] = None,
+        sampled_cell_count: Optional[int] = None,
+        donor_count: Optional[int] = None,
+        donor_ratio_min: Optional[float] = None,
+        donor_ratio_median: Optional[float] = None,
+        donor_ratio_max: Optional[float] = None,
+        cells: Optional[List["Cell"]] = None,
+        subset_of: Optional[List[str]] = None,
+        overlaps_with: Optional[List["CellSetOverlap"]] = None,
+        predominantly_consists_of: Optional[str] = None,
+        predominant_cell_type_fraction: Optional[float] = None,
+        has_tissue: Optional[List["MetadataAssociation"]] = None,
+        has_disease: Optional[List["MetadataAssociation"]] = None,
+        has_developmental_stage: Optional[List["MetadataAssociation"]] = None,
+        has_assay: Optional[List["MetadataAssociation"]] = None,
+        has_sex: Optional[List["MetadataAssociation"]] = None,
+        has_organism: Optional[List["MetadataAssociation"]] = None,
+        has_self_reported_ethnicity: Optional[List["MetadataAssociation"]] = None,
+        has_suspension_type: Optional[List["MetadataAssociation"]] = None,
+    ):
+        self.id = _curie(id, "CellSet.id")
+        self.name = _str(name, "CellSet.name")
+        self.description = _str(description, "CellSet.description")
+        self.obs_column = _str(obs_column, "CellSet.obs_column")
+        self.obs_value = _str(obs_value, "CellSet.obs_value")
+        self.cell_count = _int(cell_count, "CellSet.cell_count")
+        self.cell_count_lower = _int(cell_count_lower, "CellSet.cell_count_lower", 0, None)
+        self.cell_count_upper = _int(cell_count_upper, "CellSet.cell_count_upper", 0, None)
+        self.sampled_cell_count = _int(sampled_cell_count, "CellSet.sampled_cell_count", 0, None)
+        self.donor_count = _int(donor_count, "CellSet.donor_count", 0, None)
+        self.donor_ratio_min = _float(donor_ratio_min, "CellSet.donor_ratio_min", 0.0, 1.0)
+        self.donor_ratio_median = _float(donor_ratio_median, "CellSet.donor_ratio_median", 0.0, 1.0)
+        self.donor_ratio_max = _float(donor_ratio_max, "CellSet.donor_ratio_max", 0.0, 1.0)
+        self.cells = _inlined(cells, Cell, "CellSet.cells")
+        self.subset_of = _list(subset_of, _curie, "CellSet.subset_of")
+        self.overlaps_with = _inlined(overlaps_with, CellSetOverlap, "CellSet.overlaps_with")
+        self.predominantly_consists_of = _curie(predominantly_consists_of, "CellSet.predominantly_consists_of")
+        self.predominant_cell_type_fraction = _float(predominant_cell_type_fraction, "CellSet.predominant_cell_type_fraction", 0.0, 1.0)
+        self.has_tissue = _inlined(has_tissue, MetadataAssociation, "CellSet.has_tissue")
+        self.has_disease = _inlined(has_disease, MetadataAssociation, "CellSet.has_disease")
+        self.has_developmental_stage = _inlined(has_developmental_stage, MetadataAssociation, "CellSet.has_developmental_stage")
+        self.has_assay = _inlined(has_assay, MetadataAssociation, "CellSet.has_assay")
+        self.has_sex = _inlined(has_sex, MetadataAssociation, "CellSet.has_sex")
+        self.has_organism = _inlined(has_organism, MetadataAssociation, "CellSet.has_organism")
+        self.has_self_reported_ethnicity = _inlined(has_self_reported_ethnicity, MetadataAssociation, "CellSet.has_self_reported_ethnicity")
+        self.has_suspension_type = _inlined(has_suspension_type, MetadataAssociation, "CellSet.has_suspension_type")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        if self.id is not None:
+            data["id"] = self.id
+        if self.name is not None:
+            data["name"] = self.name
+        if self.description is not None:
+            data["description"] = self.description
+        if self.obs_column is not None:
+            data["obs_column"] = self.obs_column
+        if self.obs_value is not None:
+            data["obs_value"] = self.obs_value
+        if self.cell_count is not None:
+            data["cell_count"] = self.cell_count
+        if self.cell_count_lower is not None:
+            data["cell_count_lower"] = self.cell_count_lower
+        if self.cell_count_upper is not None:
+            data["cell_count_upper"] = self.cell_count_upper
+        if self.sampled_cell_count is not None:
+            data["sampled_cell_count"] = self.sampled_cell_count
+        if self.donor_count is not None:
+            data["donor_count"] = self.donor_count
+        if self.donor_ratio_min is not None:
+            data["donor_ratio_min"] = self.donor_ratio_min
+        if self.donor_ratio_median is not None:
+            data["donor_ratio_median"] = self.donor_ratio_median
+        if self.donor_ratio_max is not None:
+            data["donor_ratio_max"] = self.donor_ratio_max
+        if self.cells is not None:
+            data["cells"] = [v.to_dict() for v in self.cells]
+        if self.subset_of is not None:
+            data["subset_of"] = self.subset_of
+        if self.overlaps_with is not None:
+            data["overlaps_with"] = [v.to_dict() for v in self.overlaps_with]
+        if self.predominantly_consists_of is not None:
+            data["predominantly_consists_of"] = self.predominantly_consists_of
+        if self.predominant_cell_type_fraction is not None:
+            data["predominant_cell_type_fraction"] = self.predominant_cell_type_fraction
+        if self.has_tissue is not None:
+            data["has_tissue"] = [v.to_dict() for v in self.has_tissue]
+        if self.has_disease is not None:
+            data["has_disease"] = [v.to_dict() for v in self.has_disease]
+        if self.has_developmental_stage is not None:
+            data["has_developmental_stage"] = [v.to_dict() for v in self.has_developmental_stage]
+        if self.has_assay is not None:
+            data["has_assay"] = [v.to_dict() for v in self.has_assay]
+        if self.has_sex is not None:
+            data["has_sex"] = [v.to_dict() for v in self.has_sex]
+        if self.has_organism is not None:
+            data["has_organism"] = [v.to_dict() for v in self.has_organism]
+        if self.has_self_reported_ethnicity is not None:
+            data["has_self_reported_ethnicity"] = [v.to_dict() for v in self.has_self_reported_ethnicity]
+        if self.has_suspension_type is not None:
+            data["has_suspension_type"] = [v.to_dict() for v in self.has_suspension_type]
+        return data
+
+
+class CellType(_Record):
+    """A cell type from the Cell Ontology."""
+
+    __slots__ = ("id", "name", "description", "source_uri", "predominantly_in")
+    _identifier = "id"
+
+    def __init__(
+        self,
+        id: str,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        source_uri: Optional[str] = None,
+        predominantly_in: Optional[List[str]] = None,
+    ):
+        self.id = _curie(id, "CellType.id")
+        self.name = _str(name, "CellType.name")
+        self.description = _str(description, "CellType.description")
+        self.source_uri = _curie(source_uri, "CellType.source_uri")
+        self.predominantly_in = _list(predominantly_in, _curie, "CellType.predominantly_in")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        if self.id is not None:
+            data["id"] = self.id
+        if self.name is not None:
+            data["name"] = self.name
+        if self.description is not None:
+            data["description"] = self.description
+        if self.source_uri is not None:
+            data["source_uri"] = self.source_uri
+        if self.predominantly_in is not None:
+            data["predominantly_in"] = self.predominantly_in
+        return data
+
+
+class Tissue(_Record):
+    """A tissue from the Uberon Ontology."""
+
+    __slots__ = ("id", "name", "description", "source_uri", "present_in_cell_sets")
+    _identifier = "id"
+
+    def __init__(
+        self,
+        id: str,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        source_uri: Optional[str] = None,
+        present_in_cell_sets: Optional[List[str]] = None,
+    ):
+        self.id = _curie(id, "Tissue.id")
+        self.name = _str(name, "Tissue.name")
+        self.description = _str(description, "Tissue.description")
+        self.source_uri = _curie(source_uri, "Tissue.source_uri")
+        self.present_in_cell_sets = _list(present_in_cell_sets, _curie, "Tissue.present_in_cell_sets")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        if self.id is not None:
+            data["id"] = self.id
+        if self.name is not None:
+            data["name"] = self.name
+        if self.description is not None:
+            data["description"] = self.description
+        if self.source_uri is not None:
+            data["source_uri"] = self.source_uri
+        if self.present_in_cell_sets is not None:
+            data["present_in_cell_sets"] = self.present_in_cell_sets
+        return data
+
+
+class Disease(_Record):
+    """A disease from the Mondo Disease Ontology."""
+
+    __slots__ = ("id", "name", "description", "source_uri", "present_in_cell_sets")
+    _identifier = "id"
+
+    def __init__(
+        self,
+        id: str,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        source_uri: Optional[str] = None,
+        present_in_cell_sets: Optional[List[str]] = None,
+    ):
+        self.id = _curie(id, "Disease.id")
+        self.name = _str(name, "Disease.name")
+        self.description = _str(description, "Disease.description")
+        self.source_uri = _curie(source_uri, "Disease.source_uri")
+        self.present_in_cell_sets = _list(present_in_cell_sets, _curie, "Disease.present_in_cell_sets")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        if self.id is not None:
+            data["id"] = self.id
+        if self.name is not None:
+            data["name"] = self.name
+        if self.description is not None:
+            data["description"] = self.description
+        if self.source_uri is not None:
+            data["source_uri"] = self.source_uri
+        if self.present_in_cell_sets is not None:
+            data["present_in_cell_sets"] = self.present_in_cell_sets
+        return data
+
+
+class DevelopmentalStage(_Record):
+    """A developmental stage from the appropriate developmental stage ontology."""
+
+    __slots__ = ("id", "name", "description", "source_uri", "present_in_cell_sets")
+    _identifier = "id"
+
+    def __init__(
+        self,
+        id: str,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        source_uri: Optional[str] = None,
+        present_in_cell_sets: Optional[List[str]] = None,
+    ):
+        self.id = _curie(id, "DevelopmentalStage.id")
+        self.name = _str(name, "DevelopmentalStage.name")
+        self.description = _str(description, "DevelopmentalStage.description")
+        self.source_uri = _curie(source_uri, "DevelopmentalStage.source_uri")
+        self.present_in_cell_sets = _list(present_in_cell_sets, _curie, "DevelopmentalStage.present_in_cell_sets")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        if self.id is not None:
+            data["id"] = self.id
+        if self.name is not None:
+            data["name"] = self.name
+        if self.description is not None:
+            data["description"] = self.description
+        if self.source_uri is not None:
+            data["source_uri"] = self.source_uri
+        if self.present_in_cell_sets is not None:
+            data["present_in_cell_sets"] = self.present_in_cell_sets
+        return data
+
+
+class Assay(_Record):
+    """An assay from the Experimental Factor Ontology."""
+
+    __slots__ = ("id", "name", "description", "source_uri", "present_in_cell_sets")
+    _identifier = "id"
+
+    def __init__(
+        self,
+        id: str,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        source_uri: Optional[str] = None,
+        present_in_cell_sets: Optional[List[str]] = None,
+    ):
+        self.id = _curie(id, "Assay.id")
+        self.name = _str(name, "Assay.name")
+        self.description = _str(description, "Assay.description")
+        self.source_uri = _curie(source_uri, "Assay.source_uri")
+        self.present_in_cell_sets = _list(present_in_cell_sets, _curie, "Assay.present_in_cell_sets")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        if self.id is not None:
+            data["id"] = self.id
+        if self.name is not None:
+            data["name"] = self.name
+        if self.description is not None:
+            data["description"] = self.description
+        if self.source_uri is not None:
+            data["source_uri"] = self.source_uri
+        if self.present_in_cell_sets is not None:
+            data["present_in_cell_sets"] = self.present_in_cell_sets
+        return data
+
+
+class Sex(_Record):
+    """A biological sex from the Phenotype And Trait Ontology."""
+
+    __slots__ = ("id", "name", "description", "source_uri", "present_in_cell_sets")
+    _identifier = "id"
+
+    def __init__(
+        self,
+        id: str,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        source_uri: Optional[str] = None,
+        present_in_cell_sets: Optional[List[str]] = None,
+    ):
+        self.id = _curie(id, "Sex.id")
+        self.name = _str(name, "Sex.name")
+        self.description = _str(description, "Sex.description")
+        self.source_uri = _curie(source_uri, "Sex.source_uri")
+        self.present_in_cell_sets = _list(present_in_cell_sets, _curie, "Sex.present_in_cell_sets")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        if self.id is not None:
+            data["id"] = self.id
+        if self.name is not None:
+            data["name"] = self.name
+        if self.description is not None:
+            data["description"] = self.description
+        if self.source_uri is not None:
+            data["source_uri"] = self.source_uri
+        if self.present_in_cell_sets is not None:
+            data["present_in_cell_sets"] = self.present_in_cell_sets
+        return data
+
+
+class Organism(_Record):
+    """An organism from the NCBI Taxonomy."""
+
+    __slots__ = ("id", "name", "description", "source_uri", "present_in_cell_sets")
+    _identifier = "id"
+
+    def __init__(
+        self,
+        id: str,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        source_uri: Optional[str] = None,
+        present_in_cell_sets: Optional[List[str]] = None,
+    ):
+        self.id = _curie(id, "Organism.id")
+        self.name = _str(name, "Organism.name")
+        self.description = _str(description, "Organism.description")
+        self.source_uri = _curie(source_uri, "Organism.source_uri")
+        self.present_in_cell_sets = _list(present_in_cell_sets, _curie, "Organism.present_in_cell_sets")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        if self.id is not None:
+            data["id"] = self.id
+        if self.name is not None:
+            data["name"] = self.name
+        if self.description is not None:
+            data["description"] = self.description
+        if self.source_uri is not None:
+            data["source_uri"] = self.source_uri
+        if self.present_in_cell_sets is not None:
+            data["present_in_cell_sets"] = self.present_in_cell_sets
+        return data
+
+
+class SelfReportedEthnicity(_Record):
+    """A self-reported ethnicity from the Human Ancestry Ontology."""
+
+    __slots__ = ("id", "name", "description", "source_uri", "present_in_cell_sets")
+    _identifier = "id"
+
+    def __init__(
+        self,
+        id: str,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        source_uri: Optional[str] = None,
+        present_in_cell_sets: Optional[List[str]] = None,
+    ):
+        self.id = _curie(id, "SelfReportedEthnicity.id")
+        self.name = _str(name, "SelfReportedEthnicity.name")
+        self.description = _str(description, "SelfReportedEthnicity.description")
+        self.source_uri = _curie(source_uri, "SelfReportedEthnicity.source_uri")
+        self.present_in_cell_sets = _list(present_in_cell_sets, _curie, "SelfReportedEthnicity.present_in_cell_sets")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        if self.id is not None:
+            data["id"] = self.id
+        if self.name is not None:
+            data["name"] = self.name
+        if self.description is not None:
+            data["description"] = self.description
+        if self.source_uri is not None:
+            data["source_uri"] = self.source_uri
+        if self.present_in_cell_sets is not None:
+            data["present_in_cell_sets"] = self.present_in_cell_sets
+        return data
+
+
+class SuspensionType(_Record):
+    """The type of suspension the cells were profiled in (cell or nucleus)."""
+
+    __slots__ = ("id", "name", "description", "source_uri", "present_in_cell_sets")
+    _identifier = "id"
+
+    def __init__(
+        self,
+        id: str,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        source_uri: Optional[str] = None,
+        present_in_cell_sets: Optional[List[str]] = None,
+    ):
+        self.id = _curie(id, "SuspensionType.id")
+        self.name = _str(name, "SuspensionType.name")
+        self.description = _str(description, "SuspensionType.description")
+        self.source_uri = _curie(source_uri, "SuspensionType.source_uri")
+        self.present_in_cell_sets = _list(present_in_cell_sets, _curie, "SuspensionType.present_in_cell_sets")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        if self.id is not None:
+            data["id"] = self.id
+        if self.name is not None:
+            data["name"] = self.name
+        if self.description is not None:
+            data["description"] = self.description
+        if self.source_uri is not None:
+            data["source_uri"] = self.source_uri
+        if self.present_in_cell_sets is not None:
+            data["present_in_cell_sets"] = self.present_in_cell_sets
+        return data
+
+
+class Cell(_Record):
+    """An individual cell in the dataset."""
+
+    __slots__ = ("id", "belongs_to_cell_sets")
+    _identifier = "id"
+
+    def __init__(
+        self,
+        id: str,
+        belongs_to_cell_sets: Optional[List[str]] = None,
+    ):
+        self.id = _curie(id, "Cell.id")
+        self.belongs_to_cell_sets = _list(belongs_to_cell_sets, _curie, "Cell.belongs_to_cell_sets")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        if self.id is not None:
+            data["id"] = self.id
+        if self.belongs_to_cell_sets is not None:
+            data["belongs_to_cell_sets"] = self.belongs_to_cell_sets
+        return data
+
+
+class Dataset(_Record):
+    """A single cell transcriptomics dataset."""
+
+    __slots__ = ("id", "name", "description", "cell_sets", "cells", "ontology_terms", "sample_fraction", "sample_strategy", "confidence_level", "rare_labels", "donor_column")
+    _identifier = "id"
+
+    def __init__(
+        self,
+        id: str,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        cell_sets: Optional[List[str]] = None,
+        cells: Optional[List["Cell"]] = None,
+        ontology_terms: Optional[List[str]] = None,
+        sample_fraction: Optional[float] = None,
+        sample_strategy: Optional[str] = None,
+        confidence_level: Optional[float] = None,
+        rare_labels: Optional[List[str]] = None,
+        donor_column: Optional[str] = None,
+    ):
+        self.id = _curie(id, "Dataset.id")
+        self.name = _str(name, "Dataset.name")
+        self.description = _str(description, "Dataset.description")
+        self.cell_sets = _list(cell_sets, _curie, "Dataset.cell_sets")
+        self.cells = _inlined(cells, Cell, "Dataset.cells")
+        self.ontology_terms = _list(ontology_terms, _curie, "Dataset.ontology_terms")
+        self.sample_fraction = _float(sample_fraction, "Dataset.sample_fraction", 0.0, 1.0)
+        self.sample_strategy = _str(sample_strategy, "Dataset.sample_strategy")
+        self.confidence_level = _float(confidence_level, "Dataset.confidence_level", 0.0, 1.0)
+        self.rare_labels = _list(rare_labels, _str, "Dataset.rare_labels")
+        self.donor_column = _str(donor_column, "Dataset.donor_column")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        if self.id is not None:
+            data["id"] = self.id
+        if self.name is not None:
+            data["name"] = self.name
+        if self.description is not None:
+            data["description"] = self.description
+        if self.cell_sets is not None:
+            data["cell_sets"] = self.cell_sets
+        if self.cells is not None:
+            data["cells"] = [v.to_dict() for v in self.cells]
+        if self.ontology_terms is not None:
+            data["ontology_terms"] = self.ontology_terms
+        if self.sample_fraction is not None:
+            data["sample_fraction"] = self.sample_fraction
+        if self.sample_strategy is not None:
+            data["sample_strategy"] = self.sample_strategy
+        if self.confidence_level is not None:
+            data["confidence_level"] = self.confidence_level
+        if self.rare_labels is not None:
+            data["rare_labels"] = self.rare_labels
+        if self.donor_column is not None:
+            data["donor_column"] = self.donor_column
+        return data
+
+
+class CellSetOverlap(_Record):
+    """An overlap between a cell set and another cell set, with the number of shared cells and similarity measures."""
+
+    __slots__ = ("cell_set", "intersection_count", "jaccard", "overlap_coefficient")
+
+    def __init__(
+        self,
+        cell_set: Optional[str] = None,
+        intersection_count: Optional[int] = None,
+        jaccard: Optional[float] = None,
+        overlap_coefficient: Optional[float] = None,
+    ):
+        self.cell_set = _curie(cell_set, "CellSetOverlap.cell_set")
+        self.intersection_count = _int(intersection_count, "CellSetOverlap.intersection_count")
+        self.jaccard = _float(jaccard, "CellSetOverlap.jaccard", 0.0, 1.0)
+        self.overlap_coefficient = _float(overlap_coefficient, "CellSetOverlap.overlap_coefficient", 0.0, 1.0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        if self.cell_set is not None:
+            data["cell_set"] = self.cell_set
+        if self.intersection_count is not None:
+            data["intersection_count"] = self.intersection_count
+        if self.jaccard is not None:
+            data["jaccard"] = self.jaccard
+        if self.overlap_coefficient is not None:
+            data["overlap_coefficient"] = self.overlap_coefficient
+        return data
+
+
+class MetadataAssociation(_Record):
+    """An association between a cell set and metadata with a cell count and ratio."""
+
+    __slots__ = ("term", "count", "cell_ratio", "count_lower", "count_upper", "cell_ratio_lower", "cell_ratio_upper", "donor_count", "donor_ratio_min", "donor_ratio_median", "donor_ratio_max")
+
+    def __init__(
+        self,
+        term: Optional[str] = None,
+        count: Optional[int] = None,
+        cell_ratio: Optional[float] = None,
+        count_lower: Optional[int] = None,
+        count_upper: Optional[int] = None,
+        cell_ratio_lower: Optional[float] = None,
+        cell_ratio_upper: Optional[float] = None,
+        donor_count: Optional[int] = None,
+        donor_ratio_min: Optional[float] = None,
+        donor_ratio_median: Optional[float] = None,
+        donor_ratio_max: Optional[float] = None,
+    ):
+        self.term = _curie(term, "MetadataAssociation.term")
+        self.count = _int(count, "MetadataAssociation.count")
+        self.cell_ratio = _float(cell_ratio, "MetadataAssociation.cell_ratio", 0.0, 1.0)
+        self.count_lower = _int(count_lower, "MetadataAssociation.count_lower", 0, None)
+        self.count_upper = _int(count_upper, "MetadataAssociation.count_upper", 0, None)
+        self.cell_ratio_lower = _float(cell_ratio_lower, "MetadataAssociation.cell_ratio_lower", 0.0, 1.0)
+        self.cell_ratio_upper = _float(cell_ratio_upper, "MetadataAssociation.cell_ratio_upper", 0.0, 1.0)
+        self.donor_count = _int(donor_count, "MetadataAssociation.donor_count", 0, None)
+        self.donor_ratio_min = _float(donor_ratio_min, "MetadataAssociation.donor_ratio_min", 0.0, 1.0)
+        self.donor_ratio_median = _float(donor_ratio_median, "MetadataAssociation.donor_ratio_median", 0.0, 1.0)
+        self.donor_ratio_max = _float(donor_ratio_max, "MetadataAssociation.donor_ratio_max", 0.0, 1.0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {}
+        if self.term is not None:
+            data["term"] = self.term
+        if self.count is not None:
+            data["count"] = self.count
+        if self.cell_ratio is not None:
+            data["cell_ratio"] = self.cell_ratio
+        if self.count_lower is not None:
+            data["count_lower"] = self.count_lower
+        if self.count_upper is not None:
+            data["count_upper"] = self.count_upper
+        if self.cell_ratio_lower is not None:
+            data["cell_ratio_lower"] = self.cell_ratio_lower
+        if self.cell_ratio_upper is not None:
+            data["cell_ratio_upper"] = self.cell_ratio_upper
+        if self.donor_count is not None:
+            data["donor_count"] = self.donor_count
+        if self.donor_ratio_min is not None:
+            data["donor_ratio_min"] = self.donor_ratio_min
+        if self.donor_ratio_median is not None:
+            data["donor_ratio_median"] = self.donor_ratio_median
+        if self.donor_ratio_max is not None:
+            data["donor_ratio_max"] = self.donor_ratio_max
+        return data
+
+
+# Record class of each schema class
+RECORD_CLASSES = {
+    "CellSet": CellSet,
+    "CellType": CellType,
+    "Tissue": Tissue,
+    "Disease": Disease,
+    "DevelopmentalStage": DevelopmentalStage,
+    "Assay": Assay,
+    "Sex": Sex,
+    "Organism": Organism,
+    "SelfReportedEthnicity": SelfReportedEthnicity,
+    "SuspensionType": SuspensionType,
+    "Cell": Cell,
+    "Dataset": Dataset,
+    "CellSetOverlap": CellSetOverlap,
+    "MetadataAssociation": MetadataAssociation,
+}
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+Render knowledge graph images for many datasets on a process pool.
+
+Each input (JSON or YAML file, or graph store, where every dataset is
+rendered) becomes one image in the output directory. Workers draw with the
+non-interactive Agg canvas and free each figure once saved, so memory stays
+flat over hundreds of renders.
+"""
+
+import argparse
+import logging
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, NamedTuple, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DESCRIPTION = "Render knowledge graph images for many datasets in parallel"
+
+
+class RenderJob(NamedTuple):
+    """One image to render."""
+
+    data_file: str
+    dataset_id: Optional[str]  # For graph stores, the dataset to render
+    output_file: str
+    include_metadata: bool
+    max_nodes: Optional[int]
+    dpi: int
+
+
+def plan_jobs(
+    data_files: List[str],
+    output_dir: str,
+    image_format: str = "png",
+    include_metadata: bool = True,
+    max_nodes: Optional[int] = None,
+    dpi: int = 300,
+) -> List[RenderJob]:
+    """
+    List the images to render for some inputs.
+
+    Args:
+        data_files: JSON or YAML files and/or graph stores.
+        output_dir: Directory of the images, named after the inputs (and datasets for stores).
+        image_format: Image file extension, e.g. "png" or "svg".
+        include_metadata: Whether to include metadata nodes.
+        max_nodes: Maximum number of nodes per image.
+        dpi: Resolution of the images.
+
+    Returns:
+        One job per image.
+        
+    Raises:
+        ValueError: If several inputs would be rendered to the same image (inputs
+            sharing a file name in different directories, or given twice).
+    """
+    from graph_store import GraphStore, is_store_file
+
+    jobs = []
+    for data_file in data_files:
+        stem = os.path.splitext(os.path.basename(data_file))[0]
+        if is_store_file(data_file):
+            with GraphStore(data_file) as store:
+                dataset_ids = store.dataset_ids()
+            for dataset_id in dataset_ids:
+                name = f"{stem}_{re.sub(r'[^A-Za-z0-9_.-]', '_', dataset_id)}"
+                jobs.append(RenderJob(
+                    data_file, dataset_id, os.path.join(output_dir, f"{name}.{image_format}"),
+                    include_metadata, max_nodes, dpi,
+                ))
+        else:
+            jobs.append(RenderJob(
+                data_file, None, os.path.join(output_dir, f"{stem}.{image_format}"), include_metadata, max_nodes, dpi,
+            ))
+
+    # Workers writing the same image would race and silently lose all but one render
+    inputs_by_output = defaultdict(list)
+    for job in jobs:
+        inputs_by_output[job.output_file].append(job.data_file)
+    collisions = [f"{output} ({', '.join(inputs)})" for output, inputs in inputs_by_output.items() if len(inputs) > 1]
+    if collisions:
+        raise ValueError(f"Several inputs would be rendered to the same image: {'; '.join(collisions)}")
+    return jobs
+
+
+def render(job: RenderJob) -> Tuple[str, int, float]:
+    """
+    Render one image (in a worker process).
+
+    Returns:
+        Tuple of (output file, number of nodes, seconds).
+    """
+    from visualize_graph import build_graph, load_data, visualize_graph
+
+    started = time.perf_counter()
+    data = load_data(job.data_file, job.dataset_id, max_cell_sets=job.max_nodes)
+    G = build_graph(data, include_metadata=job.include_metadata, max_nodes=job.max_nodes)
+    title = data.get("dataset", {}).get("name") or os.path.basename(job.data_file)
+    visualize_graph(G, job.output_file, title=title, dpi=job.dpi)
+    return job.output_file, G.number_of_nodes(), time.perf_counter() - started
+
+
+def render_batch(jobs: List[RenderJob], workers: int = 1) -> List[str]:
+    """
+    Render images on a pool of worker processes.
+
+    Args:
+        jobs: The images to render.
+        workers: Number of worker processes; 1 renders in this process.
+
+    Returns:
+        The output files of the jobs that failed.
+    """
+    failed = []
+    if workers <= 1:
+        for job in jobs:
+            try:
+                output_file, n_nodes, seconds = render(job)
+                logger.info(f"Rendered {output_file} ({n_nodes} nodes) in {seconds:.2f}s")
+            except Exception as e:
+                logger.error(f"Failed to render {job.output_file}: {e}")
+                failed.append(job.output_file)
+        return failed
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render, job): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                output_file, n_nodes, seconds = future.result()
+                logger.info(f"Rendered {output_file} ({n_nodes} nodes) in {seconds:.2f}s")
+            except Exception as e:
+                logger.error(f"Failed to render {job.output_file}: {e}")
+                failed.append(job.output_file)
+    return failed
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line options of this script to a parser."""
+    parser.add_argument("data_files", nargs="+",
+                        help="Data files (JSON or YAML) and/or graph stores (.sqlite/.db; every dataset is rendered)")
+    parser.add_argument("--output-dir", "-o", default="knowledge_graphs",
+                        help="Directory of the images (default: knowledge_graphs)")
+    parser.add_argument("--format", "-f", default="png", help="Image format, e.g. png or svg (default: png)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--no-metadata", action="store_true",
+                        help="Do not include metadata nodes (tissues, diseases, etc.)")
+    parser.add_argument("--max-nodes", type=int, default=None,
+                        help="Maximum number of nodes to include in each graph")
+    parser.add_argument("--dpi", type=int, default=300, help="Resolution of the images (default: 300)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Enable verbose output")
+
+
+def run(args: argparse.Namespace) -> None:
+    """Run the script with parsed command line options."""
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+
+    missing = [path for path in args.data_files if not os.path.exists(path)]
+    if missing:
+        logger.error(f"Data files not found: {', '.join(missing)}")
+        sys.exit(1)
+
+    try:
+        jobs = plan_jobs(
+            args.data_files, args.output_dir, args.format,
+            include_metadata=not args.no_metadata, max_nodes=args.max_nodes, dpi=args.dpi,
+        )
+    except ValueError as e:
+        logger.error(f"{e}; render them in separate runs or rename them")
+        sys.exit(1)
+    os.makedirs(args.output_dir, exist_ok=True)
+    started = time.perf_counter()
+    failed = render_batch(jobs, workers=min(args.workers, len(jobs)))
+    elapsed = time.perf_counter() - started
+
+    if failed:
+        logger.error(f"{len(failed)} of {len(jobs)} renders failed")
+        sys.exit(1)
+    print(f"✅ Rendered {len(jobs)} images to {args.output_dir} in {elapsed:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
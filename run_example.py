@@ -7,11 +7,10 @@ End-to-end example demonstrating the full workflow:
 """
 
 import os
-import json
 import logging
 
 from generate_sample_data import generate_sample_data
-from populate_schema import load_anndata, get_cell_sets_from_anndata, create_dataset, save_objects
+from pipeline import PipelineJob, run_pipeline
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -44,81 +43,48 @@ def run_example():
     print("\n2. Populating the LinkML schema")
     print("-"*50)
     
-    # Load the AnnData object
-    adata = load_anndata(SAMPLE_DATA_FILE)
-    
-    # Extract cell sets and relationships
-    cell_sets, cell_types, tissues, diseases, dev_stages, assays = get_cell_sets_from_anndata(
-        adata=adata,
-        cell_type_columns=["cell_type_l1", "cell_type"],
-        tissue_column="tissue",
-        disease_column="disease",
-        dev_stage_column="development_stage",
-        assay_column="assay",
-    )
-    
-    # Create dataset object
-    dataset = create_dataset(
-        adata=adata,
-        cell_sets=cell_sets,
-        cell_types=cell_types,
-        tissues=tissues,
-        diseases=diseases,
-        dev_stages=dev_stages,
-        assays=assays,
-        dataset_name="Sample Dataset",
-    )
-    
-    # Save all objects
-    save_objects(
-        output_file=OUTPUT_JSON_FILE,
-        dataset=dataset,
-        cell_sets=cell_sets,
-        cell_types=cell_types,
-        tissues=tissues,
-        diseases=diseases,
-        dev_stages=dev_stages,
-        assays=assays,
+    # Load, extract cell sets and relationships, and save all objects
+    [result] = run_pipeline(
+        [PipelineJob(SAMPLE_DATA_FILE, OUTPUT_JSON_FILE, "Sample Dataset")],
+        extract_options=dict(
+            cell_type_columns=["cell_type_l1", "cell_type"],
+            tissue_column="tissue",
+            disease_column="disease",
+            dev_stage_column="development_stage",
+            assay_column="assay",
+        ),
         format="json",
+        keep_graphs=True,
     )
+    if result.error is not None:
+        raise result.error
+    kg = result.graph
     
-    # Step 3: Display schema statistics
+    # Step 3: Display schema statistics (counted from the graph in memory, not the saved file)
     print("\n3. Knowledge Graph Statistics")
     print("-"*50)
     
-    # Load the generated JSON file
-    with open(OUTPUT_JSON_FILE, 'r') as f:
-        data = json.load(f)
-    
-    # Print statistics
-    print(f"Dataset name: {data['dataset']['name']}")
-    print(f"Cell sets: {len(data['cell_sets'])}")
-    print(f"Cell types: {len(data['cell_types'])}")
-    print(f"Tissues: {len(data['tissues'])}")
-    print(f"Diseases: {len(data['diseases'])}")
-    print(f"Developmental stages: {len(data['developmental_stages'])}")
-    print(f"Assays: {len(data['assays'])}")
-    
-    # Count relationships
-    subset_rels = sum(1 for cs in data['cell_sets'] if 'subset_of' in cs)
-    cell_type_rels = sum(1 for cs in data['cell_sets'] if 'predominantly_consists_of' in cs)
-    tissue_rels = sum(len(cs.get('has_tissue', [])) for cs in data['cell_sets'])
-    disease_rels = sum(len(cs.get('has_disease', [])) for cs in data['cell_sets'])
-    dev_stage_rels = sum(len(cs.get('has_developmental_stage', [])) for cs in data['cell_sets'])
-    assay_rels = sum(len(cs.get('has_assay', [])) for cs in data['cell_sets'])
+    stats = result.statistics
+    print(f"Dataset name: {kg.name}")
+    print(f"Cell sets: {stats['cell_sets']}")
+    print(f"Cell types: {stats['cell_types']}")
+    print(f"Tissues: {stats['tissues']}")
+    print(f"Diseases: {stats['diseases']}")
+    print(f"Developmental stages: {stats['developmental_stages']}")
+    print(f"Assays: {stats['assays']}")
     
     print("\nRelationships:")
-    print(f"subset_of relationships: {subset_rels}")
-    print(f"predominantly_consists_of relationships: {cell_type_rels}")
-    print(f"Tissue associations: {tissue_rels}")
-    print(f"Disease associations: {disease_rels}")
-    print(f"Developmental stage associations: {dev_stage_rels}")
-    print(f"Assay associations: {assay_rels}")
+    print(f"subset_of relationships: {stats['subset_of']}")
+    print(f"predominantly_consists_of relationships: {stats['predominantly_consists_of']}")
+    print(f"Tissue associations: {stats['has_tissue']}")
+    print(f"Disease associations: {stats['has_disease']}")
+    print(f"Developmental stage associations: {stats['has_developmental_stage']}")
+    print(f"Assay associations: {stats['has_assay']}")
     
     # Sample cell set
-    if data['cell_sets']:
+    if stats['cell_sets']:
         print("\nSample cell set:")
-        cs = data['cell_sets'][0]
+        cs = next(kg.iter_cell_sets())
         print(f"  ID: {cs['id']}")
         print(f"  Name: {cs['name']}")
         print(f"  Cell count: {cs['cell_count']}")
@@ -4,20 +4,22 @@ Validate that a generated dataset conforms to the LinkML schema.
 """
 
 import argparse
+import hashlib
+import itertools
 import json
 import logging
 import os
+import sqlite3
 import sys
+import time
 import yaml
-from typing import Dict, Any, List, Optional, Union
-
-from linkml_runtime.loaders import json_loader, yaml_loader
-from linkml_runtime.validators.jsonschemavalidator import JsonSchemaValidator
-from linkml_runtime.utils.schemaview import SchemaView
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple, Union
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+DESCRIPTION = "Validate data against the LinkML schema"
+
 
 def load_data(file_path: str) -> Dict[str, Any]:
     """
@@ -47,81 +49,424 @@ def load_data(file_path: str) -> Dict[str, Any]:
         raise
 
 
-def validate_dataset(data: Dict[str, Any], schema_file: str) -> List[str]:
+# The schema shipped alongside these scripts, the default wherever a schema is read
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "single_cell_schema.yaml")
+
+def collection_classes(term_classes: Dict[str, Tuple[str, str]]) -> Dict[str, str]:
+    """
+    Map the collections of a serialized graph to their schema classes.
+
+    Args:
+        term_classes: The graph's term classes, with their collection key and reverse
+            slot (`KnowledgeGraph.term_classes` or `GraphStore.term_classes()`).
+
+    Returns:
+        The schema class of each collection key, cell sets included.
+    """
+    classes = {"cell_sets": "CellSet"}
+    classes.update((collection, term_class) for term_class, (collection, _) in term_classes.items())
+    return classes
+
+
+def file_collection_classes(metadata_config: Optional[str] = None) -> Dict[str, str]:
+    """
+    Map the collections of a JSON or YAML file to their schema classes.
+
+    Files do not record their term classes, so they are those of a graph populated
+    with the given metadata column mapping.
+
+    Args:
+        metadata_config: YAML metadata column mapping the file was populated with
+            (default: the default mapping).
+
+    Returns:
+        The schema class of each collection key, cell sets included.
+    """
+    from knowledge_graph import TERM_CLASSES
+    from metadata_config import default_metadata_columns, load_metadata_config
+
+    columns = load_metadata_config(metadata_config) if metadata_config is not None else default_metadata_columns()
+    term_classes = dict(TERM_CLASSES)
+    term_classes.update((spec.term_class, (spec.collection, "present_in_cell_sets")) for spec in columns)
+    return collection_classes(term_classes)
+
+# Default maximum number of entries of the validation result cache
+DEFAULT_CACHE_SIZE = 1_000_000
+
+# Validators by (schema path, schema modification time), kept for the life of the process
+_validators: Dict[Tuple[str, int], Any] = {}
+
+
+def get_validator(schema_file: str) -> Any:
+    """
+    Get the JSON Schema validator for a LinkML schema.
+    
+    The schema view and compiled validator are cached per process, keyed by the
+    schema path and modification time, so long-lived processes build them once.
+    
+    Args:
+        schema_file: Path to the LinkML schema file.
+        
+    Returns:
+        A JsonSchemaValidator for the schema.
+    """
+    key = (os.path.abspath(schema_file), os.stat(schema_file).st_mtime_ns)
+    if key not in _validators:
+        from linkml_runtime.utils.schemaview import SchemaView
+        from linkml_runtime.validators.jsonschemavalidator import JsonSchemaValidator
+        
+        logger.info(f"Compiling validator for schema: {schema_file}")
+        _validators[key] = JsonSchemaValidator(SchemaView(schema_file))
+    return _validators[key]
+
+
+class _RecordValidator:
+    """Checks objects by building the record classes generated from the schema (see generate_records.py)."""
+    
+    def validate(self, obj: Dict[str, Any], class_name: str) -> List[str]:
+        import records
+        
+        if class_name not in records.RECORD_CLASSES:
+            return [f"{class_name} is not a class of the schema"]
+        try:
+            records.RECORD_CLASSES[class_name].from_dict(obj)
+        except records.RecordError as e:
+            return [str(e)]
+        return []
+
+
+def _file_digest(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+def schema_digest(schema_file: str) -> str:
+    """Get the digest of a schema file, as recorded in the record classes generated from it."""
+    return _file_digest(schema_file)
+
+
+def _get_validator(schema_file: str, typed: bool) -> Tuple[Any, str]:
+    """Get the validator to use and a fingerprint of what it checks (for the result cache)."""
+    if typed:
+        import records
+        
+        if schema_digest(schema_file) != records.SCHEMA_DIGEST:
+            raise ValueError(
+                f"The record classes (records.py) were not generated from {schema_file}; regenerate them with "
+                f"generate_records.py --schema {schema_file} or validate without --typed"
+            )
+        logger.info("Validating with the generated record classes")
+        return _RecordValidator(), f"records:{_file_digest(records.__file__)}"
+    return get_validator(schema_file), f"linkml:{_file_digest(schema_file)}"
+
+
+class ValidationCache:
+    """
+    Persistent cache of validation results, keyed by a fingerprint of the schema,
+    the class name and a hash of the canonical JSON form of each object.
+    
+    Objects already validated against the same schema are not validated again;
+    their stored errors (none for valid objects) are returned instead. The
+    cache holds at most `max_entries` results; the least recently used ones
+    are evicted as soon as a batch of new results exceeds the bound.
+    
+    Args:
+        cache_file: Path to the SQLite cache database.
+        max_entries: Maximum number of cached results.
+    """
+    
+    def __init__(self, cache_file: str, max_entries: int = DEFAULT_CACHE_SIZE):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        # Recency stamp of the results used in the current batch
+        self._stamp = time.time_ns()
+        self._db = sqlite3.connect(cache_file, timeout=30)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key BLOB PRIMARY KEY, errors TEXT NOT NULL, last_used INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self._db.commit()
+        self._n_entries = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+    
+    def __enter__(self) -> "ValidationCache":
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+    
+    def close(self) -> None:
+        """Evict the results other processes added beyond the size bound and close the database."""
+        if self._db is None:
+            return
+        with self._db:
+            self._n_entries = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            self._evict()
+        if self.evicted:
+            logger.info(f"Evicted {self.evicted} validation results from {self.cache_file}")
+        self._db.close()
+        self._db = None
+    
+    def _evict(self) -> None:
+        """Delete the least recently used results beyond the size bound, in the current transaction."""
+        excess = self._n_entries - self.max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used LIMIT ?)", (excess,),
+            )
+            self._n_entries -= excess
+            self.evicted += excess
+    
+    @staticmethod
+    def _key(fingerprint: str, class_name: str, obj: Dict[str, Any]) -> bytes:
+        canonical = json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+        return hashlib.blake2b(f"{fingerprint}|{class_name}|{canonical}".encode(), digest_size=16).digest()
+    
+    def validate(self, validator: Any, fingerprint: str, items: List[Tuple[str, Dict[str, Any]]]) -> List[List[str]]:
+        """
+        Validate a batch of objects, validating only those without a cached result.
+        
+        Args:
+            validator: Validator with a `validate(obj, class_name)` method.
+            fingerprint: Fingerprint of the schema the validator checks.
+            items: (class name, object) pairs.
+            
+        Returns:
+            The error messages of each object.
+        """
+        self._stamp = max(time.time_ns(), self._stamp + 1)
+        keys = [self._key(fingerprint, class_name, obj) for class_name, obj in items]
+        cached: Dict[bytes, List[str]] = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self._db.execute(f"SELECT key, errors FROM results WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+            cached.update((key, json.loads(errors)) for key, errors in rows)
+        
+        results, misses = [], {}
+        for key, (class_name, obj) in zip(keys, items):
+            if key not in cached and key not in misses:
+                misses[key] = [str(e) for e in validator.validate(obj, class_name)]
+            results.append(cached[key] if key in cached else misses[key])
+        self.hits += len(items) - len(misses)
+        self.misses += len(misses)
+        
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                [(key, json.dumps(errors), self._stamp) for key, errors in misses.items()],
+            )
+            self._db.executemany("UPDATE results SET last_used = ? WHERE key = ?", [(self._stamp, key) for key in cached])
+            self._n_entries += len(misses)
+            self._evict()
+        return results
+
+
+def _batches(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(items)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def validate_dataset(
+    data: Dict[str, Any],
+    schema_file: str,
+    typed: bool = False,
+    cache: Optional[ValidationCache] = None,
+    classes: Optional[Dict[str, str]] = None,
+) -> List[str]:
     """
     Validate a dataset against the LinkML schema.
     
     Args:
         data: The dataset to validate.
         schema_file: Path to the LinkML schema file.
+        typed: Check the objects with the record classes generated from the schema
+            instead of the LinkML JSON Schema validator.
+        cache: Optional cache of validation results; only objects without a result are validated.
+        classes: Schema class of each collection to validate (default: `file_collection_classes()`).
         
     Returns:
         A list of validation errors, if any.
     """
     logger.info(f"Validating data against schema: {schema_file}")
     
-    # Load the schema
-    schema_view = SchemaView(schema_file)
+    # Load the schema and create the validator
+    validator, fingerprint = _get_validator(schema_file, typed)
+    if classes is None:
+        classes = file_collection_classes()
     
-    # Create the validator
-    validator = JsonSchemaValidator(schema_view)
+    return _validate_objects(
+        validator, data.get('dataset'), [(class_name, data[key]) for key, class_name in classes.items() if key in data],
+        cache=cache, fingerprint=fingerprint,
+    )
+
+
+def validate_graph(
+    kg: Any,
+    schema_file: str,
+    typed: bool = False,
+    cache: Optional[ValidationCache] = None,
+) -> List[str]:
+    """
+    Validate an in-memory knowledge graph against the LinkML schema.
     
-    # Validate each component
+    The objects are generated one at a time from the graph, so it is never
+    materialized as a whole.
+    
+    Args:
+        kg: The knowledge_graph.KnowledgeGraph to validate.
+        schema_file: Path to the LinkML schema file.
+        typed: Check the objects with the generated record classes.
+        cache: Optional cache of validation results.
+        
+    Returns:
+        A list of validation errors, if any.
+    """
+    validator, fingerprint = _get_validator(schema_file, typed)
+    classes = collection_classes(kg.term_classes)
+    collections = [(classes[key], objects) for key, objects in kg.iter_collections()]
+    return _validate_objects(validator, kg.dataset_dict(), collections, cache=cache, fingerprint=fingerprint)
+
+
+def _validate_objects(
+    validator: Any,
+    dataset: Optional[Dict[str, Any]],
+    collections: Iterable[Tuple[str, Iterable[Dict[str, Any]]]],
+    prefix: str = "",
+    cache: Optional[ValidationCache] = None,
+    fingerprint: str = "",
+    batch_size: int = 1000,
+) -> List[str]:
+    """Validate a Dataset object and the objects of (class name, objects) collections, collecting error messages."""
+    # (class name, index in its collection or None for the dataset, object)
+    items = itertools.chain(
+        [('Dataset', None, dataset)] if dataset is not None else [],
+        ((class_name, i, obj) for class_name, objects in collections for i, obj in enumerate(objects)),
+    )
     errors = []
+    for batch in _batches(items, batch_size):
+        if cache is not None:
+            results = cache.validate(validator, fingerprint, [(class_name, obj) for class_name, _, obj in batch])
+        else:
+            results = [validator.validate(obj, class_name) for class_name, _, obj in batch]
+        for (class_name, i, obj), obj_errors in zip(batch, results):
+            label = f"{prefix}Dataset" if i is None else f"{prefix}{class_name} {i} ({obj.get('id', 'unknown')})"
+            errors.extend([f"{label}: {e}" for e in obj_errors])
+    return errors
+
+
+def validate_store(
+    store_file: str,
+    schema_file: str,
+    dataset_id: Optional[str] = None,
+    typed: bool = False,
+    cache: Optional[ValidationCache] = None,
+) -> List[str]:
+    """
+    Validate the datasets of a graph store against the LinkML schema.
     
-    # Validate dataset
-    if 'dataset' in data:
-        dataset_errors = validator.validate(data['dataset'], 'Dataset')
-        errors.extend([f"Dataset: {e}" for e in dataset_errors])
-    
-    # Validate cell sets
-    if 'cell_sets' in data:
-        for i, cell_set in enumerate(data['cell_sets']):
-            cell_set_errors = validator.validate(cell_set, 'CellSet')
-            errors.extend([f"CellSet {i} ({cell_set.get('id', 'unknown')}): {e}" for e in cell_set_errors])
-    
-    # Validate cell types
-    if 'cell_types' in data:
-        for i, cell_type in enumerate(data['cell_types']):
-            cell_type_errors = validator.validate(cell_type, 'CellType')
-            errors.extend([f"CellType {i} ({cell_type.get('id', 'unknown')}): {e}" for e in cell_type_errors])
-    
-    # Validate tissues
-    if 'tissues' in data:
-        for i, tissue in enumerate(data['tissues']):
-            tissue_errors = validator.validate(tissue, 'Tissue')
-            errors.extend([f"Tissue {i} ({tissue.get('id', 'unknown')}): {e}" for e in tissue_errors])
-    
-    # Validate diseases
-    if 'diseases' in data:
-        for i, disease in enumerate(data['diseases']):
-            disease_errors = validator.validate(disease, 'Disease')
-            errors.extend([f"Disease {i} ({disease.get('id', 'unknown')}): {e}" for e in disease_errors])
-    
-    # Validate developmental stages
-    if 'developmental_stages' in data:
-        for i, dev_stage in enumerate(data['developmental_stages']):
-            dev_stage_errors = validator.validate(dev_stage, 'DevelopmentalStage')
-            errors.extend([f"DevelopmentalStage {i} ({dev_stage.get('id', 'unknown')}): {e}" for e in dev_stage_errors])
-    
-    # Validate assays
-    if 'assays' in data:
-        for i, assay in enumerate(data['assays']):
-            assay_errors = validator.validate(assay, 'Assay')
-            errors.extend([f"Assay {i} ({assay.get('id', 'unknown')}): {e}" for e in assay_errors])
+    Objects are read from the store one dataset and one batch at a time, so
+    stores larger than memory can be validated.
+    
+    Args:
+        store_file: Path to the graph store database.
+        schema_file: Path to the LinkML schema file.
+        dataset_id: Only validate this dataset (default: all datasets).
+        typed: Check the objects with the generated record classes.
+        cache: Optional cache of validation results.
+        
+    Returns:
+        A list of validation errors, if any, prefixed with the dataset ID.
+    """
+    from graph_store import GraphStore
     
+    logger.info(f"Validating {store_file} against schema: {schema_file}")
+    validator, fingerprint = _get_validator(schema_file, typed)
+    errors = []
+    with GraphStore(store_file) as store:
+        classes = collection_classes(store.term_classes())
+        for ds_id in ([dataset_id] if dataset_id is not None else store.dataset_ids()):
+            store.select(ds_id)
+            collections = [(classes[key], items) for key, items in store.iter_collections()]
+            errors.extend(_validate_objects(
+                validator, store.dataset_dict(ds_id), collections, prefix=f"[{ds_id}] ", cache=cache, fingerprint=fingerprint,
+            ))
     return errors
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Validate data against the LinkML schema")
-    parser.add_argument("data_file", help="Path to the data file (JSON or YAML)")
-    parser.add_argument("--schema", "-s", default="single_cell_schema.yaml", 
-                        help="Path to the LinkML schema file (default: single_cell_schema.yaml)")
-    parser.add_argument("--verbose", "-v", action="store_true", help="Enable verbose output")
+def validate_file(
+    data_file: str,
+    schema_file: str,
+    dataset_id: Optional[str] = None,
+    typed: bool = False,
+    cache_file: Optional[str] = None,
+    cache_size: int = DEFAULT_CACHE_SIZE,
+    metadata_config: Optional[str] = None,
+) -> List[str]:
+    """
+    Validate a JSON or YAML data file, or a graph store, against the LinkML schema.
     
-    args = parser.parse_args()
+    Args:
+        data_file: Path to the data file or graph store database.
+        schema_file: Path to the LinkML schema file.
+        dataset_id: For graph stores, only validate this dataset.
+        typed: Check the objects with the generated record classes.
+        cache_file: Optional SQLite database caching validation results across runs.
+        cache_size: Maximum number of cached results.
+        metadata_config: For data files, the metadata column mapping they were populated
+            with; graph stores record their term classes.
+        
+    Returns:
+        A list of validation errors, if any.
+    """
+    from graph_store import is_store_file
     
+    cache = ValidationCache(cache_file, cache_size) if cache_file is not None else None
+    try:
+        if is_store_file(data_file):
+            errors = validate_store(data_file, schema_file, dataset_id, typed, cache)
+        else:
+            errors = validate_dataset(
+                load_data(data_file), schema_file, typed, cache, file_collection_classes(metadata_config),
+            )
+    finally:
+        if cache is not None:
+            cache.close()
+    if cache is not None:
+        logger.info(f"Validated {cache.hits + cache.misses} objects, {cache.hits} served from cache")
+    return errors
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line options of this script to a parser."""
+    parser.add_argument("data_file", help="Path to the data file (JSON or YAML) or graph store (.sqlite/.db)")
+    parser.add_argument("--schema", "-s", default=SCHEMA_FILE,
+                        help="Path to the LinkML schema file (default: single_cell_schema.yaml next to this script)")
+    parser.add_argument("--dataset-id", default=None,
+                        help="For graph stores, only validate this dataset (default: all datasets)")
+    parser.add_argument("--metadata-config", default=None,
+                        help="For data files, the YAML metadata column mapping they were populated with, so that "
+                             "the term collections it adds are validated (default: the default mapping)")
+    parser.add_argument("--typed", action="store_true",
+                        help="Check objects with the record classes generated from the schema (records.py, which must "
+                             "have been generated from --schema) instead of "
+                             "the LinkML JSON Schema validator; much faster and needs no LinkML")
+    parser.add_argument("--cache", default=None,
+                        help="SQLite database caching validation results, so unchanged objects are not validated "
+                             "again (default: no cache)")
+    parser.add_argument("--no-cache", action="store_true", help="Validate every object without the result cache, "
+                                                                "even with --cache")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE,
+                        help=f"Maximum number of cached results; the least recently used are evicted "
+                             f"(default: {DEFAULT_CACHE_SIZE})")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Enable verbose output")
+
+
+def run(args: argparse.Namespace) -> None:
+    """Run the script with parsed command line options."""
     # Set logging level
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
@@ -136,16 +481,13 @@ def main():
         logger.error(f"Data file not found: {args.data_file}")
         sys.exit(1)
     
-    # Load the data
+    # Load and validate the data
     try:
-        data = load_data(args.data_file)
-    except Exception as e:
-        logger.error(f"Failed to load data: {e}")
-        sys.exit(1)
-    
-    # Validate the data
-    try:
-        errors = validate_dataset(data, args.schema)
+        errors = validate_file(
+            args.data_file, args.schema, args.dataset_id, args.typed,
+            cache_file=None if args.no_cache else args.cache, cache_size=args.cache_size,
+            metadata_config=args.metadata_config,
+        )
     except Exception as e:
         logger.error(f"Validation error: {e}")
         sys.exit(1)
@@ -161,5 +503,11 @@ def main():
         print("✅ Data is valid according to the schema.")
 
 
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args())
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
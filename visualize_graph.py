@@ -3,21 +3,25 @@
 Visualize the knowledge graph from single cell transcriptomics data.
 """
 
+from __future__ import annotations
+
 import argparse
 import json
 import logging
 import os
 import sys
 import yaml
-from typing import Dict, Any, List, Tuple, Optional, Set
+from collections import defaultdict
+from typing import TYPE_CHECKING, Dict, Any, Iterable, List, Tuple, Optional, Set
 
-import matplotlib.pyplot as plt
-import networkx as nx
-from matplotlib.colors import TABLEAU_COLORS
+if TYPE_CHECKING:
+    import networkx as nx
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+DESCRIPTION = "Visualize the knowledge graph from single cell transcriptomics data"
+
 # Define colors for different node types
 NODE_COLORS = {
     'CellSet': 'tab:blue',
@@ -31,6 +35,7 @@ NODE_COLORS = {
 # Define edge colors for different relationship types
 EDGE_COLORS = {
     'subset_of': 'tab:blue',
+    'overlaps_with': 'tab:gray',
     'predominantly_consists_of': 'tab:red',
     'has_tissue': 'tab:green',
     'has_disease': 'tab:purple',
@@ -39,27 +44,40 @@ EDGE_COLORS = {
 }
 
 
-def load_data(file_path: str) -> Dict[str, Any]:
+def load_data(
+    file_path: str,
+    dataset_id: Optional[str] = None,
+    obs_columns: Optional[List[str]] = None,
+    max_cell_sets: Optional[int] = None,
+) -> Dict[str, Any]:
     """
-    Load data from a JSON or YAML file.
+    Load data from a JSON or YAML file, or a subgraph from a graph store.
     
     Args:
-        file_path: Path to the data file.
+        file_path: Path to the data file or graph store database (.sqlite/.db).
+        dataset_id: For graph stores, the dataset to load (required if the store holds several).
+        obs_columns: For graph stores, only load cell sets from these obs columns.
+        max_cell_sets: For graph stores, load at most this many cell sets.
         
     Returns:
         A dictionary containing the loaded data.
     """
+    from graph_store import GraphStore, is_store_file
+    
     logger.info(f"Loading data from {file_path}")
     
     try:
-        if file_path.endswith('.json'):
+        if is_store_file(file_path):
+            with GraphStore(file_path) as store:
+                data = store.load(dataset_id, obs_columns=obs_columns, limit=max_cell_sets)
+        elif file_path.endswith('.json'):
             with open(file_path, 'r') as f:
                 data = json.load(f)
         elif file_path.endswith(('.yaml', '.yml')):
             with open(file_path, 'r') as f:
                 data = yaml.safe_load(f)
         else:
-            raise ValueError(f"Unsupported file format: {file_path}. Must be JSON or YAML.")
+            raise ValueError(f"Unsupported file format: {file_path}. Must be JSON, YAML or a graph store.")
         
         return data
     except Exception as e:
@@ -128,6 +146,8 @@ def build_graph(data: Dict[str, Any], include_metadata: bool = True, max_nodes:
     Returns:
         A NetworkX DiGraph.
     """
+    import networkx as nx
+    
     logger.info("Building graph")
     
     G = nx.DiGraph()
@@ -158,6 +178,10 @@ def build_graph(data: Dict[str, Any], include_metadata: bool = True, max_nodes:
                 for parent_id in cs['subset_of']:
                     G.add_edge(cs['id'], parent_id, type='subset_of')
             
+            # Add overlap relationships
+            for overlap in cs.get('overlaps_with', []):
+                G.add_edge(cs['id'], overlap['cell_set'], type='overlaps_with', jaccard=overlap['jaccard'])
+            
             # Add cell type relationships
             if 'predominantly_consists_of' in cs:
                 ct_id = cs['predominantly_consists_of']
@@ -218,18 +242,165 @@ def build_graph(data: Dict[str, Any], include_metadata: bool = True, max_nodes:
     return G
 
 
-def visualize_graph(G: nx.DiGraph, output_file: str, title: str = "Single Cell Transcriptomics Knowledge Graph"):
+# An edge: (source, target, edge type, attributes)
+Edge = Tuple[str, str, str, Dict[str, Any]]
+
+
+class AdjacencyIndex:
+    """
+    Edges of a loaded graph by node ID, in both directions.
+    
+    Offers the same `edges_of` and `nodes` lookups as `graph_store.GraphStore`,
+    whose database indexes serve as the adjacency index for store files.
+    
+    Args:
+        data: The loaded data.
+    """
+    
+    def __init__(self, data: Dict[str, Any]):
+        self._edges: Dict[str, List[Edge]] = defaultdict(list)
+        self._nodes: Dict[str, Dict[str, Any]] = {}
+        for key, items in data.items():
+            if key != 'cell_sets' and isinstance(items, list):
+                for term in items:
+                    self._nodes[term['id']] = term
+        for cs in data.get('cell_sets', []):
+            self._nodes[cs['id']] = cs
+            for parent_id in cs.get('subset_of', []):
+                self._add((cs['id'], parent_id, 'subset_of', {}))
+            for overlap in cs.get('overlaps_with', []):
+                self._add((cs['id'], overlap['cell_set'], 'overlaps_with', {'jaccard': overlap['jaccard']}))
+            if 'predominantly_consists_of' in cs:
+                self._add((cs['id'], cs['predominantly_consists_of'], 'predominantly_consists_of', {}))
+            for slot, value in cs.items():
+                if slot.startswith('has_'):
+                    for assoc in value:
+                        self._add((cs['id'], assoc['term'], slot, {'count': assoc['count']}))
+    
+    def _add(self, edge: Edge) -> None:
+        self._edges[edge[0]].append(edge)
+        self._edges[edge[1]].append(edge)
+    
+    def edges_of(self, node_ids: Iterable[str], include_metadata: bool = True) -> List[Edge]:
+        """Get the edges touching some nodes, in either direction."""
+        return [
+            edge for node_id in node_ids for edge in self._edges.get(node_id, ())
+            if include_metadata or not edge[2].startswith('has_')
+        ]
+    
+    def nodes(self, node_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Get the objects of some nodes, by ID."""
+        return {node_id: self._nodes[node_id] for node_id in node_ids if node_id in self._nodes}
+
+
+def build_ego_graph(
+    index: Any,
+    seeds: List[str],
+    radius: int = 1,
+    include_metadata: bool = True,
+    max_nodes: Optional[int] = None,
+    **edge_filters: Any,
+) -> nx.DiGraph:
+    """
+    Build the graph of the nodes within `radius` hops of some seed nodes.
+    
+    The neighborhood is expanded one hop at a time by looking up the edges of
+    the frontier in an adjacency index, so the cost is proportional to the size
+    of the neighborhood rather than of the whole graph.
+    
+    Args:
+        index: An `AdjacencyIndex` or `graph_store.GraphStore`.
+        seeds: IDs of the seed cell sets and/or terms.
+        radius: Number of hops from the seeds.
+        include_metadata: Whether to follow metadata (has_*) edges.
+        max_nodes: Maximum number of nodes to include in the graph.
+        **edge_filters: Further keyword arguments of `index.edges_of` and
+            `index.nodes` restricting the cell sets (e.g. dataset_id, obs_columns).
+        
+    Returns:
+        A NetworkX DiGraph with the same node and edge attributes as `build_graph`.
+    """
+    import networkx as nx
+    
+    logger.info(f"Building the {radius}-hop neighborhood of {len(seeds)} seed nodes")
+    
+    known = index.nodes(seeds, **edge_filters)
+    missing = [seed for seed in seeds if seed not in known]
+    if missing:
+        selection = f" in the selected cell sets ({', '.join(f'{k}={v}' for k, v in edge_filters.items() if v)})" \
+            if any(edge_filters.values()) else ""
+        raise ValueError(f"Seed nodes not found{selection}: {', '.join(missing)}")
+    
+    G = nx.DiGraph()
+    G.add_nodes_from(seeds)
+    frontier = list(seeds)
+    for _ in range(radius):
+        if not frontier or (max_nodes is not None and G.number_of_nodes() >= max_nodes):
+            break
+        next_frontier = []
+        for source, target, edge_type, attrs in index.edges_of(frontier, include_metadata=include_metadata, **edge_filters):
+            for node_id in (source, target):
+                if node_id not in G:
+                    if max_nodes is not None and G.number_of_nodes() >= max_nodes:
+                        break
+                    G.add_node(node_id)
+                    next_frontier.append(node_id)
+            if source in G and target in G:
+                G.add_edge(source, target, type=edge_type, **attrs)
+        frontier = next_frontier
+    
+    # Node attributes, as in build_graph
+    objects = index.nodes(list(G.nodes))
+    for node_id in G.nodes:
+        obj = objects.get(node_id, {'id': node_id})
+        node_type = get_node_type(node_id)
+        G.nodes[node_id]['type'] = 'CellSet' if obj.get('term_class') == 'CellSet' else node_type
+        G.nodes[node_id]['label'] = get_short_label(node_id, obj)
+        if 'cell_count' in obj:
+            G.nodes[node_id]['count'] = obj['cell_count']
+    
+    logger.info(f"Built graph with {G.number_of_nodes()} nodes and {G.number_of_edges()} edges")
+    
+    return G
+
+
+# Largest number of edges drawn with arrowheads; arrowheads are one patch per
+# edge, while plain edges are drawn as a single line collection
+MAX_ARROW_EDGES = 500
+
+
+def visualize_graph(
+    G: nx.DiGraph,
+    output_file: str,
+    title: str = "Single Cell Transcriptomics Knowledge Graph",
+    dpi: int = 300,
+    arrows: Optional[bool] = None,
+):
     """
     Visualize the graph.
     
+    The figure is drawn on the non-interactive Agg canvas without pyplot, so no
+    global figure state is kept and the figure is freed once saved. Nodes and
+    edges are bucketed by type in one pass and drawn as one collection each.
+    
     Args:
         G: The NetworkX graph to visualize.
         output_file: Path to the output file.
         title: Title for the plot.
+        dpi: Resolution of the output image.
+        arrows: Whether to draw arrowheads (default: for graphs with at most
+            MAX_ARROW_EDGES edges).
     """
+    import networkx as nx
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from matplotlib.lines import Line2D
+    
     logger.info(f"Visualizing graph to {output_file}")
     
-    plt.figure(figsize=(16, 12))
+    fig = Figure(figsize=(16, 12))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
     
     # Use different layouts based on graph size
     if G.number_of_nodes() < 50:
@@ -237,37 +408,43 @@ def visualize_graph(G: nx.DiGraph, output_file: str, title: str = "Single Cell T
     else:
         pos = nx.kamada_kawai_layout(G)
     
-    # Draw nodes by type
-    for node_type, color in NODE_COLORS.items():
-        nodes = [n for n, attrs in G.nodes(data=True) if attrs.get('type') == node_type]
-        
-        if nodes:
-            # Scale node sizes based on count if available
-            sizes = [300 + min(3000, G.nodes[n].get('count', 0)) for n in nodes]
-            
-            nx.draw_networkx_nodes(
-                G, pos,
-                nodelist=nodes,
-                node_color=color,
-                node_size=sizes,
-                alpha=0.8,
-                label=node_type
-            )
-    
-    # Draw edges by type
-    for edge_type, color in EDGE_COLORS.items():
-        edges = [(u, v) for u, v, attrs in G.edges(data=True) if attrs.get('type') == edge_type]
-        
-        if edges:
-            nx.draw_networkx_edges(
-                G, pos,
-                edgelist=edges,
-                edge_color=color,
-                width=1.5,
-                alpha=0.6,
-                arrowsize=15,
-                label=edge_type
-            )
+    # Bucket nodes and edges by type
+    nodes_by_type = defaultdict(list)
+    for n, attrs in G.nodes(data=True):
+        if attrs.get('type') in NODE_COLORS:
+            nodes_by_type[attrs['type']].append(n)
+    edges_by_type = defaultdict(list)
+    for u, v, attrs in G.edges(data=True):
+        if attrs.get('type') in EDGE_COLORS:
+            edges_by_type[attrs['type']].append((u, v))
+    
+    # Draw nodes, in the order of their types, scaling sizes by count if available
+    node_types = [t for t in NODE_COLORS if t in nodes_by_type]
+    nodelist = [n for t in node_types for n in nodes_by_type[t]]
+    if nodelist:
+        nx.draw_networkx_nodes(
+            G, pos,
+            nodelist=nodelist,
+            node_color=[NODE_COLORS[t] for t in node_types for _ in nodes_by_type[t]],
+            node_size=[300 + min(3000, G.nodes[n].get('count', 0)) for n in nodelist],
+            alpha=0.8,
+            ax=ax,
+        )
+    
+    # Draw edges
+    edge_types = [t for t in EDGE_COLORS if t in edges_by_type]
+    edgelist = [e for t in edge_types for e in edges_by_type[t]]
+    if edgelist:
+        nx.draw_networkx_edges(
+            G, pos,
+            edgelist=edgelist,
+            edge_color=[EDGE_COLORS[t] for t in edge_types for _ in edges_by_type[t]],
+            width=1.5,
+            alpha=0.6,
+            arrows=len(edgelist) <= MAX_ARROW_EDGES if arrows is None else arrows,
+            arrowsize=15,
+            ax=ax,
+        )
     
     # Draw labels
     labels = {}
@@ -280,21 +457,32 @@ def visualize_graph(G: nx.DiGraph, output_file: str, title: str = "Single Cell T
             # Use node ID as fallback
             labels[n] = n.split(':')[-1]
     
-    nx.draw_networkx_labels(G, pos, labels=labels, font_size=8, font_weight='bold')
+    nx.draw_networkx_labels(G, pos, labels=labels, font_size=8, font_weight='bold', ax=ax)
     
-    plt.title(title, fontsize=16)
-    plt.axis('off')
-    plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-    plt.tight_layout()
+    # Legend entries for the node and edge types present
+    handles = [
+        Line2D([], [], linestyle='', marker='o', markersize=10, color=NODE_COLORS[t], alpha=0.8, label=t)
+        for t in node_types
+    ] + [
+        Line2D([], [], color=EDGE_COLORS[t], linewidth=1.5, alpha=0.6, label=t)
+        for t in edge_types
+    ]
     
-    # Save the figure
-    plt.savefig(output_file, dpi=300, bbox_inches='tight')
+    ax.set_title(title, fontsize=16)
+    ax.axis('off')
+    if handles:
+        ax.legend(handles=handles, bbox_to_anchor=(1.05, 1), loc='upper left')
+    fig.tight_layout()
+    
+    # Save the figure and release it
+    fig.savefig(output_file, dpi=dpi, bbox_inches='tight')
+    fig.clear()
     logger.info(f"Saved visualization to {output_file}")
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Visualize the knowledge graph from single cell transcriptomics data")
-    parser.add_argument("data_file", help="Path to the data file (JSON or YAML)")
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the command line options of this script to a parser."""
+    parser.add_argument("data_file", help="Path to the data file (JSON or YAML) or graph store (.sqlite/.db)")
     parser.add_argument("--output", "-o", default="knowledge_graph.png", 
                         help="Path to the output image file (default: knowledge_graph.png)")
     parser.add_argument("--title", "-t", default="Single Cell Transcriptomics Knowledge Graph",
@@ -303,10 +491,37 @@ def main():
                         help="Do not include metadata nodes (tissues, diseases, etc.)")
     parser.add_argument("--max-nodes", type=int, default=None,
                         help="Maximum number of nodes to include in the graph")
+    parser.add_argument("--dataset-id", default=None,
+                        help="For graph stores, the dataset to visualize (required if the store holds several)")
+    parser.add_argument("--obs-columns", nargs="+", default=None,
+                        help="For graph stores, only load cell sets from these obs columns")
+    parser.add_argument("--seed", nargs="+", default=None,
+                        help="Only render the neighborhood of these cell set or term IDs")
+    parser.add_argument("--radius", type=int, default=1,
+                        help="With --seed, number of hops from the seed nodes (default: 1)")
     parser.add_argument("--verbose", "-v", action="store_true", help="Enable verbose output")
+
+
+def _load_ego_graph(args: argparse.Namespace) -> nx.DiGraph:
+    """Build the neighborhood of the seed nodes, querying graph stores in place."""
+    from graph_store import GraphStore, is_store_file
     
-    args = parser.parse_args()
-    
+    try:
+        if is_store_file(args.data_file):
+            with GraphStore(args.data_file) as store:
+                return build_ego_graph(
+                    store, args.seed, args.radius, include_metadata=not args.no_metadata,
+                    max_nodes=args.max_nodes, dataset_id=args.dataset_id, obs_columns=args.obs_columns,
+                )
+        index = AdjacencyIndex(load_data(args.data_file))
+        return build_ego_graph(index, args.seed, args.radius, include_metadata=not args.no_metadata, max_nodes=args.max_nodes)
+    except Exception as e:
+        logger.error(f"Failed to build graph: {e}")
+        sys.exit(1)
+
+
+def run(args: argparse.Namespace) -> None:
+    """Run the script with parsed command line options."""
     # Set logging level
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
@@ -316,19 +531,23 @@ def main():
         logger.error(f"Data file not found: {args.data_file}")
         sys.exit(1)
     
-    # Load the data
-    try:
-        data = load_data(args.data_file)
-    except Exception as e:
-        logger.error(f"Failed to load data: {e}")
-        sys.exit(1)
-    
-    # Build the graph
-    try:
-        G = build_graph(data, include_metadata=not args.no_metadata, max_nodes=args.max_nodes)
-    except Exception as e:
-        logger.error(f"Failed to build graph: {e}")
-        sys.exit(1)
+    # Build the neighborhood of the seed nodes, or the graph of the loaded data
+    if args.seed:
+        G = _load_ego_graph(args)
+    else:
+        # Load the data
+        try:
+            data = load_data(args.data_file, args.dataset_id, args.obs_columns, max_cell_sets=args.max_nodes)
+        except Exception as e:
+            logger.error(f"Failed to load data: {e}")
+            sys.exit(1)
+        
+        # Build the graph
+        try:
+            G = build_graph(data, include_metadata=not args.no_metadata, max_nodes=args.max_nodes)
+        except Exception as e:
+            logger.error(f"Failed to build graph: {e}")
+            sys.exit(1)
     
     # Visualize the graph
     try:
@@ -340,5 +559,11 @@ def main():
     print(f"✅ Knowledge graph visualization saved to {args.output}")
 
 
+def main():
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+    add_arguments(parser)
+    run(parser.parse_args())
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file